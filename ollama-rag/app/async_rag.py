@@ -0,0 +1,318 @@
+# async_rag.py
+# ChromaRAG의 async 버전
+#
+# ChromaRAG는 requests(blocking)로 ollama를 호출하기 때문에 FastAPI의 sync 핸들러(def)에서 쓰면
+# 답변 생성이 끝날 때까지 스레드풀 스레드 하나를 잡고 있음 (기본 40개 --> 동시 /ask 40개가 한계).
+# 여기서는
+#   - 앱 전체에서 httpx.AsyncClient 하나를 같이 씀 (keep-alive 연결 재사용, 연결 개수 제한, 타임아웃 설정)
+#   - ollama 호출(임베딩/생성)은 await 하므로 기다리는 동안 스레드를 잡지 않음
+#   - 크로마/sqlite 캐시(로컬, 짧게 끝남)만 스레드에서 실행 (asyncio.to_thread)
+# --> 동시에 처리할 수 있는 /ask 개수는 스레드풀이 아니라 ollama(와 max_connections)가 정함.
+#
+# scheduler(scheduler.GenerationScheduler)를 주면 임베딩/생성마다 모델의 slot을 받아서 호출
+#   - /ask의 질문 임베딩이 /ingest의 임베딩보다 먼저 (우선순위는 요청 경로로 정해짐)
+#   - 적재 파이프라인 스레드에서 부르는 embed_many도 이벤트 루프로 넘겨서 같은 대기열(적재 우선순위)을 탐
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from chroma_db import ChromaRAG
+from metrics import observe_ttft, ollama_call, record_ollama_usage
+from scheduler import PRIORITY_BATCH, GenerationScheduler
+
+# ollama가 마지막 줄(done)에 주는 시간/토큰 정보 (duration은 나노초)
+OLLAMA_TIMING_FIELDS = ("done_reason", "total_duration", "load_duration", "prompt_eval_count",
+                        "prompt_eval_duration", "eval_count", "eval_duration")
+
+
+def _timed(timings: Optional[Dict[str, float]], stage: str, t0: Optional[float]) -> None:
+    # t0가 None이면 횟수(1)만 더함
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (1.0 if t0 is None else time.perf_counter() - t0)
+
+
+class AsyncChromaRAG(ChromaRAG):
+    def __init__(self, *args,
+                 max_connections: int = 64,
+                 max_keepalive_connections: int = 16,
+                 keepalive_expiry: float = 60.0,
+                 connect_timeout: float = 5.0,
+                 embed_timeout: float = 120.0,
+                 generate_timeout: float = 300.0,
+                 scheduler: Optional[GenerationScheduler] = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # 임베딩은 짧게, 생성은 길게 (연결 자체는 connect_timeout 안에 안 되면 바로 실패)
+        self.embed_timeout = httpx.Timeout(embed_timeout, connect=connect_timeout)
+        self.generate_timeout = httpx.Timeout(generate_timeout, connect=connect_timeout)
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    ###############
+    # 공유 http 클라이언트
+    # 이벤트 루프에 묶여 있으므로 처음 쓸 때(루프 안에서) 만듦.
+    # (테스트처럼 루프가 바뀌면 새로 만듦)
+    @property
+    def http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http.is_closed or self._http_loop is not loop:
+            self._http = httpx.AsyncClient(base_url=self.ollama_base_url, limits=self.limits,
+                                           timeout=self.embed_timeout)
+            self._http_loop = loop
+        return self._http
+
+    # 앱 종료(shutdown) 때 호출 --> keep-alive 연결 정리
+    async def aclose(self) -> None:
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._http = None
+        self._http_loop = None
+
+    # scheduler가 없으면 아무것도 안 함
+    def _slot(self, model: str, level: Optional[int] = None):
+        return self.scheduler.slot(model, level) if self.scheduler is not None else nullcontext()
+
+    ###############
+    # 임베딩 / 생성
+    async def aembed(self, text: str) -> List[float]:
+        return (await self.aembed_many([text]))[0]
+
+    # embed_many와 같음 (캐시에 없는 것만 ollama에 요청)
+    async def aembed_many(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        if not texts:
+            return []
+        if self.embed_cache is None:
+            return await self._arequest_embeddings(texts, batch_size)
+
+        vectors = await asyncio.to_thread(self.embed_cache.get_many, self.embed_model, texts)
+        miss_idx = [i for i, v in enumerate(vectors) if v is None]
+        if miss_idx:
+            miss_texts = list(dict.fromkeys(texts[i] for i in miss_idx))
+            new_vectors = await self._arequest_embeddings(miss_texts, batch_size)
+            await asyncio.to_thread(self.embed_cache.put_many, self.embed_model, miss_texts, new_vectors)
+            by_text = dict(zip(miss_texts, new_vectors))
+            for i in miss_idx:
+                vectors[i] = by_text[texts[i]]
+        return vectors
+
+    async def _arequest_embeddings(self, texts: List[str], batch_size: Optional[int] = None,
+                                   level: Optional[int] = None) -> List[List[float]]:
+        batch_size = max(1, batch_size or self.embed_batch_size)
+        # 묶음이 많아도 대기열을 혼자 다 채우지 않게 slot 수만큼만 동시에 줄을 섬
+        gate = asyncio.Semaphore(self.scheduler.slots_for(self.embed_model)) if self.scheduler else nullcontext()
+
+        async def one(batch: List[str]) -> List[List[float]]:
+            async with gate, self._slot(self.embed_model, level):
+                with ollama_call('embed', self.embed_model):
+                    resp = await self.http.post('/api/embed', json={'model': self.embed_model, 'input': batch},
+                                                timeout=self.embed_timeout)
+                    resp.raise_for_status()
+            embs = resp.json()['embeddings']
+            if len(embs) != len(batch):
+                raise ValueError(f"embedding 개수 불일치: 요청 {len(batch)}개, 응답 {len(embs)}개")
+            self._count_embed_request(len(batch))
+            return embs
+
+        # 묶음들을 동시에 보냄 (연결 개수는 limits가 제한)
+        batches = [texts[s:s + batch_size] for s in range(0, len(texts), batch_size)]
+        results = await asyncio.gather(*(one(b) for b in batches))
+        return [v for embs in results for v in embs]
+
+    # 적재 파이프라인(스레드)에서 부르는 동기 임베딩 : scheduler가 있으면 이벤트 루프에서 적재 우선순위로 실행
+    def _request_embeddings(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        loop = self.scheduler.loop if self.scheduler is not None else None
+        if loop is None or loop.is_closed():
+            return super()._request_embeddings(texts, batch_size)
+        try:
+            asyncio.get_running_loop()
+            return super()._request_embeddings(texts, batch_size)  # 루프 안에서 부름 (루프를 막고 기다릴 수 없음)
+        except RuntimeError:
+            pass
+        future = asyncio.run_coroutine_threadsafe(
+            self._arequest_embeddings(texts, batch_size, level=PRIORITY_BATCH), loop)
+        return future.result()
+
+    async def agenerate(self, prompt: str) -> str:
+        async with self._slot(self.gen_model):
+            with ollama_call('generate', self.gen_model):
+                r = await self.http.post('/api/generate', json=self._generate_payload(prompt),
+                                         timeout=self.generate_timeout)
+                r.raise_for_status()
+        data = r.json()
+        record_ollama_usage(self.gen_model, data)
+        return data['response']
+
+    # /api/generate를 stream=True로 호출해서 ollama가 보내는 줄(json) 하나하나를 내보냄
+    # {"response": "글자조각", "done": false} ... 마지막 줄은 {"done": true, "eval_count": ..., ...}
+    async def agenerate_stream(self, prompt: str) -> AsyncIterator[Dict[str, Any]]:
+        payload = {**self._generate_payload(prompt), "stream": True}
+        t0 = time.perf_counter()
+        first = True
+        async with self._slot(self.gen_model):
+            with ollama_call('generate_stream', self.gen_model):
+                async with self.http.stream('POST', '/api/generate', json=payload,
+                                            timeout=self.generate_timeout) as r:
+                    r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if not line.strip():
+                            continue
+                        part = json.loads(line)
+                        if "error" in part:
+                            raise RuntimeError(part["error"])
+                        if first and part.get("response"):
+                            first = False
+                            observe_ttft(self.gen_model, time.perf_counter() - t0)
+                        if part.get("done"):
+                            record_ollama_usage(self.gen_model, part)
+                        yield part
+
+    ###############
+    # 검색 / 적재 / 질문
+    async def aquery_docs(self, question: str, top_k: int = 10,
+                          where: Optional[Dict[str, Any]] = None) -> List[str]:
+        return [h["text"] for h in await self.aquery_hits(question, top_k, where=where)]
+
+    # timings : dict를 주면 단계별 걸린 시간(초)을 더해 넣음
+    #   embed(질문 임베딩), vector_search, keyword_search, fuse, rerank, generate, query_cache_hit(캐시면 1)
+    #   (벤치마크 bench_rag.py, /metrics에서 씀)
+    async def aquery_hits(self, question: str, top_k: int = 10,
+                          where: Optional[Dict[str, Any]] = None,
+                          timings: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+        key, cached = self._cached_query(question, top_k, where)
+        if cached is not None:
+            _timed(timings, "query_cache_hit", None)
+            return cached
+
+        n, scope = await asyncio.to_thread(self._scope, where)
+        hits: List[Dict[str, Any]] = []
+
+        async def dense(k: int) -> List[Dict[str, Any]]:
+            t = time.perf_counter()
+            q_emb = await self.aembed(question)
+            _timed(timings, "embed", t)
+            t = time.perf_counter()
+            out = await asyncio.to_thread(self._search, q_emb, k, n, where)
+            _timed(timings, "vector_search", t)
+            return out
+
+        async def keyword(k: int) -> List[Tuple[str, float]]:
+            t = time.perf_counter()
+            out = await asyncio.to_thread(self.keyword_index.search, question, k, scope)
+            _timed(timings, "keyword_search", t)
+            return out
+
+        if n > 0 and self.keyword_index is None:
+            hits = await dense(top_k)
+        elif n > 0:
+            # 키워드 검색과 (임베딩 --> 벡터 검색)을 동시에
+            cand = self._candidates(top_k, n)
+            dense_hits, kw = await asyncio.gather(dense(cand), keyword(cand))
+            t = time.perf_counter()
+            hits = await asyncio.to_thread(self._fuse, dense_hits, [_id for _id, _ in kw], top_k)
+            _timed(timings, "fuse", t)
+        self._store_query(key, hits)
+        return hits
+
+    async def aretrieve(self, question: str, top_k: int = 10,
+                        where: Optional[Dict[str, Any]] = None) -> List[str]:
+        return [h["text"] for h in await self.aretrieve_hits(question, top_k, where=where)]
+
+    async def aretrieve_hits(self, question: str, top_k: int = 10,
+                             where: Optional[Dict[str, Any]] = None,
+                             timings: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+        if self.reranker is None:
+            return await self.aquery_hits(question, top_k=top_k, where=where, timings=timings)
+        hits = await self.aquery_hits(question, top_k=max(top_k, self.rerank_candidates), where=where,
+                                      timings=timings)
+        # 모델 계산(CPU)은 스레드에서
+        t = time.perf_counter()
+        out = await asyncio.to_thread(self._rerank, question, hits, top_k)
+        _timed(timings, "rerank", t)
+        return out
+
+    async def aingest_texts(self, texts: List[str], source: str = 'manual') -> int:
+        if not texts:
+            return 0
+        ids, docs, metadatas = await asyncio.to_thread(self._new_texts, texts, source)
+        if not ids:
+            return 0
+        embs = await self.aembed_many(docs)
+
+        def write() -> None:
+            bs = self.embed_batch_size
+            for s in range(0, len(ids), bs):
+                self._write_chunks(ids=ids[s:s + bs], docs=docs[s:s + bs],
+                                   embeddings=embs[s:s + bs], metadatas=metadatas[s:s + bs])
+
+        await asyncio.to_thread(write)
+        return len(ids)
+
+    async def aask(self, question: str, top_k: int = 10,
+                   where: Optional[Dict[str, Any]] = None,
+                   timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        rag_mode, q = self.parse_question(question)
+        if rag_mode:
+            hits = await self.aretrieve_hits(q, top_k=top_k, where=where, timings=timings)
+            if not hits:
+                return self.no_docs_answer()
+            prompt, context = self.rag_prompt(q, hits)
+            t = time.perf_counter()
+            answer = (await self.agenerate(prompt)).strip()
+            _timed(timings, "generate", t)
+            return {"answer": answer, "chroma-db": [h["text"] for h in hits], "mode": "RAG (Chroma DB 검색)",
+                    "context": context}
+
+        t = time.perf_counter()
+        answer = (await self.agenerate(question)).strip()
+        _timed(timings, "generate", t)
+        return {"answer": answer, "chroma-db": None, "mode": "일반 생성 (gemma3)"}
+
+    # 스트리밍 ask : (이벤트 이름, 데이터)를 차례로 내보냄 (main.py의 /ask_stream이 SSE로 보냄)
+    #   retrieved : 검색이 끝나자마자 (청크 id, source, filename, page, score) --> 화면에 근거를 먼저 보여줄 수 있음
+    #   token     : ollama가 만드는 글자 조각들
+    #   summary   : 끝나면 ollama 시간 정보(나노초) + 첫 토큰까지 걸린 시간(ttft_ms)
+    async def aask_stream(self, question: str, top_k: int = 10,
+                          where: Optional[Dict[str, Any]] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        t0 = time.perf_counter()
+        rag_mode, q = self.parse_question(question)
+        if rag_mode:
+            hits = await self.aretrieve_hits(q, top_k=top_k, where=where)
+            retrieve_ms = round((time.perf_counter() - t0) * 1000, 1)
+            if not hits:
+                yield "retrieved", {"mode": "RAG (문서 없음)", "chunks": [], "retrieve_ms": retrieve_ms}
+                yield "token", {"text": self.no_docs_answer()["answer"]}
+                yield "summary", {"total_ms": round((time.perf_counter() - t0) * 1000, 1)}
+                return
+            prompt, context = self.rag_prompt(q, hits)
+            yield "retrieved", {"mode": "RAG (Chroma DB 검색)", "chunks": [self.hit_info(h) for h in hits],
+                                "retrieve_ms": retrieve_ms, "context": context}
+        else:
+            yield "retrieved", {"mode": "일반 생성 (gemma3)", "chunks": [], "retrieve_ms": 0.0}
+            prompt = question
+
+        first_token = None
+        async for part in self.agenerate_stream(prompt):
+            if part.get("response"):
+                if first_token is None:
+                    first_token = time.perf_counter()
+                yield "token", {"text": part["response"]}
+            if part.get("done"):
+                summary = {k: part[k] for k in OLLAMA_TIMING_FIELDS if k in part}
+                if part.get("eval_count") and part.get("eval_duration"):
+                    summary["tokens_per_sec"] = round(part["eval_count"] / part["eval_duration"] * 1e9, 2)
+                if first_token is not None:
+                    summary["ttft_ms"] = round((first_token - t0) * 1000, 1)
+                summary["total_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                yield "summary", summary
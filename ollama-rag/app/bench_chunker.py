@@ -0,0 +1,83 @@
+# bench_chunker.py
+# 청커 마이크로 벤치마크 : 예전 글자 수 청커(ChromaRAG.chunk_text) vs 문장/토큰 청커(chunker.py)
+#
+# 사용법 (app 폴더에서)
+#   python bench_chunker.py                      # ../pdf 폴더의 pdf/txt를 이어붙여서 약 4MB로 만들어 측정
+#   python bench_chunker.py --mb 16 --repeat 5
+#
+# 출력 : 속도(MB/s), 청크 수, 청크당 평균/최대 토큰, 문장 중간에서 잘린 청크 비율
+from __future__ import annotations
+
+import argparse
+import re
+import statistics
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from chroma_db import ChromaRAG
+from chunker import estimate_tokens, iter_sentence_chunks
+
+# 청크 끝이 문장 끝(. ! ? 등)이 아니면 문장 중간에서 잘린 것으로 봄
+_SENT_END = re.compile(r"[.!?。！？…][\"'”’)\]]*$")
+
+
+def load_corpus(pdf_dir: Path, target_mb: float) -> str:
+    parts: List[str] = []
+    for path in sorted(pdf_dir.iterdir()):
+        if path.suffix.lower() == ".pdf":
+            parts.append(ChromaRAG.pdf_to_text(str(path)))
+        elif path.suffix.lower() == ".txt":
+            parts.append(path.read_text(encoding="utf-8", errors="ignore"))
+    base = "\n\n".join(p for p in parts if p.strip())
+    if not base:
+        raise SystemExit(f"텍스트를 찾을 수 없습니다: {pdf_dir}")
+    target = int(target_mb * 1024 * 1024)
+    size = len(base.encode("utf-8"))
+    return "\n\n".join([base] * max(1, target // size))
+
+
+def run(name: str, fn: Callable[[str], List[str]], text: str, repeat: int) -> None:
+    times = []
+    chunks: List[str] = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        chunks = fn(text)
+        times.append(time.perf_counter() - t0)
+
+    mb = len(text.encode("utf-8")) / 1024 / 1024
+    best = min(times)
+    tokens = [estimate_tokens(c) for c in chunks]
+    cut = sum(1 for c in chunks[:-1] if not _SENT_END.search(c))
+    print(f"[{name}]")
+    print(f"  time      : best {best * 1000:.1f}ms, median {statistics.median(times) * 1000:.1f}ms ({mb / best:.1f} MB/s)")
+    print(f"  chunks    : {len(chunks)}")
+    print(f"  tokens    : avg {statistics.mean(tokens):.0f}, max {max(tokens)}")
+    print(f"  mid-sentence cuts : {cut} ({cut / max(1, len(chunks) - 1) * 100:.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunker micro-benchmark")
+    parser.add_argument("--pdf_dir", default="../pdf", help="Folder with fixture PDF/TXT files")
+    parser.add_argument("--mb", type=float, default=4, help="Corpus size in MB (fixtures are repeated)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max_chars", type=int, default=1200)
+    parser.add_argument("--overlap_chars", type=int, default=150)
+    parser.add_argument("--max_tokens", type=int, default=512)
+    parser.add_argument("--overlap_tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    text = load_corpus(Path(args.pdf_dir), args.mb)
+    print(f"corpus: {len(text.encode('utf-8')) / 1024 / 1024:.1f} MB, {len(text):,} chars\n")
+
+    run(f"chars max_chars={args.max_chars} overlap={args.overlap_chars}",
+        lambda t: ChromaRAG.chunk_text(t, max_chars=args.max_chars, overlap_chars=args.overlap_chars),
+        text, args.repeat)
+    run(f"sentence max_tokens={args.max_tokens} overlap={args.overlap_tokens}",
+        lambda t: [c for c, _, _ in iter_sentence_chunks([(1, t)], max_tokens=args.max_tokens,
+                                                         overlap_tokens=args.overlap_tokens)],
+        text, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
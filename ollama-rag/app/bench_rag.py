@@ -0,0 +1,223 @@
+# bench_rag.py
+# RAG 전체(end-to-end) 벤치마크 : 적재 속도 + 질문 단계별 지연(p50/p95/p99) + 검색 recall@k
+#
+# chunk_text / top_k / 임베딩 경로를 바꿨을 때 /ask가 빨라졌는지 느려졌는지 커밋끼리 비교하려고 만듦.
+#   1) ../pdf 폴더의 PDF/TXT를 새 컬렉션(임시 폴더)에 적재 --> chunks/s, 임베딩 호출 수
+#   2) 질문 목록(../pdf/bench_questions.json)을 concurrency개씩 동시에 rounds번 보냄 (AsyncChromaRAG.aask)
+#      --> 단계별(embed, vector_search, keyword_search, fuse, rerank, generate, total) p50/p95/p99
+#   3) 정답 문자열(answers)이 들어있는 청크가 검색 결과 top_k 안에 있는지 --> recall@k, MRR
+#   4) --json으로 결과 저장 (git 커밋 id 포함) --> 여러 커밋의 결과 파일을 비교
+#
+# 사용법 (app 폴더에서)
+#   python bench_rag.py --fake                               # 가짜 ollama(fake_ollama.py)를 같이 띄워서 오프라인으로
+#   python bench_rag.py --fake --fake_ttft_ms 300 --fake_tps 30 --concurrency 1,8,32 --json before.json
+#   python bench_rag.py --ollama http://localhost:11434       # 진짜 ollama로
+#
+# 질문 파일 : [{"question": "...", "answers": ["청크에 들어있어야 하는 문자열", ...]}, ...]
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from async_rag import AsyncChromaRAG
+from bench_vector_store import percentile
+from chroma_db import ChromaRAG
+from vector_store import VECTOR_STORES
+
+STAGES = ("embed", "vector_search", "keyword_search", "fuse", "rerank", "generate", "total")
+
+
+###############
+# 가짜 ollama를 이 프로세스 안(스레드)에서 띄움
+def start_fake_ollama(args: argparse.Namespace) -> str:
+    import uvicorn
+    from fake_ollama import FakeConfig, create_app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    config = FakeConfig(ttft_ms=args.fake_ttft_ms, tps=args.fake_tps, max_parallel=args.fake_parallel,
+                        models=[args.embed_model, args.gen_model])
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    ms = [v * 1000 for v in values]
+    return {"count": len(ms), "mean_ms": round(statistics.mean(ms), 2), "p50_ms": round(percentile(ms, 50), 2),
+            "p95_ms": round(percentile(ms, 95), 2), "p99_ms": round(percentile(ms, 99), 2)}
+
+
+###############
+# 1) 적재
+def ingest(rag: ChromaRAG, pdf_dir: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    files = sorted(p for p in pdf_dir.iterdir() if p.suffix.lower() in (".pdf", ".txt"))
+    calls0 = rag.embed_requests
+    chunks = 0
+    t0 = time.perf_counter()
+    for path in files:
+        pieces = (rag.iter_pdf_pages(str(path)) if path.suffix.lower() == ".pdf"
+                  else [(1, path.read_text(encoding="utf-8", errors="ignore"))])
+        result = rag.ingest_stream(pieces, source="bench", meta_extra={"filename": path.name},
+                                   chunker=args.chunker, max_tokens=args.max_tokens,
+                                   max_chars=args.max_chars, overlap_chars=args.overlap_chars)
+        chunks += result["chunks"]
+    seconds = time.perf_counter() - t0
+    return {"files": len(files), "chunks": chunks, "seconds": round(seconds, 3),
+            "chunks_per_sec": round(chunks / max(seconds, 1e-9), 2), "embed_requests": rag.embed_requests - calls0}
+
+
+###############
+# 2) 질문 보내기 + 3) recall
+def relevant_rank(texts: List[str], answers: List[str]) -> Optional[int]:
+    for rank, text in enumerate(texts, 1):
+        if any(a in text for a in answers):
+            return rank
+    return None
+
+
+async def run_level(rag: AsyncChromaRAG, questions: List[Dict[str, Any]], concurrency: int,
+                    rounds: int, top_k: int) -> Dict[str, Any]:
+    jobs = [q for _ in range(rounds) for q in questions]
+    sem = asyncio.Semaphore(concurrency)
+    stages: Dict[str, List[float]] = {s: [] for s in STAGES}
+    ranks: List[Optional[int]] = []
+    errors: List[str] = []
+
+    async def one(i: int, item: Dict[str, Any]) -> None:
+        async with sem:
+            timings: Dict[str, float] = {}
+            q = item["question"]
+            t0 = time.perf_counter()
+            try:
+                # "Google"로 시작해야 RAG 모드 (ChromaRAG.parse_question)
+                out = await rag.aask(q if q.lower().startswith("google") else "Google " + q,
+                                     top_k=top_k, timings=timings)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                return
+            timings["total"] = time.perf_counter() - t0
+            for stage, sec in timings.items():
+                if stage in stages:
+                    stages[stage].append(sec)
+            if i < len(questions):  # recall은 첫 번째 round만 (질문마다 한 번)
+                ranks.append(relevant_rank(out.get("chroma-db") or [], item.get("answers", [])))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i, item) for i, item in enumerate(jobs)))
+    seconds = time.perf_counter() - t0
+
+    found = [r for r in ranks if r is not None]
+    return {
+        "concurrency": concurrency,
+        "requests": len(jobs),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "seconds": round(seconds, 3),
+        "requests_per_sec": round((len(jobs) - len(errors)) / max(seconds, 1e-9), 2),
+        "stages": {s: summarize(v) for s, v in stages.items() if v},
+        f"recall@{top_k}": round(len(found) / len(ranks), 4) if ranks else None,
+        "mrr": round(sum(1 / r for r in found) / len(ranks), 4) if ranks else None,
+    }
+
+
+def print_level(res: Dict[str, Any], top_k: int) -> None:
+    print(f"\n[concurrency {res['concurrency']}] {res['requests']} requests, {res['errors']} errors, "
+          f"{res['requests_per_sec']} req/s, recall@{top_k} {res[f'recall@{top_k}']}, MRR {res['mrr']}")
+    for stage, s in res["stages"].items():
+        print(f"  {stage:15s} p50 {s['p50_ms']:9.2f}ms  p95 {s['p95_ms']:9.2f}ms  p99 {s['p99_ms']:9.2f}ms")
+
+
+async def run_queries(rag: AsyncChromaRAG, questions: List[Dict[str, Any]],
+                      args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    try:
+        for c in [int(x) for x in args.concurrency.split(",") if x.strip()]:
+            res = await run_level(rag, questions, c, args.rounds, args.top_k)
+            print_level(res, args.top_k)
+            results.append(res)
+    finally:
+        await rag.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end RAG benchmark (ingest + ask latency + recall)")
+    parser.add_argument("--pdf_dir", default="../pdf", help="Folder with fixture PDF/TXT files")
+    parser.add_argument("--questions", default="../pdf/bench_questions.json", help="Labeled question set (JSON)")
+    parser.add_argument("--concurrency", default="1,8", help="Comma separated concurrency levels")
+    parser.add_argument("--rounds", type=int, default=3, help="How many times the question set is replayed")
+    parser.add_argument("--top_k", type=int, default=4)
+    parser.add_argument("--chunker", default="sentence", choices=list(ChromaRAG.CHUNKERS))
+    parser.add_argument("--max_tokens", type=int, default=512)
+    parser.add_argument("--max_chars", type=int, default=1200)
+    parser.add_argument("--overlap_chars", type=int, default=150)
+    parser.add_argument("--vector_store", default="chroma", choices=list(VECTOR_STORES))
+    parser.add_argument("--no_hybrid", action="store_true", help="Vector search only (no BM25)")
+    parser.add_argument("--query_cache", action="store_true", help="Keep the query result cache on")
+    parser.add_argument("--embed_cache", action="store_true", help="Keep the embedding cache on")
+    parser.add_argument("--ollama", default="http://localhost:11434", help="Ollama base url")
+    parser.add_argument("--embed_model", default="nomic-embed-text")
+    parser.add_argument("--gen_model", default="gemma3:1b")
+    parser.add_argument("--fake", action="store_true", help="Run an in-process fake Ollama (fake_ollama.py)")
+    parser.add_argument("--fake_ttft_ms", type=float, default=200.0)
+    parser.add_argument("--fake_tps", type=float, default=40.0)
+    parser.add_argument("--fake_parallel", type=int, default=4)
+    parser.add_argument("--chroma_dir", default=None, help="Where to build the collection (default: temp dir)")
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    base_url = start_fake_ollama(args) if args.fake else args.ollama
+    chroma_dir = args.chroma_dir or tempfile.mkdtemp(prefix="bench_rag_")
+    try:
+        rag = AsyncChromaRAG(
+            chroma_dir=chroma_dir,
+            ollama_base_url=base_url,
+            embed_model=args.embed_model,
+            gen_model=args.gen_model,
+            chunker=args.chunker,
+            use_embed_cache=args.embed_cache,
+            query_cache_size=1024 if args.query_cache else 0,
+            hybrid=not args.no_hybrid,
+            vector_store=args.vector_store,
+        )
+        ing = ingest(rag, Path(args.pdf_dir), args)
+        print(f"ingest: {ing['files']} files, {ing['chunks']} chunks in {ing['seconds']}s "
+              f"({ing['chunks_per_sec']} chunks/s, {ing['embed_requests']} embed requests)")
+        runs = asyncio.run(run_queries(rag, questions, args))
+    finally:
+        if not args.chroma_dir:
+            shutil.rmtree(chroma_dir, ignore_errors=True)
+
+    if args.json:
+        config = {k: v for k, v in vars(args).items() if k != "json"}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "created_at": time.time(), "ollama": base_url if not args.fake else "fake",
+                       "config": config, "ingest": ing, "runs": runs}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
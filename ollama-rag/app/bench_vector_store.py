@@ -0,0 +1,169 @@
+# bench_vector_store.py
+# 벡터 저장소 벤치마크 : 크로마(HNSW, 근사 검색) vs flat_store(mmap 행렬, 정확한 검색)
+#
+# 사용법 (app 폴더에서)
+#   python bench_vector_store.py                                # 1만 / 10만 / 100만 청크, 768차원
+#   python bench_vector_store.py --sizes 10000,100000 --dim 384 --dtypes float16,int8
+#   python bench_vector_store.py --sizes 1000000 --skip_chroma --json result.json
+#
+# 데이터 : 임베딩처럼 몇 개의 중심(cluster) 주변에 모인 단위 벡터 (seed로 항상 같은 값)
+# 출력   : 적재 시간, 여는 시간(open + 첫 질문), 질문 하나의 p50/p95 지연, recall@k(float32 정확한 결과 기준)
+# 주의   : 크로마 100만 개 적재는 오래 걸림 (수십 분). 디스크도 수 GB 필요.
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from flat_store import DTYPES, FlatVectorStore
+
+_BLOCK = 20000  # 데이터를 몇 개씩 만들어서 넣을지
+
+
+def make_block(start: int, n: int, dim: int, seed: int, centers: np.ndarray) -> np.ndarray:
+    rng = np.random.default_rng([seed, start])
+    x = centers[rng.integers(0, len(centers), n)] + rng.normal(0.0, 0.6 / np.sqrt(dim), (n, dim)).astype(np.float32)
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def iter_blocks(size: int, dim: int, seed: int, centers: np.ndarray) -> Iterator[Tuple[int, np.ndarray]]:
+    for start in range(0, size, _BLOCK):
+        yield start, make_block(start, min(_BLOCK, size - start), dim, seed, centers)
+
+
+def ground_truth(size: int, dim: int, seed: int, centers: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # float32 전체 계산으로 정확한 top-k (블록마다 top-k만 남겨서 메모리 절약)
+    best_d = np.full((len(queries), 0), np.inf, dtype=np.float32)
+    best_i = np.zeros((len(queries), 0), dtype=np.int64)
+    q_norm = np.einsum('ij,ij->i', queries, queries)[:, None]
+    for start, x in iter_blocks(size, dim, seed, centers):
+        d = np.einsum('ij,ij->i', x, x)[None, :] - 2.0 * (queries @ x.T) + q_norm
+        best_d = np.concatenate([best_d, d], axis=1)
+        best_i = np.concatenate([best_i, np.broadcast_to(np.arange(start, start + len(x)), d.shape)], axis=1)
+        keep = np.argsort(best_d, axis=1, kind="stable")[:, :k]
+        best_d = np.take_along_axis(best_d, keep, axis=1)
+        best_i = np.take_along_axis(best_i, keep, axis=1)
+    return best_i
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(name: str, fill: Callable[[], Any], reopen: Callable[[], Any], queries: np.ndarray,
+        truth: np.ndarray, k: int) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    fill()
+    load_s = time.perf_counter() - t0
+
+    # 새로 여는 시간 = 서버가 시작해서 첫 질문에 답할 때까지 (크로마는 첫 질문 때 HNSW 색인을 읽음)
+    t0 = time.perf_counter()
+    store = reopen()
+    store.query(query_embeddings=[queries[0].tolist()], n_results=k, include=[])
+    open_ms = (time.perf_counter() - t0) * 1000
+
+    times: List[float] = []
+    recall: List[float] = []
+    for q, gt in zip(queries, truth):
+        t0 = time.perf_counter()
+        res = store.query(query_embeddings=[q.tolist()], n_results=k, include=[])
+        times.append((time.perf_counter() - t0) * 1000)
+        got = {int(i) for i in res["ids"][0]}
+        recall.append(len(got & {int(i) for i in gt}) / len(gt))
+
+    out = {"store": name, "load_s": round(load_s, 2), "open_ms": round(open_ms, 1),
+           "p50_ms": round(statistics.median(times), 2), "p95_ms": round(percentile(times, 95), 2),
+           f"recall@{k}": round(statistics.mean(recall), 4)}
+    print(f"  [{name}] load {out['load_s']}s, open+first query {out['open_ms']}ms, "
+          f"p50 {out['p50_ms']}ms, p95 {out['p95_ms']}ms, recall@{k} {out[f'recall@{k}']}")
+    return out
+
+
+def bench_size(size: int, args: argparse.Namespace, work_dir: str) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(0.0, 1.0, (args.clusters, args.dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    # 질문 : 저장된 벡터 근처(잡음 추가)
+    picks = rng.integers(0, size, args.queries)
+    queries = np.stack([make_block((p // _BLOCK) * _BLOCK, min(_BLOCK, size - (p // _BLOCK) * _BLOCK),
+                                   args.dim, args.seed, centers)[p % _BLOCK] for p in picks])
+    queries = queries + rng.normal(0.0, 0.1 / np.sqrt(args.dim), queries.shape).astype(np.float32)
+    truth = ground_truth(size, args.dim, args.seed, centers, queries, args.k)
+
+    results: List[Dict[str, Any]] = []
+    for dtype in args.dtypes:
+        path = os.path.join(work_dir, f"flat_{dtype}_{size}")
+
+        def fill_flat(path: str = path, dtype: str = dtype) -> None:
+            store = FlatVectorStore(path, dtype=dtype)
+            for start, x in iter_blocks(size, args.dim, args.seed, centers):
+                store.upsert(ids=[str(i) for i in range(start, start + len(x))], embeddings=x)
+            store.close()
+
+        results.append(run(f"flat {dtype}", fill_flat, lambda path=path: FlatVectorStore(path),
+                           queries, truth, args.k))
+
+    if not args.skip_chroma:
+        import chromadb
+        path = os.path.join(work_dir, f"chroma_{size}")
+
+        def fill_chroma() -> None:
+            col = chromadb.PersistentClient(path=path).get_or_create_collection(name="bench")
+            for start, x in iter_blocks(size, args.dim, args.seed, centers):
+                # 크로마 한 번 upsert 최대 개수 제한이 있어서 나눠 넣음
+                for s in range(0, len(x), 5000):
+                    ids = [str(i) for i in range(start + s, start + min(len(x), s + 5000))]
+                    col.upsert(ids=ids, embeddings=x[s:s + 5000].tolist())
+
+        def reopen_chroma():
+            # 같은 프로세스 안의 크로마 캐시를 비워야 실제로 다시 읽음
+            chromadb.api.client.SharedSystemClient.clear_system_cache()
+            return chromadb.PersistentClient(path=path).get_collection(name="bench")
+
+        results.append(run("chroma hnsw", fill_chroma, reopen_chroma, queries, truth, args.k))
+
+    for r in results:
+        r["size"] = size
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector store benchmark (chroma vs flat mmap)")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma separated chunk counts")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension (nomic-embed-text = 768)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--dtypes", default="float16,int8", help=f"Flat store dtypes ({', '.join(DTYPES)})")
+    parser.add_argument("--skip_chroma", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work_dir", default=None, help="Where to build the stores (default: temp dir, removed)")
+    parser.add_argument("--json", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+    args.dtypes = [d.strip() for d in args.dtypes.split(",") if d.strip()]
+
+    work_dir: Optional[str] = args.work_dir or tempfile.mkdtemp(prefix="bench_vs_")
+    results: List[Dict[str, Any]] = []
+    try:
+        for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            print(f"size {size:,} x {args.dim}")
+            results.extend(bench_size(size, args, work_dir))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"dim": args.dim, "k": args.k, "queries": args.queries, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# bm25_index.py
+# 키워드(BM25) 검색용 역색인 (inverted index)
+#
+# 벡터 검색(임베딩)은 뜻이 비슷한 문장은 잘 찾지만 제품 코드, 이름, 숫자처럼
+# "글자가 정확히 같아야 하는" 질문은 자주 놓침. 그래서 키워드 검색을 같이 돌리고
+# 두 결과를 RRF(reciprocal rank fusion)로 합침 (ChromaRAG.query_docs).
+#
+# - 토큰 : 영어/숫자는 단어 그대로(AB-1234 같은 코드는 통째로 + 나눠서),
+#          한글(그 외 글자)은 2글자씩(bigram) --> 형태소 분석기 없이도 "삼성전자의"로 "삼성전자"를 찾음
+# - 저장 : sqlite (청크 id, 길이, 토큰별 개수). 시작할 때 메모리로 읽어서 검색은 메모리에서만 함.
+# - 검색 : 토큰별 posting을 numpy 배열로 만들어 두고(바뀐 토큰만 다시 만듦) 점수를 한 번에 더함
+#          --> 청크 10만 개에서도 질문 하나에 수 ms
+from __future__ import annotations
+
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# 영어/숫자 단어(코드는 -_. 로 이어진 것까지), 또는 영어/숫자가 아닌 글자들(한글, 한자 등)
+_TOKEN = re.compile(r"[0-9a-z]+(?:[-_.][0-9a-z]+)*|[^\W0-9a-z_]+")
+_SPLIT = re.compile(r"[-_.]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for m in _TOKEN.finditer(text.lower()):
+        word = m.group()
+        if word.isascii():
+            tokens.append(word)
+            if len(word) > 1 and _SPLIT.search(word):
+                tokens.extend(p for p in _SPLIT.split(word) if p)
+        elif len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " id TEXT PRIMARY KEY,"
+            " length INTEGER NOT NULL,"
+            " terms TEXT NOT NULL)"  # {"토큰": 개수} json
+        )
+        self._conn.commit()
+        self._load()
+
+    ###############
+    # 메모리 구조
+    #   _slot : 청크 id --> 번호(slot),  _ids : 번호 --> 청크 id (삭제되면 None)
+    #   _postings : 토큰 --> {번호: 개수}
+    #   _arrays : 토큰 --> (번호 배열, 개수 배열)  검색할 때 만들어 두고, 토큰이 바뀌면 지움
+    def _load(self) -> None:
+        self._slot: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._lengths = np.zeros(1024, dtype=np.float32)
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._total_len = 0
+        for _id, length, terms in self._conn.execute("SELECT id, length, terms FROM docs"):
+            self._add_mem(_id, length, json.loads(terms))
+        # 다른 프로세스가 sqlite를 바꿨는지 확인하는 값
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _add_mem(self, _id: str, length: int, terms: Dict[str, int]) -> None:
+        slot = len(self._ids)
+        self._ids.append(_id)
+        self._slot[_id] = slot
+        if slot >= len(self._lengths):
+            self._lengths = np.concatenate([self._lengths, np.zeros(len(self._lengths), dtype=np.float32)])
+        self._lengths[slot] = length
+        self._total_len += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[slot] = tf
+            self._arrays.pop(term, None)
+
+    def _remove_mem(self, _id: str, terms: Dict[str, int]) -> None:
+        slot = self._slot.pop(_id)
+        self._ids[slot] = None
+        self._total_len -= int(self._lengths[slot])
+        self._lengths[slot] = 0
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(slot, None)
+                if not posting:
+                    del self._postings[term]
+            self._arrays.pop(term, None)
+
+    def _refresh(self) -> None:
+        # 다른 프로세스(uvicorn worker, CLI)가 적재했으면 다시 읽음
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._load()
+
+    ###############
+    # 추가 / 삭제 (같은 id가 이미 있으면 덮어씀)
+    def add(self, ids: List[str], docs: List[str]) -> None:
+        rows = []
+        for _id, doc in zip(ids, docs):
+            tokens = tokenize(doc)
+            rows.append((_id, len(tokens), Counter(tokens)))
+        with self._lock:
+            self._refresh()
+            old = self._terms_of([r[0] for r in rows if r[0] in self._slot])
+            for _id, terms in old.items():
+                self._remove_mem(_id, terms)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docs (id, length, terms) VALUES (?, ?, ?)",
+                [(_id, length, json.dumps(terms, ensure_ascii=False)) for _id, length, terms in rows],
+            )
+            self._conn.commit()
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            for _id, length, terms in rows:
+                self._add_mem(_id, length, terms)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._refresh()
+            old = self._terms_of([_id for _id in ids if _id in self._slot])
+            if not old:
+                return
+            self._conn.executemany("DELETE FROM docs WHERE id = ?", [(_id,) for _id in old])
+            self._conn.commit()
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            for _id, terms in old.items():
+                self._remove_mem(_id, terms)
+
+    def _terms_of(self, ids: List[str]) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            q = "SELECT id, terms FROM docs WHERE id IN (%s)" % ",".join("?" * len(part))
+            for _id, terms in self._conn.execute(q, part):
+                out[_id] = json.loads(terms)
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._slot)
+
+    ###############
+    # 검색 : (청크 id, 점수)를 점수 높은 순으로 top_k개
+    # ids를 주면 그 청크들 중에서만 찾음 (메타데이터 필터로 범위를 좁힌 검색)
+    def search(self, query: str, top_k: int = 10, ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        terms = Counter(tokenize(query))
+        with self._lock:
+            self._refresh()
+            n_docs = len(self._slot)
+            if n_docs == 0 or not terms:
+                return []
+            avgdl = self._total_len / n_docs or 1.0
+            n_slots = len(self._ids)
+            lengths = self._lengths[:n_slots]
+            norm = self.k1 * (1 - self.b + self.b * lengths / avgdl)
+            scores = np.zeros(n_slots, dtype=np.float32)
+            for term, qtf in terms.items():
+                arr = self._posting_array(term)
+                if arr is None:
+                    continue
+                slots, tfs = arr
+                idf = math.log(1 + (n_docs - len(slots) + 0.5) / (len(slots) + 0.5))
+                scores[slots] += qtf * idf * tfs * (self.k1 + 1) / (tfs + norm[slots])
+
+            if ids is None:
+                hit = np.flatnonzero(scores > 0)
+            else:
+                allowed = np.fromiter((self._slot[_id] for _id in ids if _id in self._slot), dtype=np.int64)
+                hit = allowed[scores[allowed] > 0]
+            if len(hit) > top_k:
+                hit = hit[np.argpartition(-scores[hit], top_k - 1)[:top_k]]
+            hit = hit[np.argsort(-scores[hit], kind="stable")]
+            return [(self._ids[s], float(scores[s])) for s in hit]
+
+    def _posting_array(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        arr = self._arrays.get(term)
+        if arr is None:
+            posting = self._postings.get(term)
+            if not posting:
+                return None
+            arr = (np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                   np.fromiter(posting.values(), dtype=np.float32, count=len(posting)))
+            self._arrays[term] = arr
+        return arr
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# 여러 검색 결과(id 순위 목록)를 RRF로 합침 : 점수 = Σ 1 / (k + 순위)
+# --> [(id, 점수)] 점수 높은 순
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, _id in enumerate(ranking, 1):
+            scores[_id] = scores.get(_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
@@ -0,0 +1,192 @@
+# bulk_ingest.py
+# 폴더 안의 PDF/TXT 파일을 한꺼번에 적재하는 CLI
+#
+# rag_cli_min.py는 파일 하나 적재 + 질문 하나라서, 문서 수천 개면 수천 번 실행해야 하고
+# 그때마다 ChromaRAG(크로마 연결, 캐시, 색인)를 새로 만듦.
+# 여기서는
+#   - ChromaRAG 하나를 만들어서 같이 씀
+#   - 파일 workers개를 동시에 처리 (파일마다 추출 --> 청킹 --> 임베딩 --> 저장 파이프라인, ingest_stream)
+#   - 파일 하나가 끝날 때마다 체크포인트(json)에 기록 --> 중간에 멈춰도 다시 실행하면 끝난 파일은 건너뜀
+#     (파일 크기/수정 시각이 바뀐 파일은 다시 적재. 실패한 파일은 다음 실행 때 다시 시도)
+#   - 진행 상황(몇 번째 파일, files/s, chunks/s)과 마지막에 요약(임베딩 호출 수 포함)을 출력
+#
+# 사용법 (app 폴더에서)
+#   python bulk_ingest.py --dir ../pdf
+#   python bulk_ingest.py --dir /data/archive --workers 8 --source archive --json report.json
+#   python bulk_ingest.py --reembed   (이미 적재된 청크를 지금의 /api/embed로 다시 임베딩, 예전 /api/embeddings 컬렉션용)
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List
+
+from chroma_db import ChromaRAG
+from vector_store import VECTOR_STORES
+
+SUFFIXES = ('.pdf', '.txt')
+
+
+def find_files(root: Path) -> List[Path]:
+    return sorted(p for p in root.rglob('*') if p.is_file() and p.suffix.lower() in SUFFIXES)
+
+
+class Checkpoint:
+    """
+    끝난 파일 기록 (json) : {"files": {상대경로: {"size", "mtime_ns", "chunks", "added", ...}}, "failed": {...}}
+    파일 하나가 끝날 때마다 임시 파일에 쓰고 바꿔치기 --> 중간에 죽어도 깨지지 않음
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data: Dict[str, Any] = {"files": {}, "failed": {}}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+            self.data.setdefault("files", {})
+            self.data.setdefault("failed", {})
+
+    def is_done(self, key: str, stat: os.stat_result) -> bool:
+        entry = self.data["files"].get(key)
+        return entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+    def mark_done(self, key: str, stat: os.stat_result, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self.data["failed"].pop(key, None)
+            self.data["files"][key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "done_at": time.time(),
+                                       **{k: result[k] for k in ("chunks", "added", "deleted", "pages", "seconds")}}
+            self._save()
+
+    def mark_failed(self, key: str, error: str) -> None:
+        with self._lock:
+            self.data["failed"][key] = {"error": error, "at": time.time()}
+            self._save()
+
+    def _save(self) -> None:
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def ingest_file(rag: ChromaRAG, path: Path, key: str, source: str, args: argparse.Namespace) -> Dict[str, Any]:
+    if path.suffix.lower() == '.pdf':
+        pieces = rag.iter_pdf_pages(str(path), workers=args.pdf_workers)
+    else:
+        pieces = [(1, path.read_text(encoding='utf-8', errors='ignore'))]
+    return rag.ingest_stream(pieces, source=source, meta_extra={"filename": key},
+                             batch_size=args.batch_size, embed_workers=args.embed_workers,
+                             chunker=args.chunker, max_tokens=args.max_tokens)
+
+
+def run(rag: ChromaRAG, root: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.chroma_dir, 'bulk_ingest.checkpoint.json'))
+    files = find_files(root)
+    todo = []
+    for path in files:
+        key = path.relative_to(root).as_posix()
+        stat = path.stat()
+        if not checkpoint.is_done(key, stat):
+            todo.append((path, key, stat))
+    skipped = len(files) - len(todo)
+    print(f"{len(files)} files in {root} ({skipped} already done, {len(todo)} to ingest)")
+
+    calls0 = (rag.embed_requests, rag.embedded_texts)
+    totals = {"files": 0, "failed": 0, "chunks": 0, "added": 0, "deleted": 0, "pages": 0}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix='ingest') as pool:
+        futures = {pool.submit(ingest_file, rag, path, key, args.source, args): (key, stat)
+                   for path, key, stat in todo}
+        for i, fut in enumerate(as_completed(futures), 1):
+            key, stat = futures[fut]
+            try:
+                result = fut.result()
+            except Exception as e:
+                totals["failed"] += 1
+                checkpoint.mark_failed(key, f"{type(e).__name__}: {e}")
+                print(f"[{i}/{len(todo)}] FAILED {key}: {e}")
+                continue
+            checkpoint.mark_done(key, stat, result)
+            totals["files"] += 1
+            for k in ("chunks", "added", "deleted", "pages"):
+                totals[k] += result[k]
+            elapsed = max(time.perf_counter() - t0, 1e-9)
+            print(f"[{i}/{len(todo)}] {key}: {result['chunks']} chunks ({result['added']} new) "
+                  f"in {result['seconds']:.1f}s | {totals['files'] / elapsed:.2f} files/s, "
+                  f"{totals['chunks'] / elapsed:.1f} chunks/s")
+
+    seconds = time.perf_counter() - t0
+    return {
+        **totals,
+        "skipped": skipped,
+        "seconds": round(seconds, 3),
+        "files_per_sec": round(totals["files"] / max(seconds, 1e-9), 3),
+        "chunks_per_sec": round(totals["chunks"] / max(seconds, 1e-9), 2),
+        "embed_requests": rag.embed_requests - calls0[0],
+        "embedded_texts": rag.embedded_texts - calls0[1],
+        "total_docs": rag.count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk ingest a directory of PDF/TXT files (resumable)")
+    parser.add_argument("--dir", default=None, help="Folder to ingest (searched recursively)")
+    parser.add_argument("--reembed", action="store_true",
+                        help="Re-embed every chunk already in the collection instead of ingesting a folder")
+    parser.add_argument("--source", default="bulk", help="Metadata source for all files (filename = relative path)")
+    parser.add_argument("--workers", type=int, default=4, help="Files processed at the same time")
+    parser.add_argument("--embed_workers", type=int, default=2, help="Concurrent embedding requests per file")
+    parser.add_argument("--pdf_workers", type=int, default=1, help="PDF extraction processes per file")
+    parser.add_argument("--batch_size", type=int, default=32, help="Chunks per embedding request / store write")
+    parser.add_argument("--chunker", default="sentence", choices=list(ChromaRAG.CHUNKERS), help="Chunking strategy")
+    parser.add_argument("--max_tokens", type=int, default=512, help="Approx. tokens per chunk (sentence chunker)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file (default: <chroma_dir>/bulk_ingest.checkpoint.json)")
+    parser.add_argument("--chroma_dir", default="./chroma_data", help="Chroma persist directory")
+    parser.add_argument("--collection", default="rag_docs", help="Chroma collection name")
+    parser.add_argument("--ollama", default="http://localhost:11434", help="Ollama base url")
+    parser.add_argument("--embed_model", default="nomic-embed-text", help="Ollama embedding model")
+    parser.add_argument("--vector_store", default="chroma", choices=list(VECTOR_STORES), help="Vector store backend")
+    parser.add_argument("--json", default=None, help="Write the final report to this JSON file")
+    args = parser.parse_args()
+    if not args.dir and not args.reembed:
+        parser.error("--dir 또는 --reembed 중 하나가 필요합니다")
+
+    rag = ChromaRAG(
+        chroma_dir=args.chroma_dir,
+        collection_name=args.collection,
+        ollama_base_url=args.ollama,
+        embed_model=args.embed_model,
+        embed_batch_size=args.batch_size,
+        chunker=args.chunker,
+        vector_store=args.vector_store,
+    )
+    if args.reembed:
+        t0 = time.perf_counter()
+        n = rag.reembed_all(args.batch_size)
+        print(f"re-embedded {n} chunks in {time.perf_counter() - t0:.1f}s ({rag.embed_model}, /api/embed)")
+        return
+
+    root = Path(args.dir)
+    if not root.is_dir():
+        raise SystemExit(f"폴더를 찾을 수 없습니다: {root}")
+    report = run(rag, root, args)
+
+    print("\n=== bulk ingest report ===")
+    print(f"  files    : {report['files']} ingested, {report['skipped']} skipped (checkpoint), {report['failed']} failed")
+    print(f"  chunks   : {report['chunks']} ({report['added']} new, {report['deleted']} deleted), {report['pages']} pages")
+    print(f"  time     : {report['seconds']:.1f}s, {report['files_per_sec']} files/s, {report['chunks_per_sec']} chunks/s")
+    print(f"  embedding: {report['embed_requests']} requests, {report['embedded_texts']} texts embedded")
+    print(f"  total    : {report['total_docs']} chunks in collection")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,36 @@
 # chroma_db.py
 from __future__ import annotations
 
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
 import uuid
-from typing import List, Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Any, Callable, Iterable, Iterator, Tuple, Union
 
 import requests
-import chromadb
 from prompt_toolkit.renderer import print_formatted_text
 
-import fitz  # PyMuPDF
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from chunker import iter_sentence_chunks
+from context_pack import pack_context
+from embed_cache import EmbeddingCache
+from ingest_pipeline import run_ingest_pipeline
+from metrics import chroma_call, ollama_call, record_ollama_usage
+from pdf_extract import PdfSource, iter_pdf_pages
+from reranker import Reranker
+from result_cache import ResultCache
+from snapshot import export_collection, import_collection
+from source_index import SourceIndex
+from vector_store import open_vector_store
 
 
 class ChromaRAG:
+    CHUNKERS = ('sentence', 'chars')
+
     ###############
     # 1. 설정부분.
     # ollama설정
@@ -24,24 +43,99 @@ class ChromaRAG:
                  collection_name: str = 'rag_docs',
                  ollama_base_url: str = 'http://localhost:11434',
                  embed_model: str = 'nomic-embed-text',
-                 gen_model: str = 'gemma3:1b'):
+                 gen_model: str = 'gemma3:1b',
+                 embed_batch_size: int = 32,
+                 embed_cache_path: Optional[str] = None,
+                 embed_cache_size: int = 100_000,
+                 use_embed_cache: bool = True,
+                 chunker: str = 'sentence',
+                 query_cache_size: int = 1024,
+                 hybrid: bool = True,
+                 rrf_k: int = 60,
+                 reranker: Optional[Reranker] = None,
+                 rerank_candidates: int = 30,
+                 rerank_top_n: int = 4,
+                 context_tokens: int = 1500,
+                 vector_store: str = 'chroma',
+                 flat_dtype: str = 'float16'):
 
         # Ollama 설정
         self.ollama_base_url = ollama_base_url
+        # 요청마다 새로 연결하지 않도록 Session으로 keep-alive 연결을 재사용함.
+        self.session = requests.Session()
         self.embed_model = embed_model
         self.gen_model = gen_model
+        # 한 번의 /api/embed 요청에 넣을 청크 개수 (= 크로마 add 한 번에 넣는 개수)
+        self.embed_batch_size = max(1, embed_batch_size)
+        # ollama /api/embed 호출 횟수와 실제로 임베딩한 텍스트 수 (캐시 hit는 안 셈)
+        self.embed_requests = 0
+        self.embedded_texts = 0
+        self._stats_lock = threading.Lock()
+        # 청크 나누는 방식 : 'sentence'(문장/토큰 기준, chunker.py) 또는 'chars'(글자 수 기준, chunk_text)
+        if chunker not in self.CHUNKERS:
+            raise ValueError(f"chunker는 {self.CHUNKERS} 중 하나여야 합니다: {chunker}")
+        self.chunker = chunker
+        # 임베딩 캐시 : 같은 텍스트(같은 모델)는 ollama에 다시 요청하지 않음.
+        # 경로를 안 주면 chroma_dir 안에 embed_cache.sqlite3로 만듦.
+        self.embed_cache: Optional[EmbeddingCache] = None
+        if use_embed_cache:
+            os.makedirs(chroma_dir, exist_ok=True)
+            self.embed_cache = EmbeddingCache(
+                path=embed_cache_path or os.path.join(chroma_dir, 'embed_cache.sqlite3'),
+                max_entries=embed_cache_size,
+            )
 
         # chroma설정
         # 폴더만든 것에 chroma db연결함.
         # --> chroma_data
         # collection(table, 폴더)를 생성함.
         # --> rag_docs
-        self.client = chromadb.PersistentClient(path=chroma_dir)
-        self.collection = self.client.get_or_create_collection(name=collection_name)  # rag_docs
-        self.collection2 = self.client.get_or_create_collection(name=collection_name + str(2))  # rag_docs2
+        self.chroma_dir = chroma_dir
+        self.collection_name = collection_name
+        self.manifest_dir = os.path.join(chroma_dir, 'manifests')
+        # vector_store='flat'이면 크로마 대신 mmap 행렬 저장소(flat_store.py) 사용 (vector_store.py)
+        self.vector_store = vector_store
+        self.client, self.collection = open_vector_store(vector_store, chroma_dir, collection_name,
+                                                         flat_dtype=flat_dtype)  # rag_docs
+
+        # 검색 결과 캐시 : (정규화한 질문, top_k, 컬렉션 버전) --> 검색된 문서들
+        # 컬렉션 버전은 적재/삭제할 때마다 바뀌므로 예전 결과가 나갈 일이 없음.
+        # 버전은 파일(chroma_data/rag_docs.version)에 저장 --> 다른 프로세스(uvicorn worker)가 적재해도 알 수 있음.
+        self._version_path = os.path.join(chroma_dir, collection_name + '.version')
+        self._version_lock = threading.Lock()
+        self.query_cache: Optional[ResultCache] = ResultCache(query_cache_size) if query_cache_size > 0 else None
+        self.collection2 = None
+        if self.client is not None:
+            self.collection2 = self.client.get_or_create_collection(name=collection_name + str(2))  # rag_docs2
+
+        # 하이브리드 검색 : 벡터 검색 + 키워드(BM25) 검색을 동시에 돌려서 RRF로 합침 (bm25_index.py)
+        # 키워드 색인은 chroma_data/rag_docs.bm25.sqlite3 에 저장되고, 컬렉션에 쓸 때마다 같이 갱신됨.
+        self.rrf_k = rrf_k
+        self.keyword_index: Optional[BM25Index] = None
+        if hybrid:
+            self.keyword_index = BM25Index(os.path.join(chroma_dir, collection_name + '.bm25.sqlite3'))
+            self._keyword_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='bm25')
+            # 색인이 없던 시절에 적재한 데이터가 있으면 한 번 만들어 줌
+            if len(self.keyword_index) != self.count():
+                self.rebuild_keyword_index()
+
+        # 문서(source + filename)별 청크 개수 색인 --> /sources 목록을 컬렉션을 훑지 않고 바로 만듦 (source_index.py)
+        self.source_index = SourceIndex(os.path.join(chroma_dir, collection_name + '.sources.sqlite3'))
+        if len(self.source_index) != self.count():
+            self.rebuild_source_index()
+
+        # 재순위(rerank) : 검색은 rerank_candidates개를 넉넉히 가져오고,
+        # reranker(cross-encoder, CPU)가 점수를 다시 매겨서 rerank_top_n개만 프롬프트에 넣음 (reranker.py)
+        self.reranker = reranker
+        self.rerank_candidates = max(1, rerank_candidates)
+        self.rerank_top_n = max(1, rerank_top_n)
+
+        # 프롬프트 CONTEXT에 넣을 최대 토큰 수 (대략, chunker.estimate_tokens 기준)
+        # gemma3:1b는 ollama 기본 num_ctx가 2048이므로 질문/지시문/답변 자리를 빼고 1500 정도
+        self.context_tokens = max(1, context_tokens)
 
     def __str__(self):
-        return str(self.client) + " " + self.embed_model + " " + self.gen_model + " " + str(
+        return str(self.client or self.collection) + " " + self.embed_model + " " + self.gen_model + " " + str(
             self.collection) + " " + str(self.collection2)
 
     ###############
@@ -49,18 +143,73 @@ class ChromaRAG:
 
     # 임베딩 embed
 
+    # 질문(ingest/query 모두)도 embed_many와 같은 /api/embed를 쓰도록 함.
+    # --> 적재된 벡터와 질문 벡터가 같은 방식(정규화)으로 만들어지고, 캐시도 같이 씀.
+    # 주의) 예전 /api/embeddings로 만든 컬렉션(저장소에 들어있는 chroma_data 포함)은 벡터가 정규화되지 않아서
+    #       질문 벡터와 거리 계산이 맞지 않음 --> reembed_all()로 다시 임베딩하거나 컬렉션을 지우고 다시 적재해야 함.
+    #       (python bulk_ingest.py --reembed)
     def embed(self, text: str) -> List[float]:  # 리턴타입!!
-        # ollama에 주소로 임베딩해달라고 요청합시다.
-        url = self.ollama_base_url + '/api/embeddings'
-        resp = requests.post(url, json={'model': self.embed_model, 'prompt': text}, timeout=120)
-        # print(resp.json())  # dict형태로 만들어서 프린트.
-        data = resp.json()  # {"embedding" : [0.1232, 0.234324]}
-        return data['embedding']
+        return self.embed_many([text])[0]
+
+    # 여러 개를 한 번에 임베딩 embed_many
+    # /api/embed는 input에 리스트를 받으므로 batch_size개씩 묶어서 요청함.
+    # --> 청크 1000개면 http요청 1000번이 아니라 1000/batch_size번
+    # 캐시에 있는 것은 빼고, 없는 것(miss)만 ollama에 요청함.
+    def embed_many(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        if not texts:
+            return []
+        if self.embed_cache is None:
+            return self._request_embeddings(texts, batch_size)
+
+        vectors = self.embed_cache.get_many(self.embed_model, texts)
+        miss_idx = [i for i, v in enumerate(vectors) if v is None]
+        if miss_idx:
+            # 같은 텍스트가 여러 번 나와도 한 번만 요청
+            miss_texts = list(dict.fromkeys(texts[i] for i in miss_idx))
+            new_vectors = self._request_embeddings(miss_texts, batch_size)
+            self.embed_cache.put_many(self.embed_model, miss_texts, new_vectors)
+            by_text = dict(zip(miss_texts, new_vectors))
+            for i in miss_idx:
+                vectors[i] = by_text[texts[i]]
+        return vectors
+
+    # 실제로 ollama /api/embed를 호출하는 부분
+    def _request_embeddings(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        batch_size = max(1, batch_size or self.embed_batch_size)
+        url = self.ollama_base_url + '/api/embed'
+
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            with ollama_call('embed', self.embed_model):
+                resp = self.session.post(url, json={'model': self.embed_model, 'input': batch}, timeout=120)
+                resp.raise_for_status()
+            data = resp.json()  # {"embeddings" : [[0.12, ...], [0.34, ...]]}
+            embs = data['embeddings']
+            if len(embs) != len(batch):
+                raise ValueError(f"embedding 개수 불일치: 요청 {len(batch)}개, 응답 {len(embs)}개")
+            self._count_embed_request(len(batch))
+            vectors.extend(embs)
+        return vectors
+
+    def _count_embed_request(self, n_texts: int) -> None:
+        with self._stats_lock:
+            self.embed_requests += 1
+            self.embedded_texts += n_texts
 
     # 답생성 generate
     def generate(self, prompt: str) -> str:
         url = self.ollama_base_url + '/api/generate'
-        payload = {
+        with ollama_call('generate', self.gen_model):
+            r = self.session.post(url, json=self._generate_payload(prompt), timeout=120)
+        print(r.json())
+        data = r.json()
+        record_ollama_usage(self.gen_model, data)
+        return data['response']
+
+    # /api/generate 요청 바디 (async 버전(async_rag.py)과 같이 씀)
+    def _generate_payload(self, prompt: str) -> Dict[str, Any]:
+        return {
             "model": self.gen_model,  # gemma3:1b
             "prompt": prompt,
             "stream": False,
@@ -72,10 +221,6 @@ class ChromaRAG:
                 # "repeat_penalty": 1.1,
             }
         }
-        r = requests.post(url, json=payload, timeout=120)
-        print(r.json())
-        data = r.json()
-        return data['response']
 
     ###############
     # 3. chuck만드는 부분
@@ -83,39 +228,135 @@ class ChromaRAG:
     # 통으로 읽은 text를 작게 자르자(chuck, 조각)
     @staticmethod
     def chunk_text(text: str, max_chars: int = 1500, overlap_chars: int = 150) -> List[str]:
-        text = (text or "").strip()
-        if not text:
-            return []
-
-        chunks = []
-        start = 0
-        n = len(text)
-
-        while start < n:
-            end = min(start + max_chars, n)
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
+        return list(ChromaRAG.iter_chunks([text], max_chars=max_chars, overlap_chars=overlap_chars))
 
-            if end == n:
-                break
-
-            start = max(0, end - overlap_chars)
+    # 텍스트 조각들(페이지들)을 받아서 청크를 하나씩 내보냄 (generator)
+    # - 조각들을 "\n"으로 이어붙인 전체 텍스트를 chunk_text한 것과 결과가 같음.
+    # - 전체 텍스트를 한 번에 들고 있지 않고, max_chars만큼 모이면 바로 청크를 내보냄.
+    @staticmethod
+    def iter_chunks(pieces: Iterable[str], max_chars: int = 1500, overlap_chars: int = 150) -> Iterator[str]:
+        pages = enumerate(pieces, 1)
+        for chunk, _, _ in ChromaRAG.iter_page_chunks(pages, max_chars=max_chars, overlap_chars=overlap_chars):
+            yield chunk
 
-        return chunks
+    # iter_chunks와 같은데, (페이지번호, 텍스트)를 받아서 (청크, 시작페이지, 끝페이지)를 내보냄.
+    @staticmethod
+    def iter_page_chunks(pages: Iterable[Tuple[int, str]], max_chars: int = 1500,
+                         overlap_chars: int = 150) -> Iterator[Tuple[str, int, int]]:
+        step = max(1, max_chars - overlap_chars)  # overlap이 max_chars 이상이면 무한루프가 되므로
+        buf = ""
+        started = False
+        # marks : buf 안에서 각 페이지가 시작하는 위치 [(offset, 페이지번호), ...]
+        marks: List[List[int]] = []
+
+        def page_at(pos: int) -> int:
+            page = marks[0][1]
+            for off, no in marks:
+                if off > pos:
+                    break
+                page = no
+            return page
+
+        def span(start: int, end: int) -> Tuple[int, int]:
+            window = buf[start:end]
+            first = start + len(window) - len(window.lstrip())
+            last = start + len(window.rstrip()) - 1
+            return page_at(first), page_at(last)
+
+        for page_no, piece in pages:
+            piece = piece or ""
+            if started:
+                marks.append([len(buf) + 1, page_no])
+                buf = buf + "\n" + piece
+            else:
+                buf = piece.lstrip()
+                marks = [[0, page_no]]
+                started = bool(buf)
+
+            # 뒤에 텍스트(공백 말고)가 더 남아있을 때만 잘라냄 (마지막 청크는 끝에서 처리)
+            # buf를 매번 잘라 복사하지 않고 start 위치만 옮김 (긴 텍스트 한 덩어리도 O(n))
+            rlen = len(buf.rstrip())
+            start = 0
+            while start + max_chars < rlen:
+                chunk = buf[start:start + max_chars].strip()
+                if chunk:
+                    yield (chunk, *span(start, start + max_chars))
+                start += step
+
+            if start:
+                buf = buf[start:]
+                for m in marks:
+                    m[0] -= start
+                # 이미 지나간 페이지 표시는 버림 (buf 시작 위치의 페이지 하나만 남김)
+                while len(marks) > 1 and marks[1][0] <= 0:
+                    marks.pop(0)
+
+        buf = buf.rstrip()
+        if buf:
+            yield (buf.strip(), *span(0, len(buf)))
+
+    # 청크 나누는 함수를 골라서 돌려줌 : (페이지번호, 텍스트)들 --> (청크, 시작페이지, 끝페이지)들
+    # - 'sentence' : 문장/문단 경계에서 자르고 대략적인 토큰 수(max_tokens)로 크기를 정함 (chunker.py)
+    # - 'chars'    : max_chars 글자마다 자름 (예전 방식)
+    def page_chunker(self, chunker: Optional[str] = None, max_chars: int = 1200, overlap_chars: int = 150,
+                     max_tokens: int = 512, overlap_tokens: int = 64
+                     ) -> Callable[[Iterable[Tuple[int, str]]], Iterator[Tuple[str, int, int]]]:
+        chunker = chunker or self.chunker
+        if chunker == 'sentence':
+            return functools.partial(iter_sentence_chunks, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+        if chunker == 'chars':
+            return functools.partial(self.iter_page_chunks, max_chars=max_chars, overlap_chars=overlap_chars)
+        raise ValueError(f"chunker는 {self.CHUNKERS} 중 하나여야 합니다: {chunker}")
 
     # pdf를 읽어서 text로 만들자.
+    # pdf : 파일 경로 또는 bytes
     @staticmethod
-    def pdf_to_text(pdf_bytes: bytes) -> str:
+    def pdf_to_text(pdf_bytes: PdfSource) -> str:
         """
-        PDF 바이너리(bytes)를 받아서 전체 텍스트를 추출합니다.
+        PDF 바이너리(bytes)나 파일 경로를 받아서 전체 텍스트를 추출합니다.
         - 스캔본(이미지) PDF는 텍스트가 거의 안 나올 수 있음(OCR 필요)
         """
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        parts = []
-        for page in doc:
-            parts.append(page.get_text("text"))
-        return "\n".join(parts).strip()
+        return "\n".join(text for _, text in ChromaRAG.iter_pdf_pages(pdf_bytes)).strip()
+
+    # 페이지 단위로 (페이지번호, 텍스트)를 하나씩 내보냄 (pdf_extract.py)
+    # - 파일 경로를 주면 업로드 bytes를 메모리에 들고 있지 않아도 되고,
+    #   페이지가 많으면 프로세스 풀로 나눠서 추출함.
+    @staticmethod
+    def iter_pdf_pages(pdf: PdfSource, workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        return iter_pdf_pages(pdf, workers=workers)
+
+    # 임베딩 캐시 상태 (hit/miss 개수 등)
+    def embed_cache_stats(self) -> Dict[str, Any]:
+        calls = {"embed_requests": self.embed_requests, "embedded_texts": self.embedded_texts}
+        if self.embed_cache is None:
+            return {"enabled": False, **calls}
+        return {"enabled": True, **self.embed_cache.stats(), **calls}
+
+    # 검색 결과 캐시 상태
+    def query_cache_stats(self) -> Dict[str, Any]:
+        if self.query_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, "collection_version": self.collection_version(), **self.query_cache.stats()}
+
+    ###############
+    # 컬렉션 버전 : "카운터:랜덤값" 문자열. 컬렉션에 쓸 때마다(upsert/update/delete) 바꿈.
+    # (여러 프로세스가 동시에 바꿔도 랜덤값 때문에 같은 버전이 다시 나오지 않음)
+    def collection_version(self) -> str:
+        try:
+            with open(self._version_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or "0"
+        except FileNotFoundError:
+            return "0"
+
+    def _bump_version(self) -> str:
+        with self._version_lock:
+            counter = self.collection_version().split(":")[0]
+            version = f"{int(counter) + 1 if counter.isdigit() else 1}:{uuid.uuid4().hex[:8]}"
+            tmp = self._version_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(version)
+            os.replace(tmp, self._version_path)
+            return version
 
     # collection에 몇 개 들어있는지 확인하는 함수
     def count(self) -> int:
@@ -127,21 +368,235 @@ class ChromaRAG:
 
     ###############
     # 4. 크로마 db에 적재하는 부분
+
+    # 청크 id를 (source, filename, 청크내용)으로 만든다. (uuid4 대신)
+    # --> 같은 pdf를 다시 올려도 같은 id가 나와서 중복 저장되지 않음.
+    # 한 문서 안에 똑같은 청크가 여러 번 나오면 몇 번째인지(occurrence)도 같이 넣음.
+    @staticmethod
+    def make_chunk_ids(chunks: List[str], source: str, filename: Optional[str] = None) -> List[str]:
+        seen: Dict[str, int] = {}
+        ids = []
+        for ch in chunks:
+            occ = seen.get(ch, 0)
+            seen[ch] = occ + 1
+            ids.append(ChromaRAG.make_chunk_id(ch, source, filename, occ))
+        return ids
+
+    @staticmethod
+    def make_chunk_id(chunk: str, source: str, filename: Optional[str] = None, occurrence: int = 0) -> str:
+        h = hashlib.sha256()
+        for part in (source, filename or "", chunk, str(occurrence)):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()[:32]
+
     # 텍스트를 크로마db에 적재하자.(ingest)
+    # 이미 같은 id가 있으면 건너뜀.
     def ingest_texts(self, texts: List[str], source: str = 'manual') -> int:
         if not texts:
             return 0
-        for i, t in enumerate(texts):
-            self.collection.add(
-                ids=[str(uuid.uuid4())],
-                documents=[t],
-                embeddings=[self.embed(t)],
-                metadatas=[{"chunk": i, "source": source}],
+        ids, docs, metadatas = self._new_texts(texts, source)
+        if not ids:
+            return 0
+        return self._add_batched(ids=ids, docs=docs, metadatas=metadatas)
+
+    # 아직 컬렉션에 없는 텍스트만 골라서 (ids, docs, metadatas)로 리턴
+    def _new_texts(self, texts: List[str], source: str) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+        ids = self.make_chunk_ids(texts, source)
+        existing = set(self.collection.get(ids=ids, include=[])["ids"])
+        new_idx = [i for i, _id in enumerate(ids) if _id not in existing]
+        return ([ids[i] for i in new_idx],
+                [texts[i] for i in new_idx],
+                [{"chunk": i, "source": source} for i in new_idx])
+
+    # batch_size개씩 묶어서 임베딩하고, 묶음마다 collection.upsert를 한 번만 호출함.
+    # (중간에 실패했다가 다시 돌려도 같은 id면 덮어쓰도록 add 대신 upsert)
+    def _add_batched(self, ids: List[str], docs: List[str], metadatas: List[Dict[str, Any]],
+                     batch_size: Optional[int] = None) -> int:
+        batch_size = max(1, batch_size or self.embed_batch_size)
+        for start in range(0, len(docs), batch_size):
+            batch_docs = docs[start:start + batch_size]
+            self._write_chunks(
+                ids=ids[start:start + batch_size],
+                docs=batch_docs,
+                embeddings=self.embed_many(batch_docs, batch_size=batch_size),
+                metadatas=metadatas[start:start + batch_size],
             )
-        return len(texts)
+        return len(docs)
+
+    ###############
+    # 컬렉션에 쓰는 곳은 모두 이 함수들을 거침
+    # --> 키워드 색인 갱신 + 컬렉션 버전 변경(검색 캐시 무효화)이 빠지지 않게.
+    def _write_chunks(self, ids: List[str], docs: List[str], embeddings: List[List[float]],
+                      metadatas: List[Dict[str, Any]]) -> None:
+        with chroma_call('upsert'):
+            self.collection.upsert(ids=ids, documents=docs, embeddings=embeddings, metadatas=metadatas)
+        if self.keyword_index is not None:
+            self.keyword_index.add(ids, docs)
+        self.source_index.add(ids, metadatas)
+        self._bump_version()
+
+    # 본문/벡터는 그대로 두고 메타데이터만 바꿈 (다시 적재할 때 청크 순서/페이지가 바뀐 경우)
+    def _update_chunks(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        with chroma_call('update'):
+            self.collection.update(ids=ids, metadatas=metadatas)
+        self.source_index.add(ids, metadatas)
+        self._bump_version()
+
+    def _get_metadatas(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with chroma_call('get'):
+            got = self.collection.get(ids=ids, include=["metadatas"])
+        return dict(zip(got["ids"], got["metadatas"]))
+
+    def _delete_chunks(self, ids: List[str]) -> None:
+        with chroma_call('delete'):
+            self.collection.delete(ids=ids)
+        if self.keyword_index is not None:
+            self.keyword_index.remove(ids)
+        self.source_index.remove(ids)
+        self._bump_version()
+
+    # 컬렉션 전체를 읽어서 키워드 색인을 다시 만듦
+    def rebuild_keyword_index(self, batch_size: int = 1000) -> int:
+        if self.keyword_index is None:
+            return 0
+        self.keyword_index.clear()
+        n = 0
+        for got in self._iter_collection(["documents"], batch_size):
+            self.keyword_index.add(got["ids"], got["documents"])
+            n += len(got["ids"])
+        return n
+
+    # 컬렉션 전체를 읽어서 문서별 청크 개수 색인을 다시 만듦
+    def rebuild_source_index(self, batch_size: int = 1000) -> int:
+        self.source_index.clear()
+        n = 0
+        for got in self._iter_collection(["metadatas"], batch_size):
+            self.source_index.add(got["ids"], got["metadatas"])
+            n += len(got["ids"])
+        return n
+
+    # 컬렉션에 들어있는 청크를 모두 지금의 /api/embed로 다시 임베딩 (본문/메타데이터는 그대로)
+    # 임베딩 방식(엔드포인트, 모델)이 바뀌었을 때 문서를 다시 적재하지 않고 벡터만 바꿈.
+    def reembed_all(self, batch_size: Optional[int] = None) -> int:
+        batch_size = batch_size or self.embed_batch_size
+        # id 목록을 먼저 받아둠 (offset으로 읽으면서 upsert하면 순서가 바뀔 수 있어서)
+        ids = [i for got in self._iter_collection([]) for i in got["ids"]]
+        for start in range(0, len(ids), batch_size):
+            with chroma_call('get'):
+                got = self.collection.get(ids=ids[start:start + batch_size], include=["documents", "metadatas"])
+            self._write_chunks(got["ids"], got["documents"], self.embed_many(got["documents"], batch_size=batch_size),
+                               got["metadatas"])
+        return len(ids)
+
+    def _iter_collection(self, include: List[str], batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        offset = 0
+        while True:
+            got = self.collection.get(limit=batch_size, offset=offset, include=include)
+            if not got["ids"]:
+                return
+            yield got
+            offset += len(got["ids"])
+
+    # 스냅샷 : 컬렉션(id, 본문, 메타데이터, 벡터)을 Parquet/Arrow 파일로 내보내기 / 가져오기 (snapshot.py)
+    # 다른 서버로 옮길 때 임베딩을 다시 계산하지 않아도 됨.
+    def export_snapshot(self, path: str, batch_size: int = 5000) -> Dict[str, Any]:
+        return export_collection(self, path, batch_size=batch_size)
+
+    def import_snapshot(self, path: str, batch_size: int = 5000, overwrite: bool = False,
+                        check_model: bool = True) -> Dict[str, Any]:
+        return import_collection(self, path, batch_size=batch_size, overwrite=overwrite, check_model=check_model)
+
+    # 문서 목록 : [{"source", "filename", "chunks", "updated_at"}]  (컬렉션을 읽지 않고 색인에서 바로)
+    def list_sources(self, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self.source_index.list(source)
+
+    ###############
+    # 문서별 manifest
+    # 문서(source + filename) 하나당 json 파일 하나 : 그 문서에 들어있는 청크 id 목록
+    # chroma_data/manifests/<doc_id>.json
+    @staticmethod
+    def make_doc_id(source: str, filename: Optional[str] = None) -> str:
+        return hashlib.sha256(f"{source}\0{filename or ''}".encode("utf-8")).hexdigest()[:32]
+
+    def _manifest_path(self, doc_id: str) -> str:
+        return os.path.join(self.manifest_dir, doc_id + ".json")
+
+    def load_manifest(self, source: str, filename: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        path = self._manifest_path(self.make_doc_id(source, filename))
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: Dict[str, Any]) -> None:
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        path = self._manifest_path(manifest["doc_id"])
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)  # 중간에 죽어도 manifest가 깨지지 않게
+
+    # manifest가 없을 때(예전 uuid 방식으로 넣은 문서) 크로마에서 직접 그 문서의 id를 찾음
+    def _existing_doc_ids(self, source: str, filename: Optional[str]) -> List[str]:
+        manifest = self.load_manifest(source, filename)
+        if manifest is not None:
+            return manifest["chunk_ids"]
+        if filename:
+            where = {"$and": [{"source": source}, {"filename": filename}]}
+        else:
+            where = {"source": source}
+        return self.collection.get(where=where, include=[])["ids"]
 
     ###############
     # 5. 텍스트를 읽어서 청크--> 임베딩 --> 크로마db에 저장
+    # 다시 넣을 때는 바뀐 청크만 임베딩/저장하고, 없어진 청크는 지움.
+    # 리턴 : {"added": 새로 넣은 수, "deleted": 지운 수, "unchanged": 그대로인 수, "chunks": 전체 청크 수, ...}
+    # chunker가 'sentence'면 max_tokens/overlap_tokens, 'chars'면 max_chars/overlap_chars를 씀.
+    def sync_document(
+            self,
+            raw_text: str,
+            source: str,
+            max_chars: int = 1200,
+            overlap_chars: int = 150,
+            meta_extra: Optional[Dict[str, Any]] = None,
+            batch_size: Optional[int] = None,
+            chunker: Optional[str] = None,
+            max_tokens: int = 512,
+            overlap_tokens: int = 64,
+    ) -> Dict[str, Any]:
+        return self.ingest_stream([raw_text], source, max_chars=max_chars, overlap_chars=overlap_chars,
+                                  meta_extra=meta_extra, batch_size=batch_size, chunker=chunker,
+                                  max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+
+    # 페이지(텍스트 조각)들이 들어오는 대로 청킹 --> 임베딩 --> 저장을 동시에 진행 (ingest_pipeline.py)
+    # pieces : 텍스트들 또는 (페이지번호, 텍스트)들. 페이지번호를 주면 메타데이터에 page/page_end가 들어감.
+    # 예) rag.ingest_stream(rag.iter_pdf_pages("./pdf/a.pdf"), source="pdf", meta_extra={"filename": "a.pdf"})
+    def ingest_stream(
+            self,
+            pieces: Iterable[Union[str, Tuple[int, str]]],
+            source: str,
+            max_chars: int = 1200,
+            overlap_chars: int = 150,
+            meta_extra: Optional[Dict[str, Any]] = None,
+            batch_size: Optional[int] = None,
+            embed_workers: int = 4,
+            queue_size: int = 8,
+            chunker: Optional[str] = None,
+            max_tokens: int = 512,
+            overlap_tokens: int = 64,
+    ) -> Dict[str, Any]:
+        return run_ingest_pipeline(
+            self, pieces, source,
+            chunk_fn=self.page_chunker(chunker, max_chars=max_chars, overlap_chars=overlap_chars,
+                                       max_tokens=max_tokens, overlap_tokens=overlap_tokens),
+            meta_extra=meta_extra,
+            batch_size=batch_size,
+            embed_workers=embed_workers,
+            queue_size=queue_size,
+        )
+
+    # 새로 추가된 청크 수만 리턴 (예전 방식과 같은 사용법)
     def ingest_document(
             self,
             raw_text: str,
@@ -149,20 +604,24 @@ class ChromaRAG:
             max_chars: int = 1200,
             overlap_chars: int = 150,
             meta_extra: Optional[Dict[str, Any]] = None,
+            batch_size: Optional[int] = None,
+            chunker: Optional[str] = None,
+            max_tokens: int = 512,
+            overlap_tokens: int = 64,
     ) -> int:
-        meta_extra = meta_extra or {}
-        chunks = self.chunk_text(raw_text, max_chars=max_chars, overlap_chars=overlap_chars)
-        if not chunks:
-            return 0
+        return self.sync_document(raw_text, source, max_chars=max_chars, overlap_chars=overlap_chars,
+                                  meta_extra=meta_extra, batch_size=batch_size, chunker=chunker,
+                                  max_tokens=max_tokens, overlap_tokens=overlap_tokens)["added"]
 
-        for i, ch in enumerate(chunks):
-            self.collection.add(
-                ids=[str(uuid.uuid4())],
-                documents=[ch],
-                embeddings=[self.embed(ch)],
-                metadatas=[{"chunk": i, "source": source, **meta_extra}],
-            )
-        return len(chunks)
+    # 문서(source + filename) 하나를 통째로 삭제. 지운 청크 수를 리턴.
+    def delete_document(self, source: str, filename: Optional[str] = None) -> int:
+        ids = self._existing_doc_ids(source, filename)
+        if ids:
+            self._delete_chunks(ids)
+        path = self._manifest_path(self.make_doc_id(source, filename))
+        if os.path.exists(path):
+            os.remove(path)
+        return len(ids)
 
 
     ### @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
@@ -170,35 +629,175 @@ class ChromaRAG:
     ### 질문 --> 임베딩 --> 크로마db에서 검색
     ### @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
 
-    def query_docs(self, question: str, top_k: int = 10) -> List[str]:
-        n = self.count()
-        if n <= 0:
-            return []
-
-        top_k = min(top_k, n)
-        q_emb = self.embed(question)
-
-        res = self.collection.query(query_embeddings=[q_emb], n_results=top_k)
+    # 같은 질문(공백 정규화)이 같은 top_k, 같은 필터로 다시 오고 컬렉션이 안 바뀌었으면
+    # 임베딩/검색 없이 캐시에서 바로 돌려줌.
+    # where : 크로마 where 필터 (예: {"source": "pdf"}, make_where 참고). 주면 그 청크들 중에서만 검색.
+    def query_docs(self, question: str, top_k: int = 10, where: Optional[Dict[str, Any]] = None) -> List[str]:
+        return [h["text"] for h in self.query_hits(question, top_k, where=where)]
+
+    # 검색 결과를 청크 id, 메타데이터(source, filename, page ...), 점수와 같이 리턴
+    # [{"id": ..., "text": ..., "metadata": {...}, "score": ...}, ...]  (점수 높은 순)
+    def query_hits(self, question: str, top_k: int = 10,
+                   where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        key, cached = self._cached_query(question, top_k, where)
+        if cached is not None:
+            return cached
+
+        n, scope = self._scope(where)
+        hits: List[Dict[str, Any]] = []
+        if n > 0 and self.keyword_index is None:
+            hits = self._search(self.embed(question), top_k, n, where)
+        elif n > 0:
+            # 키워드 검색(수 ms)은 스레드에서, 그동안 여기서는 질문 임베딩(ollama) + 벡터 검색
+            cand = self._candidates(top_k, n)
+            kw = self._keyword_pool.submit(self.keyword_index.search, question, cand, scope)
+            dense = self._search(self.embed(question), cand, n, where)
+            hits = self._fuse(dense, [_id for _id, _ in kw.result()], top_k)
+        self._store_query(key, hits)
+        return hits
+
+    # 검색 범위 --> (청크 수, 필터에 맞는 청크 id들 또는 None(전체))
+    # 필터는 크로마 메타데이터 색인(sqlite)에서 바로 찾음 --> 범위 밖 청크는 벡터/키워드 검색 모두에서 빠짐
+    def _scope(self, where: Optional[Dict[str, Any]]) -> Tuple[int, Optional[List[str]]]:
+        if not where:
+            return self.count(), None
+        with chroma_call('get'):
+            ids = self.collection.get(where=where, include=[])["ids"]
+        return len(ids), ids
+
+    # 필터 만들기 : source/filename(자주 쓰는 것) + where(그 외 크로마 where 조건)
+    # 예) make_where("pdf", "a.pdf") --> {"$and": [{"source": "pdf"}, {"filename": "a.pdf"}]}
+    @staticmethod
+    def make_where(source: Optional[str] = None, filename: Optional[str] = None,
+                   where: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        conds: List[Dict[str, Any]] = []
+        if source is not None:
+            conds.append({"source": source})
+        if filename is not None:
+            conds.append({"filename": filename})
+        if where:
+            conds.append(where)
+        if not conds:
+            return None
+        return conds[0] if len(conds) == 1 else {"$and": conds}
+
+    # 캐시 조회 --> (캐시 키, 캐시된 결과 또는 None)
+    def _cached_query(self, question: str, top_k: int, where: Optional[Dict[str, Any]] = None
+                      ) -> Tuple[Optional[tuple], Optional[List[Dict[str, Any]]]]:
+        if self.query_cache is None:
+            return None, None
+        # 버전은 검색 "전에" 읽어야 함 (검색 도중 적재되면 이 키는 다시 쓰이지 않음)
+        key = (EmbeddingCache.normalize(question), top_k,
+               json.dumps(where, sort_keys=True, ensure_ascii=False) if where else None,
+               self.collection_version())
+        cached = self.query_cache.get(key)
+        return key, ([dict(h) for h in cached] if cached is not None else None)
+
+    def _store_query(self, key: Optional[tuple], hits: List[Dict[str, Any]]) -> None:
+        if key is not None:
+            self.query_cache.put(key, tuple(dict(h) for h in hits))
+
+    # 벡터 검색 --> hits (점수 = 1 / (1 + 거리))
+    def _search(self, q_emb: List[float], top_k: int, n: int,
+                where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        with chroma_call('query'):
+            res = self.collection.query(query_embeddings=[q_emb], n_results=min(top_k, n), where=where or None,
+                                        include=["documents", "metadatas", "distances"])
+        ids = (res.get("ids") or [[]])[0]
         docs = (res.get("documents") or [[]])[0]
-        return docs
+        metas = (res.get("metadatas") or [[]])[0] or [None] * len(ids)
+        dists = (res.get("distances") or [[]])[0] or [0.0] * len(ids)
+        return [{"id": i, "text": d, "metadata": m or {}, "score": 1.0 / (1.0 + dist)}
+                for i, d, m, dist in zip(ids, docs, metas, dists)]
+
+    # 합치기 전에 각 검색에서 가져올 개수 (한쪽에서만 나온 청크도 순위에 들어올 수 있게 top_k보다 넉넉히)
+    @staticmethod
+    def _candidates(top_k: int, n: int) -> int:
+        return min(n, max(top_k * 2, 20))
+
+    # 벡터 검색 순위 + 키워드 검색 순위 --> RRF로 합친 상위 top_k개 (점수 = RRF 점수)
+    def _fuse(self, dense: List[Dict[str, Any]], keyword_ids: List[str], top_k: int) -> List[Dict[str, Any]]:
+        fused = reciprocal_rank_fusion([[h["id"] for h in dense], keyword_ids], k=self.rrf_k)[:top_k]
+        by_id = {h["id"]: h for h in dense}
+        missing = [_id for _id, _ in fused if _id not in by_id]
+        if missing:
+            got = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for _id, doc, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+                by_id[_id] = {"id": _id, "text": doc, "metadata": meta or {}}
+        return [{**by_id[_id], "score": score} for _id, score in fused if _id in by_id]
 
     ### @@@@@@@@@@@@@@@@@@@ 크로마db + gemma3:1b에서 검색 @@@@@@@@@@@@@@@@@@@@@@
     ### Google붙으면 질문 --> 임베딩 --> 크로마db에서 검색
     ### 안붙으면 질문 --> 프롬프트 --> 올라마 gemma3:1b에서 생성
     ### @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
-    def ask(self, question: str, top_k: int = 10) -> Dict[str, Any]:
-        import re
+    def ask(self, question: str, top_k: int = 10, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        rag_mode, q = self.parse_question(question)
+        if rag_mode:
+            # ---- RAG 모드 (Chroma DB 검색 후 generate) ----
+            hits = self.retrieve_hits(q, top_k=top_k, where=where)  # "Google" 부분 제거 후 검색
+            if not hits:
+                return self.no_docs_answer()
+            prompt, context = self.rag_prompt(q, hits)
+            answer = self.generate(prompt).strip()
+            return {"answer": answer, "chroma-db": [h["text"] for h in hits], "mode": "RAG (Chroma DB 검색)",
+                    "context": context}
+
+        else:
+            # ---- 일반 생성 모드 (Chroma DB 검색 없이 바로 gemma3 호출) ----
+            prompt = question  # 그대로 전달하거나 필요 시 시스템 프롬프트 추가 가능
+            answer = self.generate(prompt).strip()
+            return {"answer": answer, "chroma-db": None, "mode": "일반 생성 (gemma3)"}
 
-        # 1. 질문이 "Google" 또는 "google" 등으로 시작하는지 확인 (앞뒤 공백 무시)
+    # 검색 결과를 화면/로그에 보여줄 때 쓰는 요약 (본문 제외)
+    @staticmethod
+    def hit_info(hit: Dict[str, Any]) -> Dict[str, Any]:
+        meta = hit.get("metadata") or {}
+        info = {"id": hit["id"], "source": meta.get("source"), "filename": meta.get("filename"),
+                "chunk": meta.get("chunk"), "score": round(float(hit.get("score", 0.0)), 6)}
+        if "page" in meta:
+            info["page"] = meta["page"]
+            info["page_end"] = meta.get("page_end", meta["page"])
+        return info
+
+    # 프롬프트에 넣을 청크들
+    # reranker가 있으면 넉넉히 검색해서 점수 좋은 것만 남김 (top_k와 rerank_top_n 중 작은 개수)
+    def retrieve(self, question: str, top_k: int = 10, where: Optional[Dict[str, Any]] = None) -> List[str]:
+        return [h["text"] for h in self.retrieve_hits(question, top_k, where=where)]
+
+    def retrieve_hits(self, question: str, top_k: int = 10,
+                      where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        if self.reranker is None:
+            return self.query_hits(question, top_k=top_k, where=where)
+        hits = self.query_hits(question, top_k=max(top_k, self.rerank_candidates), where=where)
+        return self._rerank(question, hits, top_k)
+
+    # 재순위 후 점수 = reranker 점수
+    def _rerank(self, question: str, hits: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+        scores = self.reranker.score(question, [h["text"] for h in hits])
+        order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)
+        return [{**hits[i], "score": scores[i]} for i in order[:min(top_k, self.rerank_top_n)]]
+
+    # 질문이 "Google" 또는 "google" 등으로 시작하는지 확인 (앞뒤 공백 무시)
+    # --> (RAG 모드인지, "Google"을 뗀 질문)
+    @staticmethod
+    def parse_question(question: str) -> Tuple[bool, str]:
         if re.match(r"^\s*Google", question, flags=re.IGNORECASE):
-            # ---- RAG 모드 (Chroma DB 검색 후 generate) ----
-            docs = self.query_docs(question.lstrip("Google ").strip(), top_k=top_k)  # "Google" 부분 제거 후 검색
-            if not docs:
-                answer = "문서가 존재하지 않습니다."
-                return {"answer": answer, "chroma-db": [], "mode": "RAG (문서 없음)"}
+            return True, question.lstrip("Google ").strip()
+        return False, question
+
+    @staticmethod
+    def no_docs_answer() -> Dict[str, Any]:
+        return {"answer": "문서가 존재하지 않습니다.", "chroma-db": [], "mode": "RAG (문서 없음)"}
 
-            context = "\n\n---\n\n".join(docs)[:3000]
-            prompt = f"""너는 문서 기반 QA 어시스턴트다.
+    # 검색 결과로 프롬프트 만들기 --> (프롬프트, CONTEXT 정보(토큰 수, 들어간 청크 id 등))
+    # 이웃 청크는 합치고 겹치는 부분을 뺀 뒤, 점수 순으로 context_tokens 예산만큼 채움 (context_pack.py)
+    def rag_prompt(self, question: str, hits: List[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+        context, info = pack_context(hits, max_tokens=self.context_tokens)
+        return self.build_prompt(question, context), info
+
+    @staticmethod
+    def build_prompt(question: str, context: str) -> str:
+        return f"""너는 문서 기반 QA 어시스턴트다.
     아래 CONTEXT에 있는 정보만 사용해서 질문에 답하라.
     정보가 없으면 '문서에서 찾을 수 없습니다.'라고 답하라.
 
@@ -206,18 +805,10 @@ class ChromaRAG:
     {context}
 
     [QUESTION]
-    {question.lstrip("Google ").strip()}
+    {question}
 
     [ANSWER]
     """
-            answer = self.generate(prompt).strip()
-            return {"answer": answer, "chroma-db": docs, "mode": "RAG (Chroma DB 검색)"}
-
-        else:
-            # ---- 일반 생성 모드 (Chroma DB 검색 없이 바로 gemma3 호출) ----
-            prompt = question  # 그대로 전달하거나 필요 시 시스템 프롬프트 추가 가능
-            answer = self.generate(prompt).strip()
-            return {"answer": answer, "chroma-db": None, "mode": "일반 생성 (gemma3)"}
 
 
 if __name__ == '__main__':
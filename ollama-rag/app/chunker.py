@@ -0,0 +1,154 @@
+# chunker.py
+# 문장/문단 경계에서 자르고, 글자 수가 아니라 "대략적인 토큰 수"로 청크 크기를 정하는 청커
+#
+# ChromaRAG.chunk_text는 max_chars 글자마다 잘라서 한글 문장이 단어 중간에서 끊김.
+# 여기서는
+#   1) 정규식 한 번(finditer)으로 텍스트를 훑으면서 문장 끝(. ! ? 등 + 공백)과 문단 끝(빈 줄)을 찾고
+#   2) 문장들을 max_tokens를 넘지 않을 때까지 채워서 청크를 만들고
+#   3) 다음 청크는 앞 청크의 마지막 문장들(overlap_tokens 이내)로 시작함(문장 단위 overlap)
+# 페이지 단위로 들어와도(스트리밍) 페이지 끝에서 잘린 문장은 다음 페이지와 이어붙여서 처리함.
+from __future__ import annotations
+
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+# 문장 끝 : 마침표/물음표/느낌표(+닫는 따옴표/괄호) 뒤에 공백
+# 문단 끝 : 빈 줄
+_BOUNDARY = re.compile(r"[.!?。！？…]+[\"'”’)\]]*\s+|\n[ \t]*\n\s*")
+
+_WORD = re.compile(r"\S+\s*")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    임베딩 모델 토크나이저를 돌리지 않고 토큰 수를 대략 계산합니다.
+    - 한글(한자/가나 등 ASCII가 아닌 글자) 한 글자 ≈ 토큰 1개
+    - 그 외(영어, 숫자, 기호) 4글자 ≈ 토큰 1개
+    """
+    n = len(text)
+    # 한글/한자는 utf-8로 3바이트, 영어/숫자는 1바이트 --> 바이트 수 차이로 한 번에 셈 (정규식보다 빠름)
+    wide = (len(text.encode("utf-8")) - n) // 2
+    other = n - wide - text.count(" ") - text.count("\n")
+    return wide + (max(0, other) + 3) // 4
+
+
+# (문장, 시작페이지, 끝페이지, 문단 시작 여부)를 하나씩 내보냄
+def iter_sentences(pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, int, int, bool]]:
+    carry = ""          # 이전 페이지 끝에서 아직 안 끝난 문장
+    carry_page = 0      # carry가 시작된 페이지
+    carry_end = 0       # carry의 마지막 글자가 있는 페이지
+    para = True
+    for page_no, text in pages:
+        text = text or ""
+        if carry:
+            buf = carry + "\n" + text
+            head = len(carry)  # buf[:head]는 이전 페이지들의 텍스트
+        else:
+            buf = text
+            head = 0
+            carry_page = carry_end = page_no
+
+        pos = 0
+        for m in _BOUNDARY.finditer(buf):
+            end = m.end()
+            sentence = buf[pos:end]
+            if pos >= head:
+                yield sentence, page_no, page_no, para
+            else:
+                # 이전 페이지에서 이어진 문장 : 앞뒤 공백은 빼고 어느 페이지에 있는지 계산
+                first = pos + len(sentence) - len(sentence.lstrip())
+                last = pos + len(sentence.rstrip())
+                start_page = carry_page if first < head else page_no
+                end_page = carry_end if last <= head else page_no
+                yield sentence, start_page, end_page, para
+            para = m.group().count("\n") >= 2
+            pos = end
+
+        if pos >= head:
+            carry_page = carry_end = page_no
+        elif buf[head:].strip():
+            carry_end = page_no
+        carry = buf[pos:]
+
+    if carry.strip():
+        yield carry, carry_page, carry_end, para
+
+
+# 토큰이 max_tokens보다 긴 문장(표, 줄바꿈만 있는 텍스트 등)은 단어 단위로, 그래도 길면 글자 단위로 자름.
+def _split_long(sentence: str, max_tokens: int) -> List[Tuple[str, int]]:
+    out: List[Tuple[str, int]] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for word in _WORD.findall(sentence):
+        tok = estimate_tokens(word)
+        if tok > max_tokens:
+            if cur:
+                out.append(("".join(cur).strip(), cur_tokens))
+                cur, cur_tokens = [], 0
+            # 한 글자는 토큰 1개 이하로 계산되므로 max_tokens 글자씩 자르면 넘지 않음
+            for i in range(0, len(word), max_tokens):
+                part = word[i:i + max_tokens]
+                out.append((part.strip(), estimate_tokens(part)))
+            continue
+        if cur and cur_tokens + tok > max_tokens:
+            out.append(("".join(cur).strip(), cur_tokens))
+            cur, cur_tokens = [], 0
+        cur.append(word)
+        cur_tokens += tok
+    if cur:
+        out.append(("".join(cur).strip(), cur_tokens))
+    return [(p, t) for p, t in out if p]
+
+
+def iter_sentence_chunks(pages: Iterable[Tuple[int, str]], max_tokens: int = 512,
+                         overlap_tokens: int = 64) -> Iterator[Tuple[str, int, int]]:
+    """
+    (페이지번호, 텍스트)들을 받아서 (청크, 시작페이지, 끝페이지)를 내보냅니다.
+    - 문장 중간에서 자르지 않음 (문장 하나가 max_tokens보다 길 때만 단어 단위로 자름)
+    - 청크가 max_tokens의 3/4 이상 찼을 때 새 문단이 시작되면 거기서 자름
+    - overlap은 앞 청크의 마지막 문장들 (합계 overlap_tokens 이내)
+    """
+    max_tokens = max(1, max_tokens)
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens - 1))
+    soft_limit = max_tokens * 3 // 4
+
+    # cur : [(문장, 토큰수, 시작페이지, 끝페이지, 문단시작)]
+    cur: List[Tuple[str, int, int, int, bool]] = []
+    cur_tokens = 0
+
+    def emit() -> Tuple[str, int, int]:
+        parts = []
+        for i, (s, _, _, _, p) in enumerate(cur):
+            if i:
+                parts.append("\n" if p else " ")
+            parts.append(s)
+        return "".join(parts), cur[0][2], cur[-1][3]
+
+    for sentence, page, page_end, para in iter_sentences(pages):
+        s = sentence.strip()
+        if not s:
+            continue
+        tok = estimate_tokens(s)
+        pieces = [(s, tok)] if tok <= max_tokens else _split_long(s, max_tokens)
+
+        for piece, ptok in pieces:
+            if cur and (cur_tokens + ptok > max_tokens or (para and cur_tokens >= soft_limit)):
+                yield emit()
+                # 앞 청크 끝 문장들을 overlap으로 남김 (다음 문장을 넣어도 max_tokens를 넘지 않게)
+                tail: List[Tuple[str, int, int, int, bool]] = []
+                tail_tokens = 0
+                for item in reversed(cur):
+                    if tail_tokens + item[1] > overlap_tokens or tail_tokens + item[1] + ptok > max_tokens:
+                        break
+                    tail.insert(0, item)
+                    tail_tokens += item[1]
+                # 문단이 바뀌어서 자른 경우에는 이전 문단을 끌고 오지 않음
+                if para:
+                    tail, tail_tokens = [], 0
+                cur, cur_tokens = tail, tail_tokens
+            cur.append((piece, ptok, page, page_end, para))
+            cur_tokens += ptok
+            para = False
+
+    if cur:
+        yield emit()
@@ -0,0 +1,132 @@
+# context_pack.py
+# 검색된 청크들로 프롬프트의 CONTEXT를 만드는 부분
+#
+# 예전에는 청크들을 이어붙이고 [:3000]글자에서 잘랐음
+#   - 제일 관련 있는 청크의 뒷부분이 잘려나갈 수 있고
+#   - 이웃한 청크끼리 겹치는 부분(overlap)이 두 번 들어가서 토큰이 낭비됨
+# 여기서는
+#   1) 같은 문서(source + filename)에서 연달아 있는 청크(chunk 번호가 1 차이)는 하나로 합치면서 겹치는 부분을 뺌
+#   2) 점수 높은 순으로
+#   3) 토큰 예산(max_tokens)을 넘지 않을 때까지 채움 (안 들어가는 덩어리는 건너뛰고 더 작은 것을 넣어 봄)
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple
+
+from chunker import estimate_tokens
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+
+# a의 끝과 b의 앞이 겹치는 글자 수 (청크 overlap은 max_overlap 글자를 넘지 않는다고 봄)
+# 우연히 한두 글자만 같은 경우는 겹친 것으로 보지 않음 (min_overlap 미만은 0)
+def _overlap(a: str, b: str, max_overlap: int = 4000, min_overlap: int = 8) -> int:
+    tail = a[-max_overlap:]
+    first = b[:1]
+    i = 0
+    while first:
+        # 후보 위치(b의 첫 글자)만 find로 찾아가며 확인 (한 글자씩 startswith 하는 것보다 훨씬 빠름)
+        i = tail.find(first, i)
+        if i < 0 or len(tail) - i < min_overlap:
+            return 0
+        if b.startswith(tail[i:]):
+            return len(tail) - i
+        i += 1
+    return 0
+
+
+def _doc_key(hit: Dict[str, Any]) -> Tuple[Any, Any]:
+    meta = hit.get("metadata") or {}
+    return meta.get("source"), meta.get("filename")
+
+
+# 같은 문서에서 chunk 번호가 이어지는 hit들을 덩어리(segment)로 묶음
+# segment : {"text", "score"(가장 높은 점수), "hits"(원래 hit들, chunk 순서), "overlap_chars"(뺀 글자 수)}
+def merge_adjacent(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    groups: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = {}
+    loose: List[Dict[str, Any]] = []
+    for h in hits:
+        if (h.get("metadata") or {}).get("chunk") is None:
+            loose.append(h)
+        else:
+            groups.setdefault(_doc_key(h), []).append(h)
+
+    segments: List[Dict[str, Any]] = []
+    for members in groups.values():
+        members.sort(key=lambda h: h["metadata"]["chunk"])
+        run = [members[0]]
+        for h in members[1:]:
+            if h["metadata"]["chunk"] == run[-1]["metadata"]["chunk"] + 1:
+                run.append(h)
+            elif h["metadata"]["chunk"] != run[-1]["metadata"]["chunk"]:
+                segments.append(_join(run))
+                run = [h]
+        segments.append(_join(run))
+    segments.extend(_join([h]) for h in loose)
+    return segments
+
+
+def _join(run: List[Dict[str, Any]]) -> Dict[str, Any]:
+    text = run[0]["text"].strip()
+    removed = 0
+    for h in run[1:]:
+        nxt = h["text"].strip()
+        k = _overlap(text, nxt)
+        removed += k
+        text = text + nxt[k:] if k else text + "\n" + nxt
+    return {"text": text, "score": max(float(h.get("score", 0.0)) for h in run),
+            "hits": run, "overlap_chars": removed}
+
+
+def pack_context(hits: List[Dict[str, Any]], max_tokens: int = 1500,
+                 separator: str = CONTEXT_SEPARATOR) -> Tuple[str, Dict[str, Any]]:
+    """
+    hits(ChromaRAG.retrieve_hits 결과)로 CONTEXT 문자열을 만듭니다.
+    리턴 : (context, {"tokens", "chunks", "chunk_ids", "overlap_chars_removed", "dropped"})
+    """
+    sep_tokens = estimate_tokens(separator)
+    parts: List[str] = []
+    used: List[Dict[str, Any]] = []
+    tokens = 0
+    removed = 0
+    dropped = 0
+
+    def fits(text: str) -> int:
+        t = estimate_tokens(text) + (sep_tokens if parts else 0)
+        return t if tokens + t <= max_tokens else -1
+
+    for seg in sorted(merge_adjacent(hits), key=lambda s: s["score"], reverse=True):
+        t = fits(seg["text"])
+        if t >= 0:
+            parts.append(seg["text"])
+            used.extend(seg["hits"])
+            tokens += t
+            removed += seg["overlap_chars"]
+            continue
+        # 합친 덩어리가 안 들어가면 그 안의 청크를 점수 순으로 하나씩 넣어 봄
+        for h in sorted(seg["hits"], key=lambda h: float(h.get("score", 0.0)), reverse=True):
+            t = fits(h["text"].strip())
+            if t >= 0:
+                parts.append(h["text"].strip())
+                used.append(h)
+                tokens += t
+            else:
+                dropped += 1
+
+    # 제일 좋은 청크 하나도 예산보다 크면 그 청크를 예산만큼 잘라서라도 넣음
+    if not parts and hits:
+        best = max(hits, key=lambda h: float(h.get("score", 0.0)))
+        text = best["text"].strip()
+        while text and estimate_tokens(text) > max_tokens:
+            text = text[:int(len(text) * 0.9)]
+        parts.append(text)
+        used.append(best)
+        tokens = estimate_tokens(text)
+        dropped = len(hits) - 1
+
+    return separator.join(parts), {
+        "tokens": tokens,
+        "chunks": len(used),
+        "chunk_ids": [h["id"] for h in used],
+        "overlap_chars_removed": removed,
+        "dropped": dropped,
+    }
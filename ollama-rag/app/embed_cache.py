@@ -0,0 +1,172 @@
+# embed_cache.py
+# 임베딩 결과를 디스크(sqlite)에 저장해두는 캐시
+# - 키 : (임베딩 모델, 정규화한 텍스트의 sha256)
+# - 서버를 껐다 켜도 남아있음 (파일로 저장되므로)
+# - max_entries를 넘으면 가장 오래 안 쓴 것(LRU)부터 지움
+# - hit/miss 개수를 세어서 stats()로 확인 가능
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = './embed_cache.sqlite3', max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # fastapi의 sync 핸들러는 여러 스레드에서 호출되므로 lock으로 보호함.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key       TEXT PRIMARY KEY,
+                model     TEXT NOT NULL,
+                dim       INTEGER NOT NULL,
+                vector    BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    ###############
+    # 키 만들기
+    # 공백/유니코드 정규화를 해서 "안녕  하세요"와 "안녕 하세요"가 같은 키가 되게 함.
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = unicodedata.normalize("NFC", text or "")
+        return " ".join(text.split())
+
+    @classmethod
+    def make_key(cls, model: str, text: str) -> str:
+        h = hashlib.sha256()
+        h.update(model.encode("utf-8"))
+        h.update(b"\0")
+        h.update(cls.normalize(text).encode("utf-8"))
+        return h.hexdigest()
+
+    # float 리스트 <-> bytes (float32로 저장해서 용량을 절반으로)
+    @staticmethod
+    def _pack(vector: Sequence[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> List[float]:
+        arr = array("f")
+        arr.frombytes(blob)
+        return arr.tolist()
+
+    ###############
+    # 조회
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        if not texts:
+            return []
+        keys = [self.make_key(model, t) for t in texts]
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            # sqlite는 한 쿼리에 넣을 수 있는 ? 개수 제한이 있어서 나눠서 조회함.
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = self._unpack(blob)
+
+            # 찾은 것들은 최근 사용 시간을 갱신 (LRU)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+
+            results = [found.get(k) for k in keys]
+            hit = sum(1 for r in results if r is not None)
+            self.hits += hit
+            self.misses += len(results) - hit
+        return results
+
+    ###############
+    # 저장
+    def put(self, model: str, text: str, vector: Sequence[float]) -> None:
+        self.put_many(model, [text], [vector])
+
+    def put_many(self, model: str, texts: List[str], vectors: List[Sequence[float]]) -> None:
+        if not texts:
+            return
+        now = time.time()
+        rows = {}
+        for t, v in zip(texts, vectors):
+            rows[self.make_key(model, t)] = (model, len(v), self._pack(v), now)
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(k, *v) for k, v in rows.items()],
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    # max_entries를 넘은 만큼 last_used가 가장 오래된 것부터 삭제
+    # 개수는 INSERT와 같은 트랜잭션 안에서 COUNT(*)로 셈
+    # --> 같은 파일을 쓰는 다른 프로세스(uvicorn worker, bulk_ingest)가 넣은 것까지 맞게 셈
+    def _evict_locked(self) -> None:
+        over = self._count_locked() - self.max_entries
+        if over <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (over,),
+        )
+        self.evictions += over
+
+    def _count_locked(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    ###############
+    # 상태 확인
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count_locked()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
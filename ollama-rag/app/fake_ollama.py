@@ -0,0 +1,317 @@
+# fake_ollama.py
+# 부하 테스트 / 벤치마크용 가짜 ollama 서버 (진짜 모델 없이 ollama REST API만 흉내냄)
+#
+# ChromaRAG, main.py(ollama.AsyncClient), stream/main_stream.py, ollama-start의 ollama_client.py 모두
+# :11434의 ollama를 부르므로 이 서버를 대신 띄우면 GPU/모델 없이 오프라인으로 테스트할 수 있음.
+#
+#   python fake_ollama.py                                   # :11434, 첫 토큰 200ms, 초당 40토큰
+#   python fake_ollama.py --port 11500 --ttft_ms 50 --tps 200 --error_rate 0.01 --max_parallel 4
+#
+# - /api/generate, /api/chat : stream(기본 true)이면 NDJSON으로 토큰을 tps 속도로 흘려보냄.
+#                              마지막 줄에 eval_count, eval_duration 등 진짜 ollama와 같은 시간 정보.
+#                              답변 글자는 (모델, 프롬프트)의 해시로 정해짐 --> 같은 질문이면 항상 같은 답
+# - /api/embed, /api/embeddings : 단어(한글은 2글자씩)를 해시해서 만든 벡터(정규화)
+#                              --> 항상 같은 값이고, 단어가 겹치는 문장끼리는 실제로 가까움(검색 recall 측정 가능)
+# - /api/tags, /api/ps, /api/version, / : 모델 목록 / 최근 쓴 모델 / 버전 / "Ollama is running"
+# - 지연 : 첫 토큰까지 ttft_ms + (프롬프트 토큰 / prompt_tps), 그 뒤 토큰마다 1/tps초 (jitter만큼 흔들림)
+# - 동시 처리 : max_parallel개까지만 동시에 생성(OLLAMA_NUM_PARALLEL처럼), 나머지는 줄 서서 기다림
+# - 에러 주입 : error_rate 확률로 500, stream_error_rate 확률로 생성 도중 {"error": ...} 줄
+# - GET /_fake/stats : 엔드포인트별 호출 수, 토큰 수, 주입한 에러 수 (벤치마크에서 확인용)
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+# 답변을 만들 때 쓰는 단어들 (해시로 골라서 이어붙임)
+_VOCAB = ("문서", "에", "따르면", "답변", "은", "다음", "과", "같습니다", ".", "관련", "내용", "을", "찾을",
+          "수", "있습니다", "the", "answer", "is", "based", "on", "context", ",", "and", "data", "요약")
+_WORD = re.compile(r"[0-9a-z]+|[^\W0-9a-z_]+")
+
+
+@dataclass
+class FakeConfig:
+    models: List[str] = field(default_factory=lambda: ["gemma3:1b", "llama3.2:3b", "nomic-embed-text"])
+    embed_dim: int = 768
+    ttft_ms: float = 200.0          # 첫 토큰까지 기본 시간 (모델 로드/준비)
+    prompt_tps: float = 2000.0      # 프롬프트 읽는 속도 (토큰/초)
+    tps: float = 40.0               # 답변 만드는 속도 (토큰/초)
+    max_tokens: int = 128           # num_predict가 없을 때 답변 토큰 수
+    embed_ms: float = 5.0           # /api/embed 요청 하나의 기본 시간
+    embed_ms_per_text: float = 1.0  # 텍스트 하나당 추가 시간
+    jitter: float = 0.1             # 지연을 +-10% 흔듦
+    error_rate: float = 0.0         # 요청을 500으로 실패시킬 확률
+    stream_error_rate: float = 0.0  # 스트리밍 도중 에러 줄을 보낼 확률
+    max_parallel: int = 4           # 동시에 생성하는 요청 수 (0이면 제한 없음)
+    strict_models: bool = False     # 목록에 없는 모델이면 404
+    seed: int = 0
+
+
+###############
+# 결정적인(항상 같은) 답변 / 임베딩
+def fake_tokens(model: str, prompt: str, n: int) -> List[str]:
+    seed = int.from_bytes(hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [rng.choice(_VOCAB) + ("" if i == n - 1 else " ") for i in range(n)]
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    # feature hashing : 단어마다 해시로 자리(index)와 부호를 정해서 더함
+    vec = np.zeros(dim, dtype=np.float32)
+    words = []
+    for w in _WORD.findall(text.lower()):
+        words.extend([w] if w.isascii() or len(w) < 2 else [w[i:i + 2] for i in range(len(w) - 1)])
+    for w in words or [text]:
+        h = hashlib.blake2b(w.encode("utf-8"), digest_size=8).digest()
+        idx = int.from_bytes(h[:4], "little") % dim
+        vec[idx] += 1.0 if h[4] & 1 else -1.0
+    norm = float(np.linalg.norm(vec))
+    return (vec / norm).tolist() if norm else vec.tolist()
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 3)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeOllama:
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.sem = asyncio.Semaphore(config.max_parallel) if config.max_parallel > 0 else None
+        self.loaded: Dict[str, float] = {}  # 모델 --> 마지막으로 쓴 시각 (/api/ps)
+        self.stats: Dict[str, Any] = {"requests": {}, "errors_injected": 0, "tokens_generated": 0,
+                                      "texts_embedded": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def _delay(self, seconds: float) -> float:
+        j = self.config.jitter
+        return max(0.0, seconds * (1 + self.rng.uniform(-j, j))) if j else seconds
+
+    def count(self, path: str) -> None:
+        self.stats["requests"][path] = self.stats["requests"].get(path, 0) + 1
+
+    def check(self, model: Optional[str]) -> Optional[JSONResponse]:
+        if self.config.strict_models and model not in self.config.models:
+            return JSONResponse({"error": f"model '{model}' not found"}, status_code=404)
+        if self.config.error_rate and self.rng.random() < self.config.error_rate:
+            self.stats["errors_injected"] += 1
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        if model:
+            self.loaded[model] = time.time()
+        return None
+
+    ###############
+    # 생성 : 줄 서기(max_parallel) --> 첫 토큰까지 대기 --> tps 속도로 토큰
+    async def generate(self, model: str, prompt: str, num_predict: Optional[int]) -> AsyncIterator[Dict[str, Any]]:
+        cfg = self.config
+        n = cfg.max_tokens if not num_predict or num_predict < 0 else min(num_predict, cfg.max_tokens)
+        tokens = fake_tokens(model, prompt, n)
+        prompt_tokens = count_tokens(prompt)
+        fail_at = (self.rng.randrange(n) if cfg.stream_error_rate and self.rng.random() < cfg.stream_error_rate
+                   else None)
+
+        t0 = time.perf_counter_ns()
+        if self.sem is not None:
+            await self.sem.acquire()
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            load = self._delay(cfg.ttft_ms / 1000)
+            prompt_eval = self._delay(prompt_tokens / cfg.prompt_tps)
+            await asyncio.sleep(load + prompt_eval)
+            t_eval = time.perf_counter_ns()
+            for i, tok in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(self._delay(1 / cfg.tps))
+                if i == fail_at:
+                    self.stats["errors_injected"] += 1
+                    yield {"error": "injected stream failure"}
+                    return
+                self.stats["tokens_generated"] += 1
+                yield {"piece": tok}
+            end = time.perf_counter_ns()
+        finally:
+            self.stats["in_flight"] -= 1
+            if self.sem is not None:
+                self.sem.release()
+        yield {"done": True, "done_reason": "length" if num_predict and n >= num_predict else "stop",
+               "total_duration": end - t0, "load_duration": int(load * 1e9),
+               "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prompt_eval * 1e9),
+               "eval_count": n, "eval_duration": end - t_eval}
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        cfg = self.config
+        await asyncio.sleep(self._delay((cfg.embed_ms + cfg.embed_ms_per_text * len(texts)) / 1000))
+        self.stats["texts_embedded"] += len(texts)
+        return [fake_embedding(t, cfg.embed_dim) for t in texts]
+
+
+def _chat_prompt(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{m.get('role', 'user')}: {m.get('content', '')}" for m in messages or [])
+
+
+def _ndjson(parts: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    async def gen():
+        async for p in parts:
+            yield (json.dumps(p, ensure_ascii=False) + "\n").encode("utf-8")
+    return gen()
+
+
+def create_app(config: Optional[FakeConfig] = None) -> FastAPI:
+    fake = FakeOllama(config or FakeConfig())
+    app = FastAPI(title="fake ollama")
+    app.state.fake = fake
+
+    async def respond(model: str, prompt: str, body: Dict[str, Any], chat: bool):
+        num_predict = (body.get("options") or {}).get("num_predict")
+
+        def shape(piece: str) -> Dict[str, Any]:
+            base = {"model": model, "created_at": _now(), "done": False}
+            if chat:
+                return {**base, "message": {"role": "assistant", "content": piece}}
+            return {**base, "response": piece}
+
+        if body.get("stream", True):
+            async def parts():
+                async for p in fake.generate(model, prompt, num_predict):
+                    if "error" in p:
+                        yield p
+                    elif "piece" in p:
+                        yield shape(p["piece"])
+                    else:
+                        yield {**shape(""), **p}
+            return StreamingResponse(_ndjson(parts()), media_type="application/x-ndjson")
+
+        text: List[str] = []
+        final: Dict[str, Any] = {}
+        async for p in fake.generate(model, prompt, num_predict):
+            if "error" in p:
+                return JSONResponse(p, status_code=500)
+            if "piece" in p:
+                text.append(p["piece"])
+            else:
+                final = p
+        return {**shape("".join(text)), **final}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        fake.count("/api/generate")
+        model = body.get("model", "")
+        if (err := fake.check(model)) is not None:
+            return err
+        return await respond(model, body.get("prompt", ""), body, chat=False)
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        fake.count("/api/chat")
+        model = body.get("model", "")
+        if (err := fake.check(model)) is not None:
+            return err
+        return await respond(model, _chat_prompt(body.get("messages")), body, chat=True)
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        fake.count("/api/embed")
+        model = body.get("model", "")
+        if (err := fake.check(model)) is not None:
+            return err
+        inp = body.get("input", "")
+        texts = [inp] if isinstance(inp, str) else list(inp)
+        t0 = time.perf_counter_ns()
+        embs = await fake.embed(texts)
+        return {"model": model, "embeddings": embs, "total_duration": time.perf_counter_ns() - t0,
+                "load_duration": 0, "prompt_eval_count": sum(count_tokens(t) for t in texts)}
+
+    # 예전 API : {"prompt": "..."} --> {"embedding": [...]}  (ollama-start는 input 리스트를 보냄)
+    @app.post("/api/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        fake.count("/api/embeddings")
+        model = body.get("model", "")
+        if (err := fake.check(model)) is not None:
+            return err
+        inp = body.get("prompt", body.get("input", ""))
+        if isinstance(inp, list):
+            return {"embeddings": await fake.embed([str(t) for t in inp])}
+        return {"embedding": (await fake.embed([inp]))[0]}
+
+    @app.get("/api/tags")
+    async def tags():
+        fake.count("/api/tags")
+        return {"models": [_model_info(m) for m in fake.config.models]}
+
+    @app.get("/api/ps")
+    async def ps():
+        fake.count("/api/ps")
+        models = []
+        for m, used in sorted(fake.loaded.items()):
+            expires = datetime.fromtimestamp(used, timezone.utc) + timedelta(minutes=5)
+            if expires > datetime.now(timezone.utc):
+                models.append({**_model_info(m), "expires_at": expires.isoformat(), "size_vram": 0})
+        return {"models": models}
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/")
+    async def root():
+        return PlainTextResponse("Ollama is running")
+
+    @app.get("/_fake/stats")
+    async def stats():
+        return fake.stats
+
+    return app
+
+
+def _model_info(name: str) -> Dict[str, Any]:
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+    family = name.split(":")[0]
+    return {"name": name, "model": name, "modified_at": "2024-01-01T00:00:00Z", "size": 0, "digest": digest,
+            "details": {"format": "gguf", "family": family, "families": [family], "parameter_size": "fake",
+                        "quantization_level": "fake"}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic fake Ollama server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", default=",".join(FakeConfig().models), help="Comma separated model names")
+    d = FakeConfig()
+    for name in ("embed_dim", "max_tokens", "max_parallel", "seed"):
+        parser.add_argument(f"--{name}", type=int, default=getattr(d, name))
+    for name in ("ttft_ms", "prompt_tps", "tps", "embed_ms", "embed_ms_per_text", "jitter",
+                 "error_rate", "stream_error_rate"):
+        parser.add_argument(f"--{name}", type=float, default=getattr(d, name))
+    parser.add_argument("--strict_models", action="store_true", help="404 for models not in --models")
+    args = parser.parse_args()
+
+    config = FakeConfig(**{k: v for k, v in vars(args).items() if k not in ("host", "port", "models")},
+                        models=[m.strip() for m in args.models.split(",") if m.strip()])
+    if config.tps <= 0 or config.prompt_tps <= 0 or not math.isfinite(config.tps):
+        raise SystemExit("tps, prompt_tps는 0보다 커야 합니다")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
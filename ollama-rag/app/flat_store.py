@@ -0,0 +1,399 @@
+# flat_store.py
+# 크로마 대신 쓸 수 있는 "납작한(flat)" 벡터 저장소
+#
+# 크로마는 sqlite + HNSW 색인이라 시작할 때 색인을 읽어오는 시간과 질문마다 붙는 오버헤드가 있음.
+# 문서가 수십만 개 이하라면 모든 벡터와 한 번에 거리 계산(행렬 x 벡터)을 해도 충분히 빠르고 결과도 정확함(exact top-k).
+#
+# 폴더 구조 (chroma_data/flat/rag_docs/)
+#   vectors.bin  : 벡터 행렬 (float16 또는 int8, 행 = slot)   --> np.memmap
+#   norms.bin    : 행마다 |x|^2 (float32)                       --> L2 거리 계산용
+#   scales.bin   : int8일 때 행마다 배율 (float32)
+#   alive.bin    : 행이 살아있는지 (uint8, 삭제되면 0)
+#   meta.sqlite3 : slot <-> 청크 id, 문서 본문, 메타데이터(json)   (sidecar)
+#
+# - 파일을 mmap으로 열기만 하므로 시작이 즉시 끝나고, uvicorn worker 여러 개가 같은 페이지(OS page cache)를 같이 씀.
+# - 쓰기는 sqlite 트랜잭션(BEGIN IMMEDIATE)으로 프로세스끼리도 한 번에 하나씩.
+# - 크로마 collection과 같은 함수(upsert/update/delete/get/query/count)를 제공 --> ChromaRAG가 그대로 씀 (vector_store.py)
+# - 거리는 크로마 기본값과 같은 L2 제곱 거리.
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DTYPES = ('float16', 'int8', 'float32')
+_BLOCK = 8192  # 거리 계산을 몇 행씩 나눠서 할지 (float32로 바꾸는 임시 메모리 제한, 캐시에 들어가는 크기)
+_SQL_OPS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+# 크로마 where 조건 --> sqlite WHERE 절
+# {"source": "a"}, {"page": {"$gte": 3}}, {"source": {"$in": [...]}}, {"$and": [...]}, {"$or": [...]}
+def where_to_sql(where: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    clauses: List[str] = []
+    params: List[Any] = []
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(c) for c in cond]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(p[0] for p in parts) + ")")
+            for p in parts:
+                params.extend(p[1])
+            continue
+        # source/filename은 인덱스가 있는 컬럼, 나머지는 json 안에서 찾음
+        col = key if key in ("source", "filename") else "json_extract(metadata, ?)"
+        col_params = [] if key in ("source", "filename") else ["$." + key]
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, value in cond.items():
+            if op in ("$in", "$nin"):
+                if not value:
+                    clauses.append("0" if op == "$in" else "1")
+                    continue
+                marks = ",".join("?" * len(value))
+                clauses.append(f"{col} {'IN' if op == '$in' else 'NOT IN'} ({marks})")
+                params.extend(col_params)
+                params.extend(value)
+            elif op in _SQL_OPS:
+                clauses.append(f"{col} {_SQL_OPS[op]} ?")
+                params.extend(col_params)
+                params.append(value)
+            else:
+                raise ValueError(f"지원하지 않는 where 연산자: {op}")
+    return (" AND ".join(clauses) or "1"), params
+
+
+class FlatVectorStore:
+    def __init__(self, path: str, dtype: str = 'float16'):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype은 {DTYPES} 중 하나여야 합니다: {dtype}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(path, 'meta.sqlite3'), check_same_thread=False,
+                                     isolation_level=None)  # 트랜잭션은 직접 BEGIN/COMMIT
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            " slot INTEGER PRIMARY KEY,"
+            " id TEXT NOT NULL UNIQUE,"
+            " source TEXT,"
+            " filename TEXT,"
+            " document TEXT,"
+            " metadata TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS rows_source ON rows (source, filename)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS free (slot INTEGER PRIMARY KEY)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        # 처음 만든 dtype을 저장해두고 계속 그걸 씀 (나중에 다른 dtype을 줘도 파일 형식은 안 바뀜)
+        self._conn.execute("INSERT OR IGNORE INTO info (key, value) VALUES ('dtype', ?)", (dtype,))
+        self.dtype = self._info('dtype')
+        self.dim = int(self._info('dim') or 0)
+        self._capacity = 0
+        self._maps: Dict[str, np.memmap] = {}
+        self._remap()
+
+    ###############
+    # 파일 / mmap 관리
+    def _info(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name + '.bin')
+
+    def _layout(self) -> Dict[str, Tuple[np.dtype, int]]:
+        # 파일 이름 --> (dtype, 행 하나의 원소 수)
+        out = {'vectors': (np.dtype(self.dtype), self.dim), 'norms': (np.dtype(np.float32), 1),
+               'alive': (np.dtype(np.uint8), 1)}
+        if self.dtype == 'int8':
+            out['scales'] = (np.dtype(np.float32), 1)
+        return out
+
+    # 다른 프로세스가 파일을 키웠으면(capacity 변경) 다시 mmap
+    def _remap(self) -> None:
+        if not self.dim:
+            self.dim = int(self._info('dim') or 0)
+            if not self.dim:
+                return
+        path = self._file('alive')
+        capacity = os.path.getsize(path) if os.path.exists(path) else 0
+        if capacity == self._capacity and self._maps:
+            return
+        self._maps = {}
+        if capacity:
+            for name, (dt, width) in self._layout().items():
+                shape = (capacity, width) if width > 1 else (capacity,)
+                self._maps[name] = np.memmap(self._file(name), dtype=dt, mode='r+', shape=shape)
+        self._capacity = capacity
+
+    def _grow(self, need: int) -> None:
+        if need <= self._capacity:
+            return
+        capacity = max(1024, self._capacity)
+        while capacity < need:
+            capacity *= 2
+        self._maps = {}  # 파일 크기를 바꾸기 전에 mmap을 닫음
+        for name, (dt, width) in self._layout().items():
+            with open(self._file(name), 'ab') as f:
+                f.truncate(capacity * width * dt.itemsize)  # 늘어난 부분은 0 (alive=0)
+        self._capacity = 0
+        self._remap()
+
+    @contextmanager
+    def _write(self) -> Iterator[None]:
+        # 같은 프로세스 안에서는 lock, 다른 프로세스와는 sqlite 쓰기 트랜잭션으로 한 번에 하나씩
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._remap()
+                yield
+                for m in self._maps.values():
+                    m.flush()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    ###############
+    # 벡터 저장 형식 변환
+    def _encode(self, vecs: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]:
+        # --> (저장할 행렬, int8 배율, |복원한 벡터|^2)
+        if self.dtype == 'int8':
+            scales = np.abs(vecs).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            q = np.clip(np.rint(vecs / scales[:, None]), -127, 127).astype(np.int8)
+            restored = q.astype(np.float32) * scales[:, None]
+            return q, scales.astype(np.float32), np.einsum('ij,ij->i', restored, restored)
+        stored = vecs.astype(self.dtype)
+        restored = stored.astype(np.float32)
+        return stored, None, np.einsum('ij,ij->i', restored, restored)
+
+    def _decode(self, slots: np.ndarray) -> np.ndarray:
+        vecs = np.asarray(self._maps['vectors'][slots], dtype=np.float32)
+        if self.dtype == 'int8':
+            vecs *= self._maps['scales'][slots][:, None]
+        return vecs
+
+    ###############
+    # 크로마 collection과 같은 함수들
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def upsert(self, ids: List[str], embeddings: Sequence[Sequence[float]],
+               documents: Optional[List[str]] = None, metadatas: Optional[List[Dict[str, Any]]] = None) -> None:
+        if not ids:
+            return
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        with self._write():
+            if not self.dim:
+                self.dim = vecs.shape[1]
+                self._conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('dim', ?)", (str(self.dim),))
+            if vecs.shape[1] != self.dim:
+                raise ValueError(f"벡터 차원 불일치: 저장소 {self.dim}, 입력 {vecs.shape[1]}")
+
+            slots = self._allocate(ids)
+            self._grow(int(slots.max()) + 1)
+            stored, scales, norms = self._encode(vecs)
+            self._maps['vectors'][slots] = stored
+            if scales is not None:
+                self._maps['scales'][slots] = scales
+            self._maps['norms'][slots] = norms
+            self._maps['alive'][slots] = 1
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rows (slot, id, source, filename, document, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                [(int(s), _id, (m or {}).get("source"), (m or {}).get("filename"), d,
+                  json.dumps(m, ensure_ascii=False) if m is not None else None)
+                 for s, _id, d, m in zip(slots, ids, documents, metadatas)],
+            )
+
+    add = upsert
+
+    # id마다 slot 배정 : 이미 있으면 그 자리, 없으면 빈 자리(free) --> 맨 뒤
+    def _allocate(self, ids: List[str]) -> np.ndarray:
+        existing = dict(self._select("SELECT id, slot FROM rows WHERE id IN ({})", ids))
+        free = [r[0] for r in self._conn.execute("SELECT slot FROM free ORDER BY slot LIMIT ?", (len(ids),))]
+        if free:
+            self._conn.executemany("DELETE FROM free WHERE slot = ?", [(s,) for s in free])
+        top = self._conn.execute(
+            "SELECT MAX(m) FROM (SELECT MAX(slot) AS m FROM rows UNION ALL SELECT MAX(slot) FROM free)"
+        ).fetchone()[0]
+        # (위에서 free 테이블에서 뺀 자리도 top보다 클 수 있으므로 같이 비교)
+        nxt = max(-1 if top is None else top, max(free, default=-1))
+        out = []
+        seen: Dict[str, int] = {}
+        for _id in ids:
+            if _id in seen:
+                out.append(seen[_id])
+                continue
+            if _id in existing:
+                slot = existing[_id]
+            elif free:
+                slot = free.pop(0)
+            else:
+                nxt += 1
+                slot = nxt
+            seen[_id] = slot
+            out.append(slot)
+        # 다 못 쓴 빈 자리는 돌려놓음
+        if free:
+            self._conn.executemany("INSERT INTO free (slot) VALUES (?)", [(s,) for s in free])
+        return np.asarray(out, dtype=np.int64)
+
+    def _select(self, sql: str, ids: Sequence[str]) -> List[tuple]:
+        out: List[tuple] = []
+        for start in range(0, len(ids), 500):
+            part = list(ids[start:start + 500])
+            out.extend(self._conn.execute(sql.format(",".join("?" * len(part))), part))
+        return out
+
+    def update(self, ids: List[str], metadatas: Optional[List[Dict[str, Any]]] = None,
+               documents: Optional[List[str]] = None, embeddings: Optional[Sequence[Sequence[float]]] = None) -> None:
+        if embeddings is not None:
+            # 벡터가 바뀌면 upsert와 같음 (없는 id는 크로마처럼 무시)
+            got = self.get(ids=ids, include=["documents", "metadatas"])
+            keep = {i: (d, m) for i, d, m in zip(got["ids"], got["documents"], got["metadatas"])}
+            idx = [k for k, _id in enumerate(ids) if _id in keep]
+            self.upsert([ids[k] for k in idx], [embeddings[k] for k in idx],
+                        [documents[k] if documents else keep[ids[k]][0] for k in idx],
+                        [{**(keep[ids[k]][1] or {}), **(metadatas[k] if metadatas else {})} for k in idx])
+            return
+        with self._write():
+            current = dict(self._select("SELECT id, metadata FROM rows WHERE id IN ({})", ids))
+            for k, _id in enumerate(ids):
+                if _id not in current:
+                    continue
+                if metadatas is not None:
+                    # 크로마처럼 기존 메타데이터에 합침
+                    meta = {**json.loads(current[_id] or "{}"), **(metadatas[k] or {})}
+                    self._conn.execute("UPDATE rows SET metadata = ?, source = ?, filename = ? WHERE id = ?",
+                                       (json.dumps(meta, ensure_ascii=False), meta.get("source"),
+                                        meta.get("filename"), _id))
+                if documents is not None:
+                    self._conn.execute("UPDATE rows SET document = ? WHERE id = ?", (documents[k], _id))
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        with self._write():
+            slots = [r[0] for r in self._match_rows("slot", ids, where)]
+            if not slots:
+                return
+            arr = np.asarray(slots, dtype=np.int64)
+            self._maps['alive'][arr] = 0
+            self._conn.executemany("DELETE FROM rows WHERE slot = ?", [(s,) for s in slots])
+            self._conn.executemany("INSERT OR IGNORE INTO free (slot) VALUES (?)", [(s,) for s in slots])
+
+    def _match_rows(self, cols: str, ids: Optional[Sequence[str]], where: Optional[Dict[str, Any]],
+                    limit: Optional[int] = None, offset: Optional[int] = None) -> List[tuple]:
+        sql = f"SELECT {cols} FROM rows WHERE "
+        params: List[Any] = []
+        if where:
+            w, params = where_to_sql(where)
+            sql += w
+        else:
+            sql += "1"
+        if ids is not None:
+            out: List[tuple] = []
+            for start in range(0, len(ids), 500):
+                part = list(ids[start:start + 500])
+                q = sql + " AND id IN (%s)" % ",".join("?" * len(part))
+                out.extend(self._conn.execute(q, params + part))
+            return out
+        sql += " ORDER BY slot"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [-1 if limit is None else limit, offset or 0]
+        return list(self._conn.execute(sql, params))
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ("metadatas", "documents")) -> Dict[str, Any]:
+        rows = self._match_rows("slot, id, document, metadata", ids, where, limit, offset)
+        out: Dict[str, Any] = {"ids": [r[1] for r in rows], "documents": None, "metadatas": None, "embeddings": None}
+        if "documents" in include:
+            out["documents"] = [r[2] for r in rows]
+        if "metadatas" in include:
+            out["metadatas"] = [json.loads(r[3]) if r[3] is not None else None for r in rows]
+        if "embeddings" in include:
+            with self._lock:
+                self._remap()
+                slots = np.asarray([r[0] for r in rows], dtype=np.int64)
+                out["embeddings"] = self._decode(slots) if len(slots) else np.zeros((0, self.dim), np.float32)
+        return out
+
+    ###############
+    # 검색 : 모든 살아있는 행과 L2 제곱 거리를 계산해서 가까운 n_results개 (정확한 top-k)
+    #   |x - q|^2 = |x|^2 - 2 x·q + |q|^2   (|x|^2는 norms.bin에 미리 저장)
+    def query(self, query_embeddings: Sequence[Sequence[float]], n_results: int = 10,
+              where: Optional[Dict[str, Any]] = None,
+              include: Sequence[str] = ("metadatas", "documents", "distances")) -> Dict[str, Any]:
+        qs = np.asarray(query_embeddings, dtype=np.float32)
+        with self._lock:
+            self._remap()
+            dist, slots = self._distances(qs, where)
+
+        out: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for d in dist:
+            k = min(n_results, int(np.isfinite(d).sum()))
+            if k <= 0:
+                for key in out:
+                    out[key].append([])
+                continue
+            top = np.argpartition(d, k - 1)[:k] if k < len(d) else np.arange(len(d))
+            top = top[np.argsort(d[top], kind="stable")]
+            top = top[np.isfinite(d[top])]
+            rows = {r[0]: r for r in self._select(
+                "SELECT slot, id, document, metadata FROM rows WHERE slot IN ({})",
+                [int(s) for s in slots[top]])}
+            hits = [(rows[int(s)], float(dd)) for s, dd in zip(slots[top], d[top]) if int(s) in rows]
+            out["ids"].append([r[1] for r, _ in hits])
+            out["documents"].append([r[2] for r, _ in hits])
+            out["metadatas"].append([json.loads(r[3]) if r[3] is not None else None for r, _ in hits])
+            out["distances"].append([dd for _, dd in hits])
+        for key in ("documents", "metadatas", "distances"):
+            if key not in include:
+                out[key] = None
+        return out
+
+    def _distances(self, qs: np.ndarray, where: Optional[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        # --> (질문 수 x 후보 수 거리 행렬, 후보 slot 배열). 삭제된 행은 inf
+        if not self._maps:
+            return np.zeros((len(qs), 0), np.float32), np.zeros(0, np.int64)
+        q_norm = np.einsum('ij,ij->i', qs, qs)[:, None]
+        if where:
+            # 조건에 맞는 행만 골라서 계산 (source/filename은 인덱스로 바로 찾음)
+            slots = np.asarray([r[0] for r in self._match_rows("slot", None, where)], dtype=np.int64)
+            if not len(slots):
+                return np.zeros((len(qs), 0), np.float32), slots
+            d = self._maps['norms'][slots][None, :] - 2.0 * (self._decode(slots) @ qs.T).T + q_norm
+            return d, slots
+
+        top = self._conn.execute(
+            "SELECT MAX(m) FROM (SELECT MAX(slot) AS m FROM rows UNION ALL SELECT MAX(slot) FROM free)"
+        ).fetchone()[0]
+        n = min(self._capacity, (top or 0) + 1)
+        vectors, norms, alive = self._maps['vectors'], self._maps['norms'], self._maps['alive']
+        scales = self._maps.get('scales')
+        d = np.empty((len(qs), n), dtype=np.float32)
+        for s in range(0, n, _BLOCK):
+            e = min(n, s + _BLOCK)
+            if self.dtype == 'float32':
+                dots = np.asarray(vectors[s:e]) @ qs.T
+            else:
+                dots = vectors[s:e].astype(np.float32) @ qs.T
+                if scales is not None:
+                    dots *= scales[s:e][:, None]
+            d[:, s:e] = (norms[s:e][:, None] - 2.0 * dots).T + q_norm
+        d[:, np.asarray(alive[:n]) == 0] = np.inf
+        return d, np.arange(n, dtype=np.int64)
+
+    def close(self) -> None:
+        with self._lock:
+            self._maps = {}
+            self._conn.close()
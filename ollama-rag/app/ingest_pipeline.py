@@ -0,0 +1,222 @@
+# ingest_pipeline.py
+# PDF 적재를 단계별로 나눠서 동시에 돌리는 파이프라인
+#
+#   [추출+청킹] --embed_q--> [임베딩 x embed_workers] --write_q--> [크로마 저장]
+#    (호출한 스레드)            (스레드 여러 개)                      (스레드 1개)
+#
+# - 페이지가 추출되는 대로 청크가 만들어지고, 청크 묶음(batch)이 바로 임베딩으로 넘어감.
+# - 추출(CPU)과 임베딩(ollama http, I/O)이 겹쳐서 돌아가므로
+#   전체 시간이 (추출 + 임베딩)이 아니라 max(추출, 임베딩)에 가까워짐.
+# - 큐 크기(queue_size)가 정해져 있어서 임베딩이 느리면 추출도 기다림(메모리 폭주 방지).
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+_DONE = object()  # 큐에 "끝났다"를 알리는 표시
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    # 큐가 꽉 차 있으면 기다리되, 다른 단계에서 에러가 나면(stop) 포기함.
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event) -> Any:
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return _DONE
+
+
+def _changed_metadata(rag, kept: List[Tuple[str, Dict[str, Any]]],
+                      batch_size: int = 1000) -> List[Tuple[str, Dict[str, Any]]]:
+    # 이미 있던 청크 중 새로 만든 메타데이터가 저장된 것과 다른 것만
+    changed = []
+    for start in range(0, len(kept), batch_size):
+        part = dict(kept[start:start + batch_size])
+        got = rag._get_metadatas(list(part))
+        changed.extend((_id, meta) for _id, meta in part.items() if got.get(_id) != meta)
+    return changed
+
+
+def run_ingest_pipeline(
+        rag,
+        pieces: Iterable[Union[str, Tuple[int, str]]],
+        source: str,
+        chunk_fn: Callable[[Iterable[Tuple[int, str]]], Iterator[Tuple[str, int, int]]],
+        meta_extra: Optional[Dict[str, Any]] = None,
+        batch_size: Optional[int] = None,
+        embed_workers: int = 4,
+        queue_size: int = 8,
+) -> Dict[str, Any]:
+    """
+    pieces(페이지 텍스트들 또는 (페이지번호, 텍스트)들)를 받아서 청킹 → 임베딩 → 크로마 저장을 동시에 진행합니다.
+    - rag : ChromaRAG
+    - chunk_fn : (페이지번호, 텍스트)들 --> (청크, 시작페이지, 끝페이지)들  (ChromaRAG.page_chunker로 만듦)
+    - 이미 들어있는 청크(같은 id)는 임베딩하지 않고, 문서에서 없어진 청크는 삭제합니다.
+    - 리턴 : {"added", "deleted", "unchanged", "chunks", "pages", "seconds"}
+    """
+    t0 = time.perf_counter()
+    meta_extra = meta_extra or {}
+    filename = meta_extra.get("filename")
+    batch_size = max(1, batch_size or rag.embed_batch_size)
+    embed_workers = max(1, embed_workers)
+
+    old_ids = rag._existing_doc_ids(source, filename)
+    old_set = set(old_ids)
+
+    embed_q: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    write_q: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    ###############
+    # 2단계 : 임베딩 (embed_workers개 스레드가 동시에 ollama 호출)
+    def embed_worker():
+        while True:
+            item = _get(embed_q, stop)
+            if item is _DONE:
+                return
+            try:
+                ids, docs, metas = item
+                embs = rag.embed_many(docs, batch_size=batch_size)
+                _put(write_q, (ids, docs, embs, metas), stop)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                return
+
+    ###############
+    # 3단계 : 크로마 저장 (쓰기는 스레드 1개에서만)
+    def writer():
+        while True:
+            item = _get(write_q, stop)
+            if item is _DONE:
+                return
+            try:
+                ids, docs, embs, metas = item
+                # 중간에 실패했다가 다시 돌려도 같은 id면 덮어쓰도록 upsert
+                # (키워드 색인 갱신, 검색 캐시 무효화도 같이 함)
+                rag._write_chunks(ids=ids, docs=docs, embeddings=embs, metadatas=metas)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                return
+
+    embed_threads = [threading.Thread(target=embed_worker, name=f"embed-{i}", daemon=True)
+                     for i in range(embed_workers)]
+    writer_thread = threading.Thread(target=writer, name="chroma-writer", daemon=True)
+    for t in embed_threads:
+        t.start()
+    writer_thread.start()
+
+    ###############
+    # 1단계 : 추출 + 청킹 (pieces가 generator면 여기서 페이지가 하나씩 추출됨)
+    # pieces는 텍스트 또는 (페이지번호, 텍스트). 페이지번호가 있으면 메타데이터에 넣음.
+    page_count = 0
+    with_pages = False
+
+    def counted(it: Iterable[Union[str, Tuple[int, str]]]) -> Iterator[Tuple[int, str]]:
+        nonlocal page_count, with_pages
+        for p in it:
+            page_count += 1
+            if isinstance(p, tuple):
+                with_pages = True
+                yield p
+            else:
+                yield page_count, p
+
+    def _meta(i: int, page: int, page_end: int) -> Dict[str, Any]:
+        meta = {"chunk": i, "source": source, **meta_extra}
+        if with_pages:
+            meta["page"] = page
+            meta["page_end"] = page_end
+        return meta
+
+    ids: List[str] = []
+    kept: List[Tuple[str, Dict[str, Any]]] = []
+    added = 0
+    seen: Dict[str, int] = {}
+    batch_ids: List[str] = []
+    batch_docs: List[str] = []
+    batch_metas: List[Dict[str, Any]] = []
+    try:
+        chunks = chunk_fn(counted(pieces))
+        for i, (ch, page, page_end) in enumerate(chunks):
+            occ = seen.get(ch, 0)
+            seen[ch] = occ + 1
+            _id = rag.make_chunk_id(ch, source, filename, occ)
+            ids.append(_id)
+
+            if _id in old_set:
+                # 이미 있는 청크 : 임베딩 안 함 (메타데이터가 바뀌었으면 나중에 갱신)
+                kept.append((_id, _meta(i, page, page_end)))
+                continue
+
+            batch_ids.append(_id)
+            batch_docs.append(ch)
+            batch_metas.append(_meta(i, page, page_end))
+            added += 1
+            if len(batch_docs) >= batch_size:
+                if not _put(embed_q, (batch_ids, batch_docs, batch_metas), stop):
+                    break
+                batch_ids, batch_docs, batch_metas = [], [], []
+
+        if batch_docs:
+            _put(embed_q, (batch_ids, batch_docs, batch_metas), stop)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        for _ in embed_threads:
+            _put(embed_q, _DONE, stop)
+        for t in embed_threads:
+            t.join()
+        _put(write_q, _DONE, stop)
+        writer_thread.join()
+
+    if errors:
+        raise errors[0]
+
+    ###############
+    # 마무리 : 없어진 청크 삭제, 메타데이터가 바뀐 청크 갱신, manifest 저장
+    # 추출된 텍스트가 하나도 없으면(스캔본 pdf 등) 기존 데이터는 건드리지 않음.
+    deleted = 0
+    if ids:
+        new_set = set(ids)
+        removed = [_id for _id in old_ids if _id not in new_set]
+        if removed:
+            rag._delete_chunks(removed)
+        deleted = len(removed)
+
+        # 순서(chunk)뿐 아니라 page/page_end 등 메타데이터 전체를 저장된 것과 비교
+        moved = _changed_metadata(rag, kept)
+        if moved:
+            rag._update_chunks([m[0] for m in moved], [m[1] for m in moved])
+
+        rag._save_manifest({
+            "doc_id": rag.make_doc_id(source, filename),
+            "source": source,
+            "filename": filename,
+            "chunk_ids": ids,
+            "updated_at": time.time(),
+        })
+
+    return {
+        "added": added,
+        "deleted": deleted,
+        "unchanged": len(ids) - added,
+        "chunks": len(ids),
+        "pages": page_count,
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
@@ -11,6 +11,15 @@ from fastapi.responses import HTMLResponse
 # from ollama_client import stream_generate
 from redis.asyncio import Redis  # redis-py의 async 클라이언트
 import json
+import time
+from typing import Optional
+
+import metrics
+from metrics import ollama_call, record_ollama_usage
+from chat_history import ChatHistory
+from result_cache import ResultCache
+from single_flight import SingleFlight
+from scheduler import PRIORITY_BATCH, PRIORITY_TASK, GenerationScheduler, Saturated
 
 from chroma_db import ChromaRAG
 from fastapi import UploadFile, File
@@ -23,14 +32,27 @@ class HealthResponse(BaseModel):
     status: str
     ollama_status: str
     message: str
+    scheduler: Optional[dict] = None  # 모델별 slot / 대기열 상태
 
 
 app = FastAPI()
+# /metrics (Prometheus) + 요청마다 시간/동시 요청 수
+metrics.install(app)
 
 # Redis 설정 (로컬 개발 기준, 프로덕션에서는 환경변수로 관리)
 REDIS_URL = "redis://localhost:6379"
 # 앱 상태에 Redis 클라이언트 저장
 app.state.redis = None  # 아직 연결안됨. fastapi시작할 때 redis도 연결해두려고 함.
+# 대화 기록 (redis) : 세션마다 최근 CHAT_HISTORY_MAX_MESSAGES개 + 오래된 대화는 요약으로 압축
+CHAT_HISTORY_MAX_MESSAGES = 40  # redis에 남기는 최대 메시지 수 (넘으면 LTRIM)
+CHAT_HISTORY_TTL = 7 * 24 * 3600  # 마지막 대화 후 이 시간(초)이 지나면 기록 삭제 (EXPIRE)
+CHAT_HISTORY_TOKEN_BUDGET = 1500  # 프롬프트에 넣는 기록의 최대 토큰 수 (넘으면 요약으로 압축)
+CHAT_HISTORY_KEEP_RECENT = 6  # 압축할 때 그대로 남기는 최근 메시지 수
+CHAT_HISTORY_ENCODING = "json"  # "msgpack"이면 msgpack(+zlib)으로 저장 --> redis 메모리 절약 (pip install msgpack)
+CHAT_HISTORY_PAGE_LIMIT = 200  # /chat-history 한 번에 주는 최대 메시지 수
+CHAT_HISTORY_EXPORT_BATCH = 500  # /chat-history/{id}/export 에서 redis에서 한 번에 읽는 메시지 수
+app.state.chat_history = None
+app.state.chat_history_redis = None  # msgpack일 때 쓰는 바이너리 클라이언트 (decode_responses=False)
 
 # Static 파일 설정 (CSS, JS, 이미지 등)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -52,6 +74,121 @@ templates = Jinja2Templates(directory="templates")
 MODEL = "gemma3:1b"
 OLLAMA_BASE_URL = "http://localhost:11434"
 
+# ollama 클라이언트 (앱 전체에서 1개) : 요청마다 클라이언트/TCP 연결을 새로 만들지 않고 keep-alive 연결을 재사용
+OLLAMA_MAX_CONNECTIONS = 32  # ollama로 동시에 열 수 있는 연결 수
+OLLAMA_MAX_KEEPALIVE = 16  # 쉬는 동안에도 열어두는 연결 수
+OLLAMA_KEEPALIVE_EXPIRY = 60.0  # 이 시간(초) 동안 안 쓴 연결은 닫음
+OLLAMA_CONNECT_TIMEOUT = 5.0  # ollama에 연결이 안 되면 바로 실패
+OLLAMA_READ_TIMEOUT = 300.0  # 응답(스트리밍이면 다음 조각)을 기다리는 최대 시간
+# 엔드포인트별 전체 응답 제한 시간(초) : 넘으면 504
+OLLAMA_TIMEOUTS = {
+    "health": 5.0,
+    "default": 120.0,
+    "summarize": 60.0,
+    "translate": 60.0,
+    "sentiment": 30.0,
+    "names": 30.0,
+    "brainstorm": 120.0,
+    "poem": 120.0,
+    "recipe": 120.0,
+    "chat": 180.0,
+    "stream": 180.0,  # /stream : 넘으면 그때까지 보낸 것으로 스트림을 끝냄 (slot 반납)
+}
+STREAM_TIMEOUT_TEXT = "\n\n[응답 시간 초과로 중단됨]"
+app.state.ollama = None
+
+# 입장 제어 (scheduler.py) : 모델마다 동시에 ollama로 보내는 생성 수를 제한하고 나머지는 우선순위 대기열에서 기다림
+# 대기열이 꽉 차거나 너무 오래 기다리면 429 + Retry-After
+OLLAMA_NUM_PARALLEL = 4  # ollama 서버의 OLLAMA_NUM_PARALLEL과 같게 (모델마다 동시에 처리하는 요청 수)
+OLLAMA_MAX_QUEUE = 64  # 모델마다 기다릴 수 있는 요청 수
+# ollama 서버 전체(GPU 하나)에서 동시에 처리하는 요청 수 : 생성(gemma3)과 임베딩(nomic-embed-text)이 같이 씀
+# --> /chat 생성과 /ingest 임베딩이 같은 우선순위 대기열에서 경쟁 (적재가 몰려도 대화가 먼저 slot을 받음)
+OLLAMA_TOTAL_SLOTS = OLLAMA_NUM_PARALLEL
+# 경로별 우선순위 (없는 경로는 대화 우선순위 : /chat, /stream, /ask ...)
+ROUTE_PRIORITY = {
+    "/summarize": PRIORITY_TASK,
+    "/translate": PRIORITY_TASK,
+    "/sentiment": PRIORITY_TASK,
+    "/brainstorm": PRIORITY_TASK,
+    "/poem": PRIORITY_TASK,
+    "/recipe": PRIORITY_TASK,
+    "/names": PRIORITY_TASK,
+    "/ingest_texts": PRIORITY_BATCH,
+    "/ingest_pdf": PRIORITY_BATCH,
+}
+scheduler = GenerationScheduler(default_slots=OLLAMA_NUM_PARALLEL, max_queue=OLLAMA_MAX_QUEUE,
+                                total_slots=OLLAMA_TOTAL_SLOTS)
+scheduler.install(app, route_priority=ROUTE_PRIORITY)
+
+
+def ollama_client() -> ollama.AsyncClient:
+    if app.state.ollama is None:
+        app.state.ollama = ollama.AsyncClient(
+            host=OLLAMA_BASE_URL,
+            timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return app.state.ollama
+
+
+# 제한 시간 안에 안 끝나면 504 (연결은 취소되고 풀로 돌아감)
+async def _with_timeout(call, timeout: Optional[float]):
+    try:
+        return await asyncio.wait_for(call, timeout or OLLAMA_TIMEOUTS["default"])
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Ollama 응답 시간 초과")
+
+
+# ollama 호출 + 지표(호출 시간, 동시 호출 수, 토큰 수, tokens/s)
+# priority를 안 주면 요청 경로의 우선순위 (ROUTE_PRIORITY)
+async def ollama_generate(timeout: Optional[float] = None, priority: Optional[int] = None, **kwargs):
+    model = kwargs.get("model", MODEL)
+    async with scheduler.slot(model, priority):
+        with ollama_call("generate", model):
+            response = await _with_timeout(ollama_client().generate(**kwargs), timeout)
+    record_ollama_usage(model, response)
+    return response
+
+
+async def ollama_chat(timeout: Optional[float] = None, priority: Optional[int] = None, **kwargs):
+    model = kwargs.get("model", MODEL)
+    async with scheduler.slot(model, priority):
+        with ollama_call("chat", model):
+            response = await _with_timeout(ollama_client().chat(**kwargs), timeout)
+    record_ollama_usage(model, response)
+    return response
+
+
+# 작업 엔드포인트(/summarize, /translate, /sentiment) : 같은 (모델, 프롬프트, options) 요청은 생성 1번으로
+#   - 동시에 들어온 같은 요청 --> 진행 중인 생성을 같이 기다림 (single-flight)
+#   - 끝난 결과 --> TASK_CACHE_TTL초 동안 메모리에 저장 (완전히 같은 요청만, LRU). TASK_CACHE_SIZE = 0이면 안 씀
+#   - 같은 입력이면 같은 결과가 나와야 결과를 나눠 써도 맞음 --> 이 엔드포인트들은 temperature 0으로 고정 (TASK_OPTIONS)
+#   - 응답의 "cached" : 저장해둔 결과나 진행 중이던 다른 요청의 결과를 받았으면 true
+TASK_CACHE_SIZE = 1024
+TASK_CACHE_TTL = 3600.0  # 초
+TASK_OPTIONS = {"temperature": 0}
+task_flight = SingleFlight()
+task_cache: Optional[ResultCache] = ResultCache(TASK_CACHE_SIZE, ttl=TASK_CACHE_TTL) if TASK_CACHE_SIZE > 0 else None
+
+
+async def ollama_generate_shared(timeout: Optional[float] = None, use_cache: bool = True, **kwargs):
+    """리턴 : (응답, 저장해둔 결과 또는 진행 중이던 다른 요청의 결과를 받았으면 True)"""
+    kwargs["options"] = {**kwargs.get("options", {}), **TASK_OPTIONS}
+    key = SingleFlight.key(op="generate", **{"model": MODEL, **kwargs})
+    if use_cache and task_cache is not None:
+        cached = task_cache.get(key)
+        if cached is not None:
+            return cached, True
+    response, shared = await task_flight.do(key, lambda: ollama_generate(timeout=timeout, **kwargs))
+    if task_cache is not None:
+        task_cache.put(key, response)
+    return response, shared
+
+
 @app.get("/")
 def read_root(request: Request):
     return templates.TemplateResponse("index.html", context={"request": request})
@@ -65,40 +202,43 @@ def ollamatest(request: Request):
 async def health_check():
     """FastAPI와 Ollama의 health 상태를 확인하는 엔드포인트"""
     try:
-        # Ollama health check
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5.0)
-
-        if response.status_code == 200:
-            ollama_status = "healthy"
-            message = "fastapi & ollama 제대로 동작중"
-        else:
-            ollama_status = "unhealthy"
-            message = f"Ollama returned status code: {response.status_code}"
-
-    except httpx.ConnectError:
+        # Ollama health check (/api/tags, 앱 전체 ollama 클라이언트의 연결 재사용)
+        await asyncio.wait_for(ollama_client().list(), OLLAMA_TIMEOUTS["health"])
+        ollama_status = "healthy"
+        message = "fastapi & ollama 제대로 동작중"
+
+    except ollama.ResponseError as e:
+        ollama_status = "unhealthy"
+        message = f"Ollama returned status code: {e.status_code}"
+    except ConnectionError:
         ollama_status = "연결불가"
         message = "Ollama 연결할 수 없음."
-    except httpx.TimeoutException:
+    except (asyncio.TimeoutError, httpx.TimeoutException):
         ollama_status = "타임아웃"
         message = "Ollama 타임 아웃"
     except Exception as e:
         ollama_status = "error"
         message = f"Error checking Ollama: {str(e)}"
 
+    if scheduler.saturated():
+        message += " (ollama 대기열에 기다리는 요청 있음)"
+
     return HealthResponse(
         status="ok",
         ollama_status=ollama_status,
-        message=message
+        message=message,
+        scheduler=scheduler.stats(),
     )
 
 
 # 앱 시작 시 모델 미리 로드 (preload)
 @app.on_event("startup")
 async def preload_model():
+    ollama_client()
     try:
         # 빈 프롬프트로 모델 로드 + 영구 유지
-        await ollama.AsyncClient().generate(
+        await ollama_generate(
+            timeout=OLLAMA_READ_TIMEOUT,  # 처음 모델을 올리는 건 오래 걸릴 수 있음
             model=MODEL,
             prompt=" ",  # 빈 프롬프트 (또는 "preload" 같은 더미 텍스트)
             keep_alive=-1  # -1: 영구적으로 메모리에 유지
@@ -107,6 +247,18 @@ async def preload_model():
 
         app.state.redis = Redis.from_url(url=REDIS_URL, decode_responses=True)
         # decode_responses=True --> 바이트스트림으로 도착한 데이터 utf-8로 자동으로 변환
+        history_redis = app.state.redis
+        if CHAT_HISTORY_ENCODING != "json":
+            # 압축된 바이트를 그대로 넣고 꺼내야 하므로 utf-8 변환을 안 하는 클라이언트를 따로 씀
+            history_redis = app.state.chat_history_redis = Redis.from_url(url=REDIS_URL)
+        app.state.chat_history = ChatHistory(
+            history_redis,
+            max_messages=CHAT_HISTORY_MAX_MESSAGES,
+            ttl=CHAT_HISTORY_TTL,
+            token_budget=CHAT_HISTORY_TOKEN_BUDGET,
+            keep_recent=CHAT_HISTORY_KEEP_RECENT,
+            encoding=CHAT_HISTORY_ENCODING,
+        )
 
         print(f"{REDIS_URL}로 Redis서버 미리 연결됨.")
 
@@ -114,19 +266,35 @@ async def preload_model():
         print(f"모델 preload 실패 또는 Redis연결 실패 : {e}")
 
 
+# 작업 엔드포인트 캐시/요청 합치기 상태
+@app.get("/task_cache_stats")
+async def task_cache_stats():
+    return {
+        "single_flight": task_flight.stats(),
+        "cache": task_cache.stats() if task_cache is not None else {"enabled": False},
+    }
+
+
 # fastapi서버가 종료(재부팅)되었을 때 자동 호출됨.
 @app.on_event("shutdown")
 async def shutdown_event():
     if app.state.redis:
         await app.state.redis.close()
         print("redis 연결 종료됨.....")
+    if app.state.chat_history_redis:
+        await app.state.chat_history_redis.close()
+    # ollama keep-alive 연결 정리
+    if app.state.ollama is not None:
+        await app.state.ollama.close()
+        app.state.ollama = None
 
 
 # 일반 generate 엔드포인트 (스트리밍 없이 전체 응답)
 @app.get("/chat")
 async def generate(word: str, request: Request):
     try:
-        response = await ollama.AsyncClient().generate(
+        response = await ollama_generate(
+            timeout=OLLAMA_TIMEOUTS["chat"],
             model=MODEL,
             prompt=word,
             options={"temperature": 1},
@@ -136,30 +304,67 @@ async def generate(word: str, request: Request):
                                           context={"request": request,
                                                    "result": response["response"]
                                                    })
+    except Saturated:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # 스트리밍 엔드포인트 (실시간 토큰 반환, 더 빠른 체감)
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
 
 @app.get("/stream")
 async def stream(word: str):
-    return StreamingResponse(stream_generate(word), media_type="text/event-stream")
+    lease = await scheduler.acquire(MODEL)
+    # 생성이 끝나거나 클라이언트가 끊으면 slot 반납 (release는 한 번만 반납)
+    return StreamingResponse(stream_generate(word, lease), media_type="text/event-stream",
+                             background=BackgroundTask(lease.release))
 
 
-async def stream_generate(prompt: str):
-    stream = await ollama.AsyncClient().generate(
-        model=MODEL,
-        prompt=prompt,
-        stream=True,
-        keep_alive=-1
-    )
-    async for part in stream:
-        # "이 값을 내보내고, 여기서 잠깐 멈춰. 다음에 다시 불러주면 이어서 할게!"
-        # ollama로 부터 받은 조각마다 보내..
-        yield part["response"]
+async def stream_generate(prompt: str, lease=None):
+    try:
+        async for text in _stream_parts(prompt, OLLAMA_TIMEOUTS["stream"]):
+            yield text
+    finally:
+        if lease is not None:
+            lease.release()
+
+
+# 스트리밍 응답은 504로 바꿀 수 없으므로(이미 보내는 중) 시간이 넘으면 안내 문구를 보내고 끝냄
+# 다음 조각을 기다릴 때마다 남은 시간만큼만 기다림 --> 멈춘 생성이 slot을 OLLAMA_READ_TIMEOUT까지 잡고 있지 않게
+async def _stream_parts(prompt: str, timeout: Optional[float] = None):
+    t0 = time.perf_counter()
+    limit = timeout or OLLAMA_TIMEOUTS["stream"]
+    first = True
+    with ollama_call("generate_stream", MODEL):
+        stream = await ollama_client().generate(
+            model=MODEL,
+            prompt=prompt,
+            stream=True,
+            keep_alive=-1
+        )
+        try:
+            while True:
+                try:
+                    part = await asyncio.wait_for(stream.__anext__(), limit - (time.perf_counter() - t0))
+                except StopAsyncIteration:
+                    break
+                if first:
+                    first = False
+                    metrics.observe_ttft(MODEL, time.perf_counter() - t0)
+                if part.get("done"):
+                    record_ollama_usage(MODEL, part)
+                # "이 값을 내보내고, 여기서 잠깐 멈춰. 다음에 다시 불러주면 이어서 할게!"
+                # ollama로 부터 받은 조각마다 보내..
+                yield part["response"]
+        except asyncio.TimeoutError:
+            print(f"/stream 시간 초과 ({limit}초) --> 스트림 종료")
+            yield STREAM_TIMEOUT_TEXT
+        finally:
+            # ollama 연결(httpx 응답)을 닫음
+            await stream.aclose()
 
 
 @app.get("/ollama-rag2")
@@ -177,6 +382,7 @@ class SummarizeRequest(BaseModel):
     ## BaseModel(변수+함수) + 내가 추가한 변수
     text: str
     max_length: int = 200
+    use_cache: bool = True  # false면 캐시를 건너뛰고 새로 생성
 
 
 @app.post("/summarize")
@@ -185,29 +391,33 @@ async def summarize(request: SummarizeRequest):
     # post방식으로 http요청을 해줌.
     prompt = f"{request.text}를 {request.max_length}자로 요약해주세요."
     print(prompt)
-    response = await ollama.AsyncClient().generate(
+    response, cached = await ollama_generate_shared(
+        timeout=OLLAMA_TIMEOUTS["summarize"],
+        use_cache=request.use_cache,
         model=MODEL,
         prompt=prompt,
         keep_alive=-1
     )
     print("-----------------")
     print(response)  # dict
-    return {'summary': response["response"].strip()}
+    return {'summary': response["response"].strip(), 'cached': cached}
 
 
 class TranslateRequest(BaseModel):
     text: str
+    use_cache: bool = True  # false면 캐시를 건너뛰고 새로 생성
 
 
 @app.post("/translate")
 async def translate(request: TranslateRequest):
     prompt = f"다음 영어 문장을 자연스러운 한국어로 번역해 주세요. 번역만 출력하세요:\n\n{request.text}"
-    response = await ollama.AsyncClient().generate(model=MODEL, prompt=prompt, keep_alive=-1)
-    return {"translation": response["response"].strip()}
+    response, cached = await ollama_generate_shared(timeout=OLLAMA_TIMEOUTS["translate"], use_cache=request.use_cache, model=MODEL, prompt=prompt, keep_alive=-1)
+    return {"translation": response["response"].strip(), "cached": cached}
 
 
 class SentimentRequest(BaseModel):
     text: str
+    use_cache: bool = True  # false면 캐시를 건너뛰고 새로 생성
 
 
 @app.post("/sentiment")
@@ -217,9 +427,9 @@ async def sentiment(request: SentimentRequest):
 
     문장: {request.text}
     """
-    response = await ollama.AsyncClient().generate(model=MODEL, prompt=prompt, keep_alive=-1)
+    response, cached = await ollama_generate_shared(timeout=OLLAMA_TIMEOUTS["sentiment"], use_cache=request.use_cache, model=MODEL, prompt=prompt, keep_alive=-1)
     sentiment = response["response"].strip()
-    return {"sentiment": sentiment}
+    return {"sentiment": sentiment, "cached": cached}
 
 
 class BrainstormRequest(BaseModel):
@@ -233,7 +443,7 @@ async def brainstorm(request: BrainstormRequest):
     주제 '{request.topic}'에 대해 창의적이고 실현 가능한 아이디어를 {request.count}개 제안해 주세요.
     각 아이디어는 번호를 붙이고 한 문장으로 간단히 설명하세요.
     """
-    response = await ollama.AsyncClient().generate(model=MODEL, prompt=prompt, keep_alive=-1)
+    response = await ollama_generate(timeout=OLLAMA_TIMEOUTS["brainstorm"], model=MODEL, prompt=prompt, keep_alive=-1)
     return {"ideas": response["response"].strip()}
 
 
@@ -253,7 +463,7 @@ async def write_poem(request: PoemRequest):
 
     제목도 함께 붙여주세요.
     """
-    response = await ollama.AsyncClient().generate(model=MODEL, prompt=prompt, keep_alive=-1)
+    response = await ollama_generate(timeout=OLLAMA_TIMEOUTS["poem"], model=MODEL, prompt=prompt, keep_alive=-1)
     return {"poem": response["response"].strip()}
 
 
@@ -274,7 +484,7 @@ async def generate_recipe(request: RecipeRequest):
 
     요리 이름도 창의적으로 지어주고, 필요한 추가 재료(조미료 등)는 최소한으로 제안해 주세요.
     """
-    response = await ollama.AsyncClient().generate(model=MODEL, prompt=prompt, keep_alive=-1)
+    response = await ollama_generate(timeout=OLLAMA_TIMEOUTS["recipe"], model=MODEL, prompt=prompt, keep_alive=-1)
     return {"recipe": response["response"].strip()}
 
 
@@ -301,7 +511,8 @@ async def names(request: NameRequest):
             3. 이름 - 간단설명
             """
     print(prompt)
-    response = await ollama.AsyncClient().generate(
+    response = await ollama_generate(
+        timeout=OLLAMA_TIMEOUTS["names"],
         model=MODEL,
         prompt=prompt,
         keep_alive=-1
@@ -383,6 +594,7 @@ chat_histories = {}
 class ChatRequest(BaseModel):
     message: str
     session_id: str = "default"  # 로그인한 아이디
+    use_cache: bool = True  # 비슷한 질문의 답이 의미 캐시에 있으면 그 답을 씀
 
 
 # 기존 /chat 엔드포인트 수정
@@ -390,73 +602,109 @@ class ChatRequest(BaseModel):
 @app.post("/chat")
 async def chat(request: ChatRequest):
     print(f"서버로 전달된 값은 {request.message}, {request.session_id}")
-    history = []
     # prompt를 user_message에 만들어주세요.
     user_message = f"{request.message}를 200자 이내로 답변을 줘라. 단답형으로 줘라. 응답은 리스트 형태로 줘라."
     # ollama.AsyncClient().chat()쓸때는
     # - 내가 쓴 것은 role:user가 되어야만 함.
     # - 응답받은 것은 role:assistant가 됨.
     # ollama에게 질문을 줄때는 [{}]로 주어야함.
+    user_turn = {"role": "user", "content": request.message}
+
+    # redis에서 이 세션의 요약 + 최근 대화를 읽음 (pipeline, 왕복 1번)
+    store = app.state.chat_history
+    summary, history = await store.load(request.session_id) if store is not None else (None, [])
+
+    # 비슷한 질문을 전에 받은 적이 있으면 ollama를 부르지 않고 저장해둔 답을 씀
+    # (앞 대화에 따라 답이 달라지므로 앞 대화가 없는 첫 질문만)
+    cache = app.state.semantic_cache if request.use_cache and not history and not summary else None
+    scope = SemanticCache.scope(kind="chat", model=MODEL)
+    hit, emb = await cache.get(request.message, scope) if cache is not None else (None, None)
+    if hit is not None:
+        ai_message = hit["response"]
+    else:
+        # ollama연결해서 응답받고, 리턴
+        # [요약] + 최근 대화 + 이번 질문 (token budget 안에서)
+        response = await ollama_chat(
+            timeout=OLLAMA_TIMEOUTS["chat"],
+            model=MODEL,
+            messages=store.messages(summary, history, user_turn) if store is not None else [user_turn],
+            keep_alive=-1
+        )
 
-    history.append({"role": "user", "content": request.message})
-
-    # ollama연결해서 응답받고, 리턴
-    response = await ollama.AsyncClient().chat(
-        model=MODEL,
-        messages=history,
-        keep_alive=-1
-    )
-
-    print("-----------------")
-    print(response)
+        print("-----------------")
+        print(response)
 
-    # 올라마의 결과는 dict로 온다.
-    # response변수에 저장함.--> {message : {content : 응답내용}}
-    ai_message = response["message"]["content"]
-    history.append({"role": "assistant", "content": ai_message})
+        # 올라마의 결과는 dict로 온다.
+        # response변수에 저장함.--> {message : {content : 응답내용}}
+        ai_message = response["message"]["content"]
+        if cache is not None:
+            await cache.put(request.message, scope, {"response": ai_message}, emb=emb)
 
-    print("chat_histories>> ", history)
+    new_turns = [user_turn, {"role": "assistant", "content": ai_message}]
+    print("chat_histories>> ", new_turns)
 
     ## redis에 넣자.!
-    session_key = "chat_history:" + request.session_id
-    # history가 있으면 넣자.!!
+    # rpush + ltrim(최근 CHAT_HISTORY_MAX_MESSAGES개만) + expire를 pipeline 한 번으로
+    if store is not None:
+        await store.append(request.session_id, new_turns)
+        # 기록이 token budget을 넘거나 max_messages에 가까워지면 앞부분을 요약으로 압축 (백그라운드)
+        store.schedule_compaction(request.session_id, summary, history + new_turns, _summarize_history)
 
-    redis = app.state.redis
+    if hit is not None:
+        return {"response": ai_message, "cache": hit["cache"]}
+    return {"response": ai_message}
 
-    if history:
-        # redis에는 json으로 넣어주어야한다.
-        # 우리는 dict를 가지고 있다 --> json으로 바꾸어주어야함.
-        # json.dumps(dict)
-        await redis.rpush(session_key, *[json.dumps(one) for one in history])
 
-    return {"response": response['message']['content']}
+# 대화 기록 요약 (ChatHistory가 압축할 때 호출)
+async def _summarize_history(prompt: str) -> str:
+    response = await ollama_generate(timeout=OLLAMA_TIMEOUTS["summarize"], priority=PRIORITY_BATCH, model=MODEL, prompt=prompt, keep_alive=-1)
+    return response["response"]
 
 
-@app.get("/chat-history/{session_id}")
-async def chat_history(session_id: str):
-    # 1. 레디스가 연결이 안되어있으면 500번에러
-    redis = app.state.redis
-    if not redis:  # redis가 None이면
+def _chat_history_store() -> ChatHistory:
+    # 레디스가 연결이 안되어있으면 500번에러
+    store = app.state.chat_history
+    if store is None:
         raise HTTPException(status_code=500, detail="Redis 연결 안됨.")
         # http응답을 보내버림(code, detail을 http 헤더에 넣어서 브라우저에 응답함.)
         # http만들어서 응답하고 끝!
+    return store
+
 
-    # 2. 레이스가 연결이 되어있으면
-    session_key = 'chat_history:' + session_id
-    # [1,2,2,34,354,5435345,35,3,45,353,5,35,35,353,5,3,5,3,4,5,6]
-    # 6은 -1인덱스임.
-
-    #    redis.lrange() 리스트를 불러오자.
-    history_json = await redis.lrange(session_key, 0, -1)
-    print("==========================================")
-    print(history_json)  ## [ '{}', '{}', ...] ==> [{}, {}, {},....]
-    # for문 돌려서 '{}'이렇게 생긴 string을 빼서 json으로 바꿔서,
-    # json의 리스트로 만들어주어야함.
-    history = [json.loads(msg) for msg in history_json]
-    # [{}, {}, {}, ....]
-    print("*********************************")
-    print(history)
-    return {"history": history}
+# 커서 기반 페이지
+#   /chat-history/apple                 : 최근 50개
+#   /chat-history/apple?before=120      : index 120보다 오래된 50개 (응답의 next_before를 그대로 넘기면 됨)
+#   /chat-history/apple?after=120       : index 120 다음부터 50개 (응답의 next_after)
+# 메시지마다 index가 붙어 있고, 남아있는 기록보다 앞의 대화는 summary에 요약되어 있음
+@app.get("/chat-history/{session_id}")
+async def chat_history(session_id: str, limit: int = 50, before: Optional[int] = None,
+                       after: Optional[int] = None):
+    store = _chat_history_store()
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="before와 after는 같이 쓸 수 없습니다.")
+    limit = max(1, min(limit, CHAT_HISTORY_PAGE_LIMIT))
+    return await store.page(session_id, limit=limit, before=before, after=after)
+
+
+# 전체 기록 내보내기 (NDJSON 스트리밍) : 첫 줄은 session_id/summary/total, 그 다음 줄부터 메시지 1개씩 (오래된 것부터)
+# 페이지 단위로 읽어서 바로 보내므로 기록이 길어도 메모리에 전부 올리지 않음
+@app.get("/chat-history/{session_id}/export")
+async def export_chat_history(session_id: str):
+    store = _chat_history_store()
+    first = await store.page(session_id, limit=1)
+
+    async def lines():
+        header = {"session_id": session_id, "summary": first["summary"],
+                  "total": first["total"], "oldest_index": first["oldest_index"]}
+        yield json.dumps(header, ensure_ascii=False) + "\n"
+        async for message in store.iter_all(session_id, batch=CHAT_HISTORY_EXPORT_BATCH):
+            yield json.dumps(message, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="chat-history-{session_id}.ndjson"'},
+    )
 
 ##################################
 # 크로마db test
@@ -466,27 +714,83 @@ async def chat_history(session_id: str):
 from fastapi import HTTPException
 from schemas import *
 from chroma_db import ChromaRAG
+from async_rag import AsyncChromaRAG
+from reranker import Reranker
+from semantic_cache import SemanticCache
 from fastapi import UploadFile, File
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import os
+import shutil
+import tempfile
+
 
+# 재순위(rerank) 모델 : ONNX cross-encoder 폴더 경로 또는 huggingface repo id (None이면 재순위 안 함)
+# 예: RERANK_MODEL = "./models/bge-reranker-v2-m3-onnx"
+RERANK_MODEL = None
 
 # RAG 엔진(전역 1개)
-rag = ChromaRAG(
+# AsyncChromaRAG : ollama 호출은 httpx.AsyncClient 하나(연결 재사용)로 await 함.
+# --> /ask가 답변 생성을 기다리는 동안 스레드풀 스레드를 잡고 있지 않음.
+rag = AsyncChromaRAG(
     chroma_dir="./chroma_data",
     collection_name="rag_docs",
     ollama_base_url="http://localhost:11434",
     embed_model="nomic-embed-text",
     gen_model="gemma3:1b",
+    max_connections=64,         # ollama로 동시에 열 수 있는 연결 수
+    max_keepalive_connections=16,
+    generate_timeout=300.0,
+    reranker=Reranker(RERANK_MODEL) if RERANK_MODEL else None,
+    scheduler=scheduler,        # 임베딩/생성도 같은 대기열 (/ingest 임베딩은 적재 우선순위)
+    rerank_candidates=30,       # 검색은 30개를 가져오고
+    rerank_top_n=4,             # 점수 좋은 4개만 프롬프트에 넣음
+    vector_store="chroma",      # "flat" : mmap 행렬 저장소 (정확한 검색, 바로 시작, worker끼리 메모리 공유)
 )
 
 
+# 의미 답변 캐시 (redis) : 바꿔 말한 비슷한 질문이면 gemma3로 다시 생성하지 않고 저장해둔 답을 돌려줌
+# 범위는 모델 + 컬렉션 버전(/ask는 top_k, 검색 필터도) --> 문서를 적재/삭제하면 예전 답은 안 씀
+SEMANTIC_CACHE_THRESHOLD = 0.92  # 코사인 유사도가 이 이상이면 같은 질문으로 봄
+SEMANTIC_CACHE_TTL = 24 * 3600  # 초
+SEMANTIC_CACHE_MAX_ENTRIES = 5000  # 범위마다 (넘으면 오래 안 쓴 것부터 지움)
+app.state.semantic_cache = None
+
+
+# redis가 연결됐을 때만 켬 (preload_model에서 연결한 app.state.redis를 같이 씀)
+@app.on_event("startup")
+async def open_semantic_cache():
+    if app.state.redis is not None:
+        app.state.semantic_cache = SemanticCache(
+            app.state.redis,
+            embed=rag.aembed,
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            ttl=SEMANTIC_CACHE_TTL,
+            max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+        )
+
+
+# 서버 종료 시 ollama 연결(keep-alive) 정리
+@app.on_event("shutdown")
+async def close_rag():
+    await rag.aclose()
+
+
 # 텍스트를 읽어서 청크--> 임베딩 --> 크로마db에 넣는 요청
 @app.post("/ingest_texts")
-def ingest_texts(req: IngestTextsRequest):
+async def ingest_texts(req: IngestTextsRequest):
     if not req.texts:
         raise HTTPException(status_code=400, detail="texts is empty")
 
-    added = rag.ingest_texts(req.texts, source=req.source)
-    return {"docs_added": added, "total_docs": rag.count()}
+    added = await rag.aingest_texts(req.texts, source=req.source)
+    return {"docs_added": added, "total_docs": await run_in_threadpool(rag.count)}
+
+# 업로드된 파일을 1MB씩 임시 파일에 복사하고 경로를 리턴
+def _save_upload(file: UploadFile) -> str:
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        shutil.copyfileobj(file.file, tmp, length=1024 * 1024)
+        return tmp.name
+
 
 # pdf파일을 업로드해서 텍스트로 변환한 후,
 # 텍스트를 읽어서 청크--> 임베딩 --> 크로마db에 넣는 요청
@@ -496,53 +800,217 @@ async def ingest_pdf(
         max_chars: int = 1200,
         overlap_chars: int = 150,
         source: str = "pdf",
+        batch_size: int = 32,
+        embed_workers: int = 4,
+        chunker: str = "sentence",
+        max_tokens: int = 512,
+        overlap_tokens: int = 64,
 ):
     """
     PDF 파일을 업로드 받아 텍스트 추출 → 청킹 → Chroma 저장
     - 파라미터는 query string 형태로도 받을 수 있게 최소로 구성
-    - 예: /ingest_pdf?max_chars=1200&overlap_chars=150&source=pdf
+    - 예: /ingest_pdf?max_chars=1200&overlap_chars=150&source=pdf&batch_size=32
+    - batch_size: 한 번에 임베딩/저장할 청크 개수
+    - embed_workers: 동시에 ollama에 임베딩 요청을 보내는 개수
+    - chunker: "sentence"(문장 경계 + 토큰 수 기준, max_tokens/overlap_tokens)
+               또는 "chars"(글자 수 기준, max_chars/overlap_chars)
     """
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only .pdf files are allowed")
+    if chunker not in ChromaRAG.CHUNKERS:
+        raise HTTPException(status_code=400, detail=f"chunker must be one of {ChromaRAG.CHUNKERS}")
 
-    ## 파일을 읽은 이후
-    pdf_bytes = await file.read()
-    if not pdf_bytes:
-        raise HTTPException(status_code=400, detail="Empty file")
+    ## 업로드 파일을 임시 파일로 저장 (bytes로 통째로 읽어서 메모리에 들고 있지 않음)
+    ## --> PyMuPDF가 파일 경로로 직접 읽고, 페이지가 많으면 프로세스 풀로 나눠서 추출함.
+    tmp_path = await run_in_threadpool(_save_upload, file)
+    try:
+        if os.path.getsize(tmp_path) == 0:
+            raise HTTPException(status_code=400, detail="Empty file")
+
+        # PDF 페이지 추출 → 청킹 → 임베딩 → 저장을 파이프라인으로 동시에 진행
+        # (페이지가 추출되는 대로 청크가 임베딩으로 넘어감)
+        # 같은 파일을 다시 올리면 바뀐 청크만 저장하고, 없어진 청크는 삭제됨.
+        # 오래 걸리는 작업이므로 이벤트 루프를 막지 않게 threadpool에서 실행
+        result = await run_in_threadpool(
+            rag.ingest_stream,
+            rag.iter_pdf_pages(tmp_path),
+            source=source,
+            max_chars=max_chars,
+            overlap_chars=overlap_chars,
+            meta_extra={"filename": file.filename},
+            batch_size=batch_size,
+            embed_workers=embed_workers,
+            chunker=chunker,
+            max_tokens=max_tokens,
+            overlap_tokens=overlap_tokens,
+        )
+    finally:
+        os.remove(tmp_path)
 
-    # PDF → 텍스트 추출
-    text = rag.pdf_to_text(pdf_bytes)
-    if not text.strip():
+    if result["chunks"] == 0:
         # 스캔 PDF(이미지)면 텍스트가 없을 수 있음
         raise HTTPException(
             status_code=400,
             detail="No extractable text found. If it's a scanned PDF, OCR is needed."
         )
 
-    # 청킹 후 임베딩 후 저장
-    chunks_added = rag.ingest_document(
-        raw_text=text,
-        source=source,
-        max_chars=max_chars,
-        overlap_chars=overlap_chars,
-        meta_extra={"filename": file.filename},
-    )
+    return {
+        "chunks_added": result["added"],
+        "chunks_deleted": result["deleted"],
+        "chunks_unchanged": result["unchanged"],
+        "pages": result["pages"],
+        "seconds": result["seconds"],
+        "total_docs": await run_in_threadpool(rag.count),
+        "filename": file.filename,
+    }
+
+
+# 임베딩 캐시 hit/miss 확인
+@app.get("/embed_cache_stats")
+def embed_cache_stats():
+    return rag.embed_cache_stats()
+
+
+# 검색 결과 캐시 상태 (hit_rate, 현재 컬렉션 버전 등)
+@app.get("/query_cache_stats")
+def query_cache_stats():
+    return rag.query_cache_stats()
+
+
+# 의미 답변 캐시 상태 (hit_rate : 이 worker / all_workers : redis에 모은 전체)
+@app.get("/semantic_cache_stats")
+async def semantic_cache_stats():
+    if app.state.semantic_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await app.state.semantic_cache.stats()}
+
+
+# 의미 답변 캐시 비우기
+@app.delete("/semantic_cache")
+async def clear_semantic_cache():
+    if app.state.semantic_cache is None:
+        raise HTTPException(status_code=503, detail="semantic cache is disabled (Redis 연결 안됨)")
+    return {"keys_deleted": await app.state.semantic_cache.clear()}
+
+
+# 문서 하나(source + filename)의 청크를 모두 삭제 --> 컬렉션 버전이 바뀌어서 검색 캐시도 무효화됨
+@app.delete("/documents")
+def delete_document(source: str, filename: Optional[str] = None):
+    deleted = rag.delete_document(source, filename)
+    if deleted == 0:
+        raise HTTPException(status_code=404, detail="document not found")
+    return {"chunks_deleted": deleted, "total_docs": rag.count()}
 
-    return {"chunks_added": chunks_added, "total_docs": rag.count(), "filename": file.filename}
+
+# 문서 목록 (source, filename, 청크 수) : 적재/삭제할 때 같이 갱신되는 색인에서 바로 읽음
+@app.get("/sources")
+def sources(source: Optional[str] = None):
+    docs = rag.list_sources(source)
+    return {"sources": docs, "documents": len(docs), "total_chunks": sum(d["chunks"] for d in docs)}
+
+
+# AskRequest의 source/filename/where --> 크로마 where 필터
+def _ask_where(req: AskRequest) -> Optional[dict]:
+    return ChromaRAG.make_where(req.source, req.filename, req.where)
 
 
 @app.post("/ask")
-def ask(req: AskRequest):
+async def ask(req: AskRequest):
     # 문서가 하나도 없으면 질문해도 의미가 없으니 400 처리
-    if rag.count() == 0:
+    if await run_in_threadpool(rag.count) == 0:
         raise HTTPException(status_code=400, detail="No documents. Ingest first.")
 
+    # 비슷한 질문의 답이 의미 캐시에 있으면 바로 돌려줌 (검색 + 생성을 안 함)
+    where = _ask_where(req)
+    cache = app.state.semantic_cache if req.use_cache else None
+    if cache is not None:
+        scope = SemanticCache.scope(kind="ask", model=rag.gen_model, embed_model=rag.embed_model,
+                                    version=await run_in_threadpool(rag.collection_version),
+                                    top_k=req.top_k, where=where)
+        hit, emb = await cache.get(req.question, scope)
+        if hit is not None:
+            return hit
+
     # RAG 실행 (크로마 db에서 검색 -> 안되면 올라마 생성)
-    out = rag.ask(req.question, top_k=req.top_k)
+    # source/filename/where를 주면 그 문서들 안에서만 검색
+    try:
+        out = await rag.aask(req.question, top_k=req.top_k, where=where)
+    except ValueError as e:
+        # 잘못된 where 조건
+        raise HTTPException(status_code=400, detail=str(e))
+    if cache is not None:
+        await cache.put(req.question, scope, out, emb=emb)
 
     print("====================")
     print(out)
     # dict로 그대로 반환하면 FastAPI가 JSON으로 바꿔서 응답함
     # out 구조: {"answer": "...", "retrieved": ["...", "..."]}
     return out
+
+
+# 스트리밍 /ask (SSE, server-sent events)
+# 검색 결과(청크 id, source)를 먼저 보내고, 답변은 ollama가 만드는 대로 글자 조각(token)을 바로 보냄.
+#   event: retrieved  data: {"mode": ..., "chunks": [{"id", "source", "filename", "page", "score"}, ...]}
+#   event: token      data: {"text": "..."}        (여러 번)
+#   event: summary    data: {"eval_count", "eval_duration", "prompt_eval_count", ..., "ttft_ms", "tokens_per_sec"}
+#   event: error      data: {"detail": "..."}      (중간에 실패하면)
+@app.post("/ask_stream")
+async def ask_stream(req: AskRequest):
+    if await run_in_threadpool(rag.count) == 0:
+        raise HTTPException(status_code=400, detail="No documents. Ingest first.")
+
+    # /ask처럼 의미 캐시를 먼저 봄 : hit이면 저장해둔 답을 이벤트 3개(retrieved, token, summary)로 바로 보냄
+    where = _ask_where(req)
+    cache = app.state.semantic_cache if req.use_cache else None
+    scope, emb = None, None
+    if cache is not None:
+        scope = SemanticCache.scope(kind="ask_stream", model=rag.gen_model, embed_model=rag.embed_model,
+                                    version=await run_in_threadpool(rag.collection_version),
+                                    top_k=req.top_k, where=where)
+        hit, emb = await cache.get(req.question, scope)
+        if hit is not None:
+            return _sse_response(_cached_events(hit))
+
+    # 스트리밍을 시작한 뒤에는 429를 보낼 수 없으므로 대기열이 꽉 찼으면 미리 거절
+    scheduler.check(rag.gen_model)
+    events = rag.aask_stream(req.question, top_k=req.top_k, where=where)
+    if cache is not None:
+        events = _caching_events(events, cache, req.question, scope, emb)
+    return _sse_response(events)
+
+
+def _sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        _sse(events),
+        media_type="text/event-stream",
+        # 프록시(nginx 등)가 모아서 보내지 않게
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _cached_events(hit: dict):
+    yield "retrieved", hit["retrieved"]
+    yield "token", {"text": hit["answer"]}
+    yield "summary", {"total_ms": 0.0, "cache": hit["cache"]}
+
+
+# 스트리밍을 그대로 보내면서 답을 모아두었다가, 끝까지(summary) 성공한 경우에만 캐시에 저장
+async def _caching_events(events, cache: SemanticCache, question: str, scope: str, emb):
+    retrieved, parts = None, []
+    async for event, data in events:
+        if event == "retrieved":
+            retrieved = data
+        elif event == "token":
+            parts.append(data["text"])
+        elif event == "summary" and retrieved is not None:
+            await cache.put(question, scope, {"retrieved": retrieved, "answer": "".join(parts)}, emb=emb)
+        yield event, data
+
+
+async def _sse(events):
+    try:
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
     
@@ -0,0 +1,195 @@
+# metrics.py
+# (ollama-rag/app, ollama-test/app에 똑같은 파일이 있음. app 폴더를 하나씩 따로 배포하므로 복사본을 둠
+#  --> 고칠 때는 둘 다 같이 고칠 것. ollama-rag/tests/test_vendored.py가 확인함)
+# Prometheus 지표 (/metrics)
+#
+# ollama 응답의 prompt_eval_count / eval_count / eval_duration / load_duration을 print로만 보던 것을
+# 숫자로 모아서 Prometheus(그라파나)가 긁어가게 함. --> 용량 계획(모델별 tokens/s, 동시 요청 수)을 데이터로.
+#   - ollama_request_seconds{op, model}      : 임베딩/생성/채팅 호출 시간 (히스토그램)
+#   - ollama_ttft_seconds{model}             : 스트리밍 첫 글자까지 걸린 시간
+#   - ollama_load_seconds{model}             : 모델 로드 시간 (load_duration)
+#   - ollama_prompt_tokens_total{model}      : 입력 토큰 수 (prompt_eval_count)
+#   - ollama_eval_tokens_total{model}        : 생성 토큰 수 (eval_count)
+#   - ollama_tokens_per_second{model, phase} : 마지막 요청의 토큰 속도 (phase = prompt | eval)
+#   - ollama_requests_in_flight{op}          : 지금 ollama에서 처리 중인 요청 수
+#   - ollama_errors_total{op, model}         : 실패한 호출 수
+#   - ollama_queue_depth{model}              : ollama slot을 기다리는 요청 수 (scheduler.py)
+#   - ollama_slots_in_use{model}             : 사용 중인 slot 수
+#   - ollama_queue_wait_seconds{model, priority} : slot을 받기까지 기다린 시간
+#   - ollama_rejected_total{model, reason}   : 429로 거절한 요청 수 (reason = queue_full | wait_timeout | preempted)
+#   - chroma_request_seconds{op}             : 크로마 query/add/delete 시간
+#   - redis_command_seconds{command}         : redis 명령 시간 (pipeline이면 "pipeline")
+#   - http_request_seconds{method, route, status}, http_requests_in_flight{route} : FastAPI 요청
+#
+# 사용법 (main.py)
+#   import metrics
+#   metrics.install(app)                       # /metrics + http 미들웨어
+#   with metrics.ollama_call("generate", MODEL):
+#       resp = await client.generate(...)
+#   metrics.record_ollama_usage(MODEL, resp)
+#
+# prometheus_client가 없으면 지표는 아무 일도 안 하고 /metrics는 503 (pip install prometheus_client)
+# uvicorn --workers 여러 개면 worker마다 따로 셈 (PROMETHEUS_MULTIPROC_DIR 설정 필요)
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+except ImportError:  # 지표 없이도 앱은 돌아가게
+    CONTENT_TYPE_LATEST = None
+
+# 생성은 수십 초까지, 크로마/redis는 ms 단위
+_OLLAMA_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+_LOCAL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+class _Noop:
+    def labels(self, *args, **kwargs) -> "_Noop":
+        return self
+
+    def observe(self, *args) -> None:
+        pass
+
+    def inc(self, *args) -> None:
+        pass
+
+    def dec(self, *args) -> None:
+        pass
+
+    def set(self, *args) -> None:
+        pass
+
+
+ENABLED = CONTENT_TYPE_LATEST is not None
+
+if ENABLED:
+    OLLAMA_SECONDS = Histogram("ollama_request_seconds", "Ollama call latency", ["op", "model"],
+                               buckets=_OLLAMA_BUCKETS)
+    OLLAMA_TTFT = Histogram("ollama_ttft_seconds", "Time to first streamed token", ["model"],
+                            buckets=_OLLAMA_BUCKETS)
+    OLLAMA_LOAD = Histogram("ollama_load_seconds", "Model load time reported by Ollama", ["model"],
+                            buckets=_OLLAMA_BUCKETS)
+    PROMPT_TOKENS = Counter("ollama_prompt_tokens_total", "Prompt tokens evaluated", ["model"])
+    EVAL_TOKENS = Counter("ollama_eval_tokens_total", "Tokens generated", ["model"])
+    TOKENS_PER_SEC = Gauge("ollama_tokens_per_second", "Tokens/s of the last request", ["model", "phase"])
+    OLLAMA_IN_FLIGHT = Gauge("ollama_requests_in_flight", "Ollama calls in progress", ["op"])
+    OLLAMA_ERRORS = Counter("ollama_errors_total", "Failed Ollama calls", ["op", "model"])
+    OLLAMA_QUEUE_DEPTH = Gauge("ollama_queue_depth", "Requests waiting for an Ollama slot", ["model"])
+    OLLAMA_SLOTS_IN_USE = Gauge("ollama_slots_in_use", "Ollama slots in use", ["model"])
+    OLLAMA_QUEUE_WAIT = Histogram("ollama_queue_wait_seconds", "Time spent waiting for an Ollama slot",
+                                  ["model", "priority"], buckets=_OLLAMA_BUCKETS)
+    OLLAMA_REJECTED = Counter("ollama_rejected_total", "Requests rejected with 429", ["model", "reason"])
+    CHROMA_SECONDS = Histogram("chroma_request_seconds", "Chroma call latency", ["op"], buckets=_LOCAL_BUCKETS)
+    REDIS_SECONDS = Histogram("redis_command_seconds", "Redis command latency", ["command"],
+                              buckets=_LOCAL_BUCKETS)
+    HTTP_SECONDS = Histogram("http_request_seconds", "HTTP request latency", ["method", "route", "status"],
+                             buckets=_OLLAMA_BUCKETS)
+    HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests in progress", ["route"])
+else:
+    OLLAMA_SECONDS = OLLAMA_TTFT = OLLAMA_LOAD = PROMPT_TOKENS = EVAL_TOKENS = TOKENS_PER_SEC = _Noop()
+    OLLAMA_IN_FLIGHT = OLLAMA_ERRORS = CHROMA_SECONDS = REDIS_SECONDS = HTTP_SECONDS = HTTP_IN_FLIGHT = _Noop()
+    OLLAMA_QUEUE_DEPTH = OLLAMA_SLOTS_IN_USE = OLLAMA_QUEUE_WAIT = OLLAMA_REJECTED = _Noop()
+
+
+###############
+# 호출 시간 재기
+@contextmanager
+def ollama_call(op: str, model: str) -> Iterator[None]:
+    OLLAMA_IN_FLIGHT.labels(op).inc()
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:  # 취소/연결 끊김(스트리밍 중단)은 에러로 안 셈
+        OLLAMA_ERRORS.labels(op, model).inc()
+        raise
+    finally:
+        OLLAMA_IN_FLIGHT.labels(op).dec()
+        OLLAMA_SECONDS.labels(op, model).observe(time.perf_counter() - t0)
+
+
+@contextmanager
+def chroma_call(op: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        CHROMA_SECONDS.labels(op).observe(time.perf_counter() - t0)
+
+
+@contextmanager
+def redis_call(command: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        REDIS_SECONDS.labels(command).observe(time.perf_counter() - t0)
+
+
+def observe_ttft(model: str, seconds: float) -> None:
+    OLLAMA_TTFT.labels(model).observe(seconds)
+
+
+# ollama 응답(dict 또는 ollama 라이브러리 응답, 스트리밍이면 done 줄)의 토큰/시간 정보 --> 지표
+# duration은 나노초
+def record_ollama_usage(model: str, data: Any) -> None:
+    if data is None:
+        return
+    get = data.get if hasattr(data, "get") else (lambda k: getattr(data, k, None))
+    model = get("model") or model
+    prompt_count, prompt_ns = get("prompt_eval_count"), get("prompt_eval_duration")
+    eval_count, eval_ns = get("eval_count"), get("eval_duration")
+    load_ns = get("load_duration")
+    if prompt_count:
+        PROMPT_TOKENS.labels(model).inc(prompt_count)
+        if prompt_ns:
+            TOKENS_PER_SEC.labels(model, "prompt").set(prompt_count / prompt_ns * 1e9)
+    if eval_count:
+        EVAL_TOKENS.labels(model).inc(eval_count)
+        if eval_ns:
+            TOKENS_PER_SEC.labels(model, "eval").set(eval_count / eval_ns * 1e9)
+    if load_ns:
+        OLLAMA_LOAD.labels(model).observe(load_ns / 1e9)
+
+
+###############
+# FastAPI 연결 : /metrics 엔드포인트 + 요청마다 시간/동시 요청 수
+def install(app, path: str = "/metrics") -> None:
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse, Response
+
+    @app.get(path, include_in_schema=False)
+    def metrics_endpoint():
+        if not ENABLED:
+            return PlainTextResponse("prometheus_client is not installed (pip install prometheus_client)\n",
+                                     status_code=503)
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    @app.middleware("http")
+    async def http_metrics(request: Request, call_next):
+        if request.url.path == path:
+            return await call_next(request)
+        route = _route_of(request)
+        HTTP_IN_FLIGHT.labels(route).inc()
+        t0 = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            HTTP_IN_FLIGHT.labels(route).dec()
+            HTTP_SECONDS.labels(request.method, route, str(status)).observe(time.perf_counter() - t0)
+
+
+# /chat-history/apple --> /chat-history/{session_id} (사용자마다 지표가 따로 생기지 않게 경로 템플릿으로)
+def _route_of(request) -> str:
+    from starlette.routing import Match
+
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", request.url.path)
+    return "unmatched"
@@ -2,6 +2,8 @@
 from fastapi import HTTPException
 import requests
 
+from metrics import ollama_call, record_ollama_usage
+
 # http서버이므로 http연결하는 모듈 필요함.
 # 순서대로 호출해서 받을 것이면 requests(*), tablib.request
 # 동시에 호출해서 받을 것이면 httpx
@@ -29,14 +31,17 @@ def ollama_client(word : str):
             }
         }
         # 올라마 서버로 post요청을 보내서
-        response = requests.post(url=f"{OLLAMA_BASE_URL}/api/generate",
-                                 json=payload)
+        with ollama_call("generate", DEFAULT_MODEL):
+            response = requests.post(url=f"{OLLAMA_BASE_URL}/api/generate",
+                                     json=payload)
         # 결과 받아오면 결과를 추출해서
         print(response.status_code)
         print(response)
         if response.status_code == 200:
             ollama_response = response.json()
             print(ollama_response)
+            # 토큰 수, tokens/s --> /metrics
+            record_ollama_usage(DEFAULT_MODEL, ollama_response)
         # 우리마음대로 결과 dict을 만들어주자.
             # JSON 응답 구성
             result = {
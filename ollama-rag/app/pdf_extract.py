@@ -0,0 +1,97 @@
+# pdf_extract.py
+# PDF에서 페이지 단위로 텍스트를 뽑아내는 모듈
+# - (페이지번호, 텍스트)를 하나씩 yield 하므로 전체 텍스트를 한 번에 메모리에 들고 있지 않음.
+# - 파일 경로를 주면 PyMuPDF가 파일을 직접 읽음 (업로드 bytes를 통째로 복사해 둘 필요 없음)
+# - 페이지가 많은 파일은 페이지 구간(range)을 나눠서 프로세스 풀에서 동시에 추출함.
+#   (텍스트 추출은 CPU 작업이라 스레드보다 프로세스가 빠름)
+from __future__ import annotations
+
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple, Union
+
+import fitz  # PyMuPDF
+
+PdfSource = Union[str, "os.PathLike[str]", bytes, bytearray, memoryview, mmap.mmap]
+
+
+def _open(src: PdfSource) -> fitz.Document:
+    if isinstance(src, (str, os.PathLike)):
+        return fitz.open(os.fspath(src))
+    if isinstance(src, mmap.mmap):
+        src = memoryview(src)
+    return fitz.open(stream=src, filetype="pdf")
+
+
+def pdf_page_count(src: PdfSource) -> int:
+    doc = _open(src)
+    try:
+        return doc.page_count
+    finally:
+        doc.close()
+
+
+# 프로세스 풀에서 실행되는 함수 (pickle 되어야 하므로 모듈 최상단에 있어야 함)
+def _extract_range(path: str, start: int, end: int) -> List[str]:
+    doc = fitz.open(path)
+    try:
+        return [doc[i].get_text("text") for i in range(start, end)]
+    finally:
+        doc.close()
+
+
+def iter_pdf_pages(
+        src: PdfSource,
+        workers: Optional[int] = None,
+        pages_per_task: int = 16,
+        parallel_min_pages: int = 200,
+) -> Iterator[Tuple[int, str]]:
+    """
+    PDF의 페이지를 (페이지번호(1부터), 텍스트) 형태로 순서대로 내보냅니다.
+    - src : 파일 경로(권장), bytes, mmap
+    - 파일 경로이고 페이지 수가 parallel_min_pages 이상이면
+      pages_per_task 페이지씩 나눠서 workers개 프로세스로 동시에 추출합니다.
+    - 스캔본(이미지) PDF는 텍스트가 거의 안 나올 수 있음(OCR 필요)
+    """
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+
+    is_path = isinstance(src, (str, os.PathLike))
+    doc = _open(src)
+    try:
+        n = doc.page_count
+        if not is_path or workers <= 1 or n < parallel_min_pages:
+            # 작은 파일은 프로세스를 띄우는 비용(프로세스당 약 1초)이 더 크므로 그냥 순서대로
+            for i in range(n):
+                yield i + 1, doc[i].get_text("text")
+            return
+    finally:
+        doc.close()
+
+    yield from _iter_pages_parallel(os.fspath(src), n, workers, max(1, pages_per_task))
+
+
+def _iter_pages_parallel(path: str, n: int, workers: int, pages_per_task: int) -> Iterator[Tuple[int, str]]:
+    ranges = [(s, min(s + pages_per_task, n)) for s in range(0, n, pages_per_task)]
+    # 서버(스레드가 많은 프로세스)에서 fork하면 위험할 수 있어서 spawn 사용
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # 한꺼번에 다 제출하면 결과 텍스트가 메모리에 쌓이므로 workers*2개까지만 미리 제출
+        pending = []
+        next_range = 0
+        while next_range < len(ranges) and len(pending) < workers * 2:
+            s, e = ranges[next_range]
+            pending.append((s, pool.submit(_extract_range, path, s, e)))
+            next_range += 1
+
+        while pending:
+            start, fut = pending.pop(0)
+            texts = fut.result()
+            if next_range < len(ranges):
+                s, e = ranges[next_range]
+                pending.append((s, pool.submit(_extract_range, path, s, e)))
+                next_range += 1
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
@@ -5,6 +5,9 @@ import argparse
 from pathlib import Path
 
 from chroma_db import ChromaRAG
+from flat_store import DTYPES
+from reranker import Reranker
+from vector_store import VECTOR_STORES
 
 
 def main():
@@ -17,6 +20,14 @@ def main():
     parser.add_argument("--embed_model", default="nomic-embed-text", help="Ollama embedding model")
     parser.add_argument("--gen_model", default="llama3.2:3b", help="Ollama generation model")
     parser.add_argument("--top_k", type=int, default=4, help="How many chunks to retrieve")
+    parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes (default: min(4, cpu))")
+    parser.add_argument("--chunker", default="sentence", choices=["sentence", "chars"], help="Chunking strategy")
+    parser.add_argument("--max_tokens", type=int, default=512, help="Approx. tokens per chunk (sentence chunker)")
+    parser.add_argument("--batch_size", type=int, default=32, help="Chunks per embedding request / Chroma add")
+    parser.add_argument("--reranker", default=None, help="ONNX cross-encoder dir or HF repo id (optional)")
+    parser.add_argument("--rerank_candidates", type=int, default=30, help="Chunks to retrieve before reranking")
+    parser.add_argument("--vector_store", default="chroma", choices=list(VECTOR_STORES), help="Vector store backend")
+    parser.add_argument("--flat_dtype", default="float16", choices=list(DTYPES), help="Flat store vector dtype")
     args = parser.parse_args()
 
     pdf_path = Path(args.pdf)
@@ -29,21 +40,27 @@ def main():
         ollama_base_url=args.ollama,
         embed_model=args.embed_model,
         gen_model=args.gen_model,
+        embed_batch_size=args.batch_size,
+        chunker=args.chunker,
+        reranker=Reranker(args.reranker) if args.reranker else None,
+        rerank_candidates=args.rerank_candidates,
+        rerank_top_n=args.top_k,
+        vector_store=args.vector_store,
+        flat_dtype=args.flat_dtype,
     )
 
-    # 1) PDF -> text
-    pdf_bytes = pdf_path.read_bytes()
-    text = rag.pdf_to_text(pdf_bytes)
-    if not text.strip():
-        print("PDF에서 텍스트가 거의 추출되지 않았습니다. (스캔본 PDF일 가능성) OCR이 필요할 수 있습니다.")
-        return
-
-    # 2) Ingest (chunk + embed + store)
+    # 1) PDF -> 페이지별 text -> 2) Ingest (chunk + embed + store)
+    #    파일 경로로 바로 읽고(페이지가 많으면 프로세스 풀), 추출되는 대로 청킹/임베딩/저장
     before = rag.count()
-    added = rag.ingest_document(raw_text=text, source=str(pdf_path))
+    result = rag.ingest_stream(rag.iter_pdf_pages(pdf_path, workers=args.workers), source=str(pdf_path),
+                               max_tokens=args.max_tokens)
     after = rag.count()
+    if result["chunks"] == 0:
+        print("PDF에서 텍스트가 거의 추출되지 않았습니다. (스캔본 PDF일 가능성) OCR이 필요할 수 있습니다.")
+        return
 
-    print(f"[INGEST] before={before}, added={added}, after={after}")
+    print(f"[INGEST] before={before}, added={result['added']}, deleted={result['deleted']}, "
+          f"pages={result['pages']}, after={after}, {result['seconds']}s")
 
     # 3) Ask (retrieve + generate)
     out = rag.ask(args.q, top_k=args.top_k)
@@ -51,7 +68,7 @@ def main():
     print(out["answer"].strip())
 
     print("\n===== RETRIEVED CHUNKS (top_k) =====")
-    for i, ch in enumerate(out["retrieved"], 1):
+    for i, ch in enumerate(out.get("chroma-db") or [], 1):
         preview = ch.strip().replace("\n", " ")
         print(f"{i}. {preview[:220]}{'...' if len(preview) > 220 else ''}")
 
@@ -0,0 +1,114 @@
+# reranker.py
+# 검색된 청크들을 한 번 더 점수 매겨서(재순위, rerank) 좋은 것 N개만 남기는 단계
+#
+# 벡터/키워드 검색은 빠르지만 대충 고름 --> top_k를 키워서 많이 가져오면 프롬프트가 길어져서
+# LLM이 프롬프트 읽는 시간(prompt eval)이 늘어남.
+# 그래서
+#   1) 검색은 넉넉하게(예: 30개) 싸게 가져오고
+#   2) cross-encoder 모델이 (질문, 청크) 쌍을 직접 읽고 점수를 매겨서
+#   3) 점수 높은 N개(예: 4개)만 프롬프트에 넣음
+#
+# - 모델 : ONNX로 변환된 cross-encoder (예: BAAI/bge-reranker-v2-m3, cross-encoder/mmarco-mMiniLMv2-L12-H384-v1)
+#          폴더 안에 model.onnx(또는 onnx/model.onnx)와 tokenizer.json이 있어야 함.
+# - onnxruntime(CPU) + tokenizers 사용 --> chromadb가 이미 쓰는 패키지라 추가 설치가 필요 없음.
+# - 길이가 비슷한 것끼리 묶어서(batch) 돌림 --> padding이 줄어서 CPU 시간이 줄어듦.
+from __future__ import annotations
+
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class Reranker:
+    def __init__(self, model_path: str, batch_size: int = 16, max_length: int = 512,
+                 threads: Optional[int] = None):
+        """
+        - model_path : 모델 폴더 경로 (없으면 huggingface repo id로 보고 내려받음)
+        - batch_size : 한 번에 모델에 넣는 (질문, 청크) 쌍 개수
+        - max_length : (질문 + 청크) 최대 토큰 수 (넘으면 청크 뒤쪽을 자름)
+        - threads : onnxruntime이 쓸 CPU 스레드 수 (None이면 onnxruntime 기본값)
+        """
+        self.model_path = model_path
+        self.batch_size = max(1, batch_size)
+        self.max_length = max_length
+        self.threads = threads
+        self._session = None
+        self._tokenizer = None
+        self._input_names: List[str] = []
+        self._lock = threading.Lock()
+
+    ###############
+    # 모델은 처음 쓸 때 읽음 (서버 시작이 느려지지 않게)
+    def _load(self) -> None:
+        if self._session is not None:
+            return
+        with self._lock:
+            if self._session is not None:
+                return
+            try:
+                import onnxruntime as ort
+                from tokenizers import Tokenizer
+            except ImportError as e:
+                raise RuntimeError("reranker를 쓰려면 onnxruntime, tokenizers가 필요합니다 "
+                                   "(pip install onnxruntime tokenizers)") from e
+
+            model_dir = self._resolve_dir(self.model_path)
+            onnx_path = next((p for p in (os.path.join(model_dir, 'model.onnx'),
+                                          os.path.join(model_dir, 'onnx', 'model.onnx')) if os.path.exists(p)), None)
+            if onnx_path is None:
+                raise FileNotFoundError(f"model.onnx를 찾을 수 없습니다: {model_dir}")
+
+            tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+            # 청크 쪽(두 번째 문장)만 잘라서 질문은 항상 다 들어가게
+            tokenizer.enable_truncation(max_length=self.max_length, strategy='only_second')
+            tokenizer.enable_padding()
+
+            opts = ort.SessionOptions()
+            if self.threads:
+                opts.intra_op_num_threads = self.threads
+            session = ort.InferenceSession(onnx_path, sess_options=opts, providers=['CPUExecutionProvider'])
+            self._input_names = [i.name for i in session.get_inputs()]
+            self._tokenizer = tokenizer
+            self._session = session
+
+    @staticmethod
+    def _resolve_dir(model_path: str) -> str:
+        if os.path.isdir(model_path):
+            return model_path
+        # 폴더가 없으면 huggingface repo id로 보고 필요한 파일만 내려받음
+        from huggingface_hub import snapshot_download
+        return snapshot_download(model_path, allow_patterns=['model.onnx', 'onnx/model.onnx', '*.json'])
+
+    ###############
+    # (질문, 청크) 쌍의 점수 (높을수록 관련 있음). 입력 순서대로 리턴.
+    def score(self, question: str, docs: Sequence[str]) -> List[float]:
+        if not docs:
+            return []
+        self._load()
+        # 길이순으로 정렬해서 묶음 --> 한 묶음 안의 padding이 줄어듦
+        order = sorted(range(len(docs)), key=lambda i: len(docs[i]))
+        scores = [0.0] * len(docs)
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            for i, s in zip(idx, self._score_batch(question, [docs[i] for i in idx])):
+                scores[i] = s
+        return scores
+
+    def _score_batch(self, question: str, docs: List[str]) -> List[float]:
+        encs = self._tokenizer.encode_batch([(question, d) for d in docs])
+        feeds = {
+            'input_ids': np.array([e.ids for e in encs], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encs], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encs], dtype=np.int64),
+        }
+        logits = self._session.run(None, {k: v for k, v in feeds.items() if k in self._input_names})[0]
+        # (batch, 1) 또는 (batch, 2) --> 마지막 열이 "관련 있음" 점수
+        return np.asarray(logits, dtype=np.float32).reshape(len(docs), -1)[:, -1].tolist()
+
+    # 점수 높은 top_n개의 (청크, 점수)
+    def rerank(self, question: str, docs: Sequence[str], top_n: int = 4) -> List[Tuple[str, float]]:
+        scores = self.score(question, docs)
+        best = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:max(1, top_n)]
+        return [(docs[i], scores[i]) for i in best]
@@ -0,0 +1,300 @@
+# scheduler.py
+# (ollama-rag/app, ollama-test/app에 똑같은 파일이 있음. app 폴더를 하나씩 따로 배포하므로 복사본을 둠
+#  --> 고칠 때는 둘 다 같이 고칠 것. ollama-rag/tests/test_vendored.py가 확인함)
+# ollama 앞의 입장 제어 (admission control) + 우선순위 대기열
+#
+# 예전에는 요청이 몰리면 전부 ollama로 보내서 ollama 안에서 같이 줄을 서고, 같이 타임아웃이 났음.
+#   - 모델마다 동시에 ollama로 보내는 요청 수를 slots개로 제한 (ollama의 OLLAMA_NUM_PARALLEL에 맞춤)
+#   - 나머지는 우선순위 대기열에서 기다림 : 대화(/chat, /ask) > 작업(/summarize ...) > 적재(/ingest 임베딩)
+#     오래 기다린 요청은 우선순위가 올라감 (aging초마다 한 단계) --> 적재도 계속 밀리지만은 않음
+#   - 대기열이 꽉 찼거나 너무 오래 기다리면 Saturated --> install()이 429 + Retry-After로 바꿔줌
+#     꽉 찼을 때 더 높은 우선순위 요청이 오면, 기다리던 것 중 가장 낮은 우선순위(그중 가장 늦게 온 것)를 대신 거절
+#   - total_slots를 주면 모든 모델이 그 slot 수를 같이 씀 (ollama 서버 하나 = GPU 하나)
+#     --> 모델이 달라도(예: /chat의 gemma3 생성과 /ingest의 nomic-embed-text 임베딩) 하나의 우선순위 순서로 경쟁
+#     total_slots가 없으면 모델마다 따로 세므로 우선순위는 같은 모델을 쓰는 요청끼리만 적용됨
+#   - 대기열 길이 / 사용 중인 slot / 기다린 시간 / 거절 수는 /metrics 로 (metrics.py)
+#
+# 사용법 (main.py)
+#   scheduler = GenerationScheduler(slots={"gemma3:1b": 4}, max_queue=64, total_slots=4)
+#   scheduler.install(app, route_priority={"/ingest_texts": PRIORITY_BATCH})
+#   async with scheduler.slot(MODEL):
+#       resp = await client.generate(...)
+#
+# 우선순위는 요청 경로로 정함 (install()의 미들웨어가 contextvar에 넣어둠) --> 호출하는 쪽에서 따로 넘기지 않아도 됨
+# 한 프로세스(uvicorn worker) 안에서만 셈. worker가 여러 개면 slots도 worker 수로 나눠서 설정
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from metrics import OLLAMA_QUEUE_DEPTH, OLLAMA_QUEUE_WAIT, OLLAMA_REJECTED, OLLAMA_SLOTS_IN_USE
+
+PRIORITY_INTERACTIVE = 0  # /chat, /stream, /ask
+PRIORITY_TASK = 1  # /summarize, /translate ...
+PRIORITY_BATCH = 2  # /ingest 임베딩
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_TASK: "task", PRIORITY_BATCH: "batch"}
+
+_priority: ContextVar[int] = ContextVar("ollama_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class Saturated(Exception):
+    """대기열이 꽉 찼거나 기다리는 시간이 max_wait를 넘음 --> 429"""
+
+    def __init__(self, model: str, reason: str, retry_after: int):
+        super().__init__(f"{model} 요청이 너무 많습니다 ({reason}). {retry_after}초 뒤에 다시 시도하세요.")
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _ModelQueue:
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.active = 0
+        self.waiting = 0
+        # (순서 값, 번호, 우선순위, future) --> 순서 값이 작은 것부터 slot을 받음
+        self.heap: List[tuple] = []
+        self.avg_seconds = 1.0  # slot을 잡고 있는 평균 시간 (Retry-After 계산용)
+
+
+class Lease:
+    """slot 1개. release()는 여러 번 불러도 한 번만 반납"""
+
+    def __init__(self, scheduler: "GenerationScheduler", model: str):
+        self._scheduler = scheduler
+        self.model = model
+        self.started = time.perf_counter()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self._scheduler._release(self.model, time.perf_counter() - self.started)
+
+    async def __aenter__(self) -> "Lease":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class GenerationScheduler:
+    def __init__(self, slots: Optional[Dict[str, int]] = None, default_slots: int = 1, max_queue: int = 64,
+                 max_wait: Optional[Dict[int, float]] = None, aging: float = 10.0,
+                 total_slots: Optional[int] = None):
+        """
+        slots        : 모델 -> 동시에 ollama로 보낼 수 있는 요청 수 (없는 모델은 default_slots)
+        total_slots  : 모든 모델을 합쳐서 동시에 ollama로 보낼 수 있는 요청 수 (None이면 제한 없음)
+        max_queue    : 모델마다 기다릴 수 있는 요청 수. 넘으면 바로 429
+        max_wait     : 우선순위 -> 최대 대기 시간(초). 넘으면 429 (적재는 길게)
+        aging        : 이 시간(초)만큼 기다리면 우선순위 한 단계만큼 앞으로
+        """
+        self.slots = dict(slots or {})
+        self.default_slots = max(1, default_slots)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = {PRIORITY_INTERACTIVE: 30.0, PRIORITY_TASK: 60.0, PRIORITY_BATCH: 600.0, **(max_wait or {})}
+        self.aging = aging
+        self.total_slots = max(1, total_slots) if total_slots else None
+        self.active = 0  # 모든 모델에서 사용 중인 slot 수
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.rejected = 0
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._seq = itertools.count()
+
+    def _queue(self, model: str) -> _ModelQueue:
+        q = self._queues.get(model)
+        if q is None:
+            q = self._queues[model] = _ModelQueue(max(1, self.slots.get(model, self.default_slots)))
+        return q
+
+    def slots_for(self, model: str) -> int:
+        return self._queue(model).slots
+
+    # 이 모델의 slot과 (total_slots가 있으면) 전체 slot이 둘 다 비어 있음
+    def _free(self, q: _ModelQueue) -> bool:
+        return q.active < q.slots and (self.total_slots is None or self.active < self.total_slots)
+
+    def _start(self, model: str, q: _ModelQueue) -> None:
+        q.active += 1
+        self.active += 1
+        OLLAMA_SLOTS_IN_USE.labels(model).set(q.active)
+
+    def _retry_after(self, q: _ModelQueue) -> int:
+        return max(1, math.ceil(q.avg_seconds * (q.waiting + 1) / q.slots))
+
+    def _reject(self, model: str, q: _ModelQueue, reason: str) -> Saturated:
+        self.rejected += 1
+        OLLAMA_REJECTED.labels(model, reason).inc()
+        return Saturated(model, reason, self._retry_after(q))
+
+    # 대기열이 꽉 찼을 때 대신 거절할 요청 : level보다 낮은 우선순위 중 가장 낮고, 가장 늦게 온 것
+    @staticmethod
+    def _victim(q: _ModelQueue, level: int) -> Optional[tuple]:
+        entries = [e for e in q.heap if not e[3].done() and e[2] > level]
+        return max(entries, key=lambda e: (e[2], e[1])) if entries else None
+
+    ###############
+    # slot 받기 / 반납
+    def check(self, model: str, level: Optional[int] = None) -> None:
+        """대기열이 꽉 찼으면 바로 Saturated (스트리밍처럼 응답을 시작하기 전에 미리 거절할 때)"""
+        level = current_priority() if level is None else level
+        q = self._queue(model)
+        if not self._free(q) and q.waiting >= self.max_queue and self._victim(q, level) is None:
+            raise self._reject(model, q, "queue_full")
+
+    async def acquire(self, model: str, level: Optional[int] = None) -> Lease:
+        level = current_priority() if level is None else level
+        name = PRIORITY_NAMES.get(level, str(level))
+        q = self._queue(model)
+        t0 = time.perf_counter()
+        # slot이 비어 있으면 바로 받음 (기다리던 요청이 있었다면 _dispatch가 이미 그 slot을 나눠줬음)
+        if self._free(q) and q.waiting == 0:
+            self._start(model, q)
+            OLLAMA_QUEUE_WAIT.labels(model, name).observe(0.0)
+            return Lease(self, model)
+        if q.waiting >= self.max_queue:
+            victim = self._victim(q, level)
+            if victim is None:
+                raise self._reject(model, q, "queue_full")
+            q.waiting -= 1
+            victim[3].set_exception(self._reject(model, q, "preempted"))
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(q.heap, (time.monotonic() + level * self.aging, next(self._seq), level, fut))
+        q.waiting += 1
+        OLLAMA_QUEUE_DEPTH.labels(model).set(q.waiting)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(fut, self.max_wait.get(level, self.max_wait[PRIORITY_BATCH]))
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                return self._granted(model, name, t0)
+            self._gave_up(model, q)
+            raise self._reject(model, q, "wait_timeout") from None
+        except Saturated:
+            raise  # 더 높은 우선순위 요청에 자리를 뺏김 (waiting은 뺏은 쪽에서 줄임)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # slot을 받은 순간 취소됨 (클라이언트 연결 끊김) --> 바로 반납
+                self._release(model, 0.0, measured=False)
+            else:
+                self._gave_up(model, q)
+            raise
+        return self._granted(model, name, t0)
+
+    def _granted(self, model: str, name: str, t0: float) -> Lease:
+        OLLAMA_QUEUE_WAIT.labels(model, name).observe(time.perf_counter() - t0)
+        return Lease(self, model)
+
+    def _gave_up(self, model: str, q: _ModelQueue) -> None:
+        # heap에 남은 future는 취소된 상태 --> 다음 _release에서 건너뜀
+        q.waiting -= 1
+        OLLAMA_QUEUE_DEPTH.labels(model).set(q.waiting)
+
+    def slot(self, model: str, level: Optional[int] = None) -> "_SlotContext":
+        return _SlotContext(self, model, level)
+
+    def _release(self, model: str, held: float, measured: bool = True) -> None:
+        q = self._queue(model)
+        if measured:
+            q.avg_seconds = 0.8 * q.avg_seconds + 0.2 * held
+        q.active -= 1
+        self.active -= 1
+        OLLAMA_SLOTS_IN_USE.labels(model).set(q.active)
+        self._dispatch()
+
+    # 빈 slot을 기다리는 요청에게 나눠줌 : 모델 slot이 빈 대기열들의 맨 앞 중 순서 값이 가장 작은 것부터
+    # (total_slots가 있으면 모든 모델의 대기열이 하나의 순서로 경쟁)
+    def _dispatch(self) -> None:
+        while self.total_slots is None or self.active < self.total_slots:
+            best: Optional[tuple] = None
+            for model, q in self._queues.items():
+                # 취소/거절된 요청은 건너뜀
+                while q.heap and q.heap[0][3].done():
+                    heapq.heappop(q.heap)
+                if q.heap and q.active < q.slots and (best is None or q.heap[0][:2] < best[1].heap[0][:2]):
+                    best = (model, q)
+            if best is None:
+                return
+            model, q = best
+            fut = heapq.heappop(q.heap)[3]
+            q.waiting -= 1
+            OLLAMA_QUEUE_DEPTH.labels(model).set(q.waiting)
+            self._start(model, q)
+            fut.set_result(None)
+
+    ###############
+    # 상태 (/health)
+    def saturated(self) -> bool:
+        return any(q.waiting > 0 for q in self._queues.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_queue": self.max_queue,
+            "total_slots": self.total_slots,
+            "active": self.active,
+            "rejected": self.rejected,
+            "models": {
+                model: {"slots": q.slots, "active": q.active, "waiting": q.waiting,
+                        "avg_seconds": round(q.avg_seconds, 3), "retry_after": self._retry_after(q)}
+                for model, q in self._queues.items()
+            },
+        }
+
+    ###############
+    # FastAPI 연결 : 경로별 우선순위 미들웨어 + Saturated --> 429 + Retry-After
+    def install(self, app: FastAPI, route_priority: Optional[Dict[str, int]] = None,
+                default: int = PRIORITY_INTERACTIVE) -> None:
+        route_priority = dict(route_priority or {})
+
+        @app.on_event("startup")
+        async def _bind_loop() -> None:
+            self.loop = asyncio.get_running_loop()
+
+        @app.middleware("http")
+        async def _ollama_priority(request: Request, call_next):
+            with priority(route_priority.get(request.url.path, default)):
+                return await call_next(request)
+
+        @app.exception_handler(Saturated)
+        async def _saturated(request: Request, exc: Saturated):
+            return JSONResponse(status_code=429, content={"detail": str(exc)},
+                                headers={"Retry-After": str(exc.retry_after)})
+
+
+class _SlotContext:
+    def __init__(self, scheduler: GenerationScheduler, model: str, level: Optional[int]):
+        self._scheduler = scheduler
+        self._model = model
+        self._level = level
+        self._lease: Optional[Lease] = None
+
+    async def __aenter__(self) -> Lease:
+        self._lease = await self._scheduler.acquire(self._model, self._level)
+        return self._lease
+
+    async def __aexit__(self, *exc) -> None:
+        if self._lease is not None:
+            self._lease.release()
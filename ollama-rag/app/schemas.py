@@ -4,7 +4,7 @@ from __future__ import annotations
 #   파이썬 버전에 따라 타입 관련 오류를 줄이는 데 도움이 됩니다.
 #   지금 코드에서는 "호환성/안정성" 목적에 가깝습니다.
 
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 # ↑ List: 여러 개의 값을 담는 리스트 타입 힌트 (예: List[str])
 #   Optional: 값이 있을 수도/없을 수도 있음 (예: Optional[str]는 str 또는 None)
 
@@ -78,6 +78,18 @@ class AskRequest(BaseModel):
     # - top_k가 작으면 빠르지만, 근거가 부족할 수 있음
     top_k: int = 10
 
+    # source / filename : 이 문서(들)에서만 검색 (적재할 때 넣은 메타데이터와 같은 값)
+    # 예) {"question": "Google 환불 규정은?", "source": "pdf", "filename": "약관.pdf"}
+    source: Optional[str] = None
+    filename: Optional[str] = None
+
+    # where : 그 외 메타데이터 조건 (크로마 where 문법)
+    # 예) {"page": {"$lte": 10}}, {"source": {"$in": ["pdf", "manual"]}}
+    where: Optional[Dict[str, Any]] = None
+
+    # use_cache : 비슷한 질문의 답이 의미 캐시(redis)에 있으면 그 답을 돌려줌 (False면 항상 새로 생성)
+    use_cache: bool = True
+
 
 # =========================================================
 # 4) /ask 응답(JSON) 형태를 정의
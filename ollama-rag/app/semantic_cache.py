@@ -0,0 +1,241 @@
+# semantic_cache.py
+# 의미(semantic) 답변 캐시 : 비슷한 질문(바꿔 말한 질문)이면 gemma3로 다시 생성하지 않고 저장해둔 답을 돌려줌
+#
+# - 질문을 임베딩해서 저장해둔 질문들과 코사인 유사도를 비교 --> threshold 이상이면 hit
+# - 범위(scope) : 모델 + 컬렉션 버전 (+ top_k, where 등) 별로 따로 저장
+#   문서를 새로 적재/삭제하면 컬렉션 버전이 바뀌므로 예전 답은 자동으로 안 쓰임
+# - redis에 저장 (app.state.redis 같이 씀) --> 서버를 재시작해도, uvicorn worker가 여러 개여도 같이 씀
+#     {prefix}:{scope}:e:{id}  : 질문 + 답 (json), ttl초 뒤 만료
+#     {prefix}:{scope}:vec     : id -> 질문 벡터 (float16, base64)
+#     {prefix}:{scope}:lru     : id -> 마지막으로 쓴 시각 (zset) --> 범위마다 max_entries개를 넘으면 오래 안 쓴 것부터 지움
+#     {prefix}:{scope}:gen     : 바뀔 때마다 1 증가 --> 프로세스마다 들고 있는 벡터 행렬을 그때만 다시 읽음
+#     {prefix}:stats           : hits / misses / stores / evictions (모든 worker 합계)
+# - redis가 안 되거나 질문 임베딩이 실패하면 캐시 없이 동작 (에러를 내지 않고 miss로 처리)
+#
+# RediSearch(Redis Stack)의 벡터 색인 없이 일반 redis + numpy로 계산 (범위마다 수천 개 정도면 1ms 안팎)
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from redis.exceptions import RedisError
+
+from metrics import redis_call
+
+EmbedFn = Callable[[str], Awaitable[List[float]]]
+
+
+def _text(v: Any) -> str:
+    return v.decode("utf-8") if isinstance(v, bytes) else v
+
+
+class SemanticCache:
+    def __init__(self, redis, embed: EmbedFn, threshold: float = 0.92, ttl: int = 24 * 3600,
+                 max_entries: int = 5000, prefix: str = "semcache"):
+        """
+        redis : redis.asyncio.Redis (decode_responses는 True/False 둘 다 됨)
+        embed : 질문 --> 벡터 (예: AsyncChromaRAG.aembed)
+        threshold : 이 값 이상으로 비슷해야 같은 질문으로 봄 (코사인 유사도, 1.0이면 완전히 같은 방향)
+        """
+        self.redis = redis
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = max(1, int(ttl))
+        self.max_entries = max(1, max_entries)
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        # scope -> {"gen", "ids", "rows"(id -> 벡터), "matrix"}
+        self._mirror: Dict[str, Dict[str, Any]] = {}
+
+    ###############
+    # 범위 : 같은 범위 안에서만 답을 재사용
+    # 예) SemanticCache.scope(kind="ask", model="gemma3:1b", version="12:ab34cd56", top_k=4)
+    @staticmethod
+    def scope(**parts: Any) -> str:
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _key(self, scope: str, name: str) -> str:
+        return f"{self.prefix}:{scope}:{name}"
+
+    @staticmethod
+    def make_id(question: str) -> str:
+        return hashlib.sha1(" ".join(question.split()).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _normalize(vec: List[float]) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm > 0 else v
+
+    ###############
+    # 찾기 / 저장
+    async def get(self, question: str, scope: str) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """
+        리턴 : (저장된 값 + "cache" 정보 또는 None, 질문 벡터)
+        질문 벡터는 miss일 때 put(..., emb=)에 넘기면 임베딩을 다시 안 함. (임베딩이 실패하면 None)
+        """
+        emb = await self._embed(question)
+        if emb is None:
+            return None, None
+        try:
+            with redis_call("semcache_get"):
+                found = await self._lookup(scope, emb)
+        except (RedisError, OSError) as e:
+            self.errors += 1
+            print(f"semantic cache 조회 실패 : {e}")
+            return None, emb
+        if found is None:
+            self.misses += 1
+            await self._count("misses")
+            return None, emb
+        self.hits += 1
+        await self._count("hits")
+        return found, emb
+
+    # 임베딩 실패(ollama 연결 안 됨, 타임아웃 등)도 캐시 문제로 요청이 실패하지 않게 miss로 처리
+    async def _embed(self, question: str) -> Optional[np.ndarray]:
+        try:
+            return self._normalize(await self.embed(question))
+        except Exception as e:
+            self.errors += 1
+            print(f"semantic cache 임베딩 실패 : {e}")
+            return None
+
+    async def _lookup(self, scope: str, emb: np.ndarray) -> Optional[Dict[str, Any]]:
+        mirror = await self._vectors(scope)
+        if not mirror["ids"] or mirror["matrix"].shape[1] != emb.shape[0]:
+            return None
+        sims = mirror["matrix"] @ emb
+        best = int(np.argmax(sims))
+        if float(sims[best]) < self.threshold:
+            return None
+        _id = mirror["ids"][best]
+        raw = await self.redis.get(self._key(scope, f"e:{_id}"))
+        if raw is None:
+            # 답은 ttl로 만료됐는데 벡터만 남아 있음 --> 정리
+            await self._forget(scope, [_id])
+            return None
+        await self.redis.zadd(self._key(scope, "lru"), {_id: time.time()})
+        entry = json.loads(raw)
+        return {**entry["value"], "cache": {"hit": True, "similarity": round(float(sims[best]), 4),
+                                            "question": entry["question"],
+                                            "age_s": round(time.time() - entry["created"], 1)}}
+
+    async def put(self, question: str, scope: str, value: Dict[str, Any],
+                  emb: Optional[np.ndarray] = None) -> None:
+        if emb is None:
+            emb = await self._embed(question)
+            if emb is None:
+                return
+        _id = self.make_id(question)
+        now = time.time()
+        entry = json.dumps({"question": question, "value": value, "created": now}, ensure_ascii=False)
+        vec = base64.b64encode(emb.astype(np.float16).tobytes()).decode("ascii")
+        try:
+            with redis_call("semcache_put"):
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.set(self._key(scope, f"e:{_id}"), entry, ex=self.ttl)
+                pipe.hset(self._key(scope, "vec"), _id, vec)
+                pipe.zadd(self._key(scope, "lru"), {_id: now})
+                pipe.incr(self._key(scope, "gen"))
+                # 안 쓰는 범위(예전 컬렉션 버전)는 통째로 만료되게
+                for name in ("vec", "lru", "gen"):
+                    pipe.expire(self._key(scope, name), self.ttl)
+                pipe.hincrby(self._stats_key, "stores", 1)
+                await pipe.execute()
+                await self._evict(scope, now)
+        except (RedisError, OSError) as e:
+            self.errors += 1
+            print(f"semantic cache 저장 실패 : {e}")
+
+    # ttl이 지난 것 + max_entries를 넘은 것(오래 안 쓴 것부터) 지우기
+    async def _evict(self, scope: str, now: float) -> None:
+        lru = self._key(scope, "lru")
+        stale = await self.redis.zrangebyscore(lru, 0, now - self.ttl)
+        over = await self.redis.zcard(lru) - len(stale) - self.max_entries
+        if over > 0:
+            stale = list(stale) + list(await self.redis.zrange(lru, len(stale), len(stale) + over - 1))
+        if stale:
+            await self._forget(scope, [_text(s) for s in stale])
+
+    async def _forget(self, scope: str, ids: List[str]) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(self._key(scope, "lru"), *ids)
+        pipe.hdel(self._key(scope, "vec"), *ids)
+        pipe.delete(*[self._key(scope, f"e:{_id}") for _id in ids])
+        pipe.incr(self._key(scope, "gen"))
+        pipe.hincrby(self._stats_key, "evictions", len(ids))
+        await pipe.execute()
+
+    ###############
+    # 범위의 벡터 행렬 : gen이 바뀌었을 때만 redis에서 다시 읽음 (새로 생긴 id의 벡터만 가져옴)
+    async def _vectors(self, scope: str) -> Dict[str, Any]:
+        gen = await self.redis.get(self._key(scope, "gen"))
+        mirror = self._mirror.get(scope)
+        if mirror is not None and mirror["gen"] == gen:
+            return mirror
+        vec_key = self._key(scope, "vec")
+        ids = [_text(i) for i in await self.redis.hkeys(vec_key)]
+        old = mirror["rows"] if mirror is not None else {}
+        new_ids = [i for i in ids if i not in old]
+        rows = {i: old[i] for i in ids if i in old}
+        if new_ids:
+            for i, raw in zip(new_ids, await self.redis.hmget(vec_key, new_ids)):
+                if raw is not None:
+                    rows[i] = np.frombuffer(base64.b64decode(raw), dtype=np.float16).astype(np.float32)
+        ids = list(rows)
+        matrix = np.stack([rows[i] for i in ids]) if ids else np.zeros((0, 0), dtype=np.float32)
+        mirror = {"gen": gen, "ids": ids, "rows": rows, "matrix": matrix}
+        self._mirror[scope] = mirror
+        # 예전 범위(컬렉션 버전이 바뀐 것)의 행렬은 메모리에서 버림
+        if len(self._mirror) > 64:
+            for old_scope in list(self._mirror)[:-64]:
+                del self._mirror[old_scope]
+        return mirror
+
+    ###############
+    # 상태
+    @property
+    def _stats_key(self) -> str:
+        return f"{self.prefix}:stats"
+
+    async def _count(self, field: str) -> None:
+        try:
+            await self.redis.hincrby(self._stats_key, field, 1)
+        except (RedisError, OSError):
+            pass
+
+    async def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        out: Dict[str, Any] = {
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+        try:
+            shared = {_text(k): int(v) for k, v in (await self.redis.hgetall(self._stats_key)).items()}
+        except (RedisError, OSError):
+            return out
+        shared_total = shared.get("hits", 0) + shared.get("misses", 0)
+        out["all_workers"] = {**shared, "hit_rate": round(shared.get("hits", 0) / shared_total, 4)
+                              if shared_total else 0.0}
+        return out
+
+    async def clear(self) -> int:
+        keys = [k async for k in self.redis.scan_iter(match=f"{self.prefix}:*", count=1000)]
+        if keys:
+            await self.redis.delete(*keys)
+        self._mirror.clear()
+        self.hits = self.misses = self.errors = 0
+        return len(keys)
@@ -0,0 +1,63 @@
+# single_flight.py
+# (ollama-rag/app, ollama-test/app에 똑같은 파일이 있음. app 폴더를 하나씩 따로 배포하므로 복사본을 둠
+#  --> 고칠 때는 둘 다 같이 고칠 것. ollama-rag/tests/test_vendored.py가 확인함)
+# 같은 요청 합치기 (single-flight) : 같은 키로 동시에 들어온 요청은 ollama 생성 1번의 결과를 같이 받음
+# - 예) 같은 기사를 여러 사용자가 동시에 /translate --> 첫 요청만 ollama를 호출, 나머지는 그 결과를 기다림
+# - 키 : (모델, 완성된 프롬프트, options 등) --> SingleFlight.key(...)
+# - 한 프로세스(uvicorn worker) 안에서만 합침. 끝난 결과를 저장해두는 것은 ResultCache(result_cache.py)
+# - 먼저 온 요청이 취소되어도(클라이언트 연결 끊김) 생성은 계속 --> 기다리던 다른 요청은 결과를 받음
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        # key -> 진행 중인 생성 (task)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0  # 실제로 실행한 횟수
+        self.shared = 0  # 진행 중인 것을 같이 기다린 횟수
+
+    @staticmethod
+    def key(**parts: Any) -> str:
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        리턴 : (결과, 다른 요청의 결과를 같이 받았으면 True)
+        fn이 에러를 내면 기다리던 요청 모두 같은 에러를 받음 (에러는 저장하지 않으므로 다음 요청은 다시 실행)
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task), True
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        self.calls += 1
+        return await asyncio.shield(task), False
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 기다리던 요청이 모두 취소된 뒤에 에러가 나도 "never retrieved" 경고가 안 나게
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.calls + self.shared
+        return {
+            "inflight": len(self._inflight),
+            "calls": self.calls,
+            "shared": self.shared,
+            "shared_rate": round(self.shared / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,188 @@
+# snapshot.py
+# 컬렉션 스냅샷 : 청크 id, 본문, 메타데이터, 벡터를 Parquet(또는 Arrow IPC) 파일 하나로 내보내고/가져오기
+#
+# chroma_data/ 폴더(sqlite + HNSW 파일)를 통째로 복사하거나, PDF부터 다시 적재(임베딩 다시 계산)하는 대신
+#   서버 A : python snapshot.py export --out rag_docs.parquet
+#   서버 B : python snapshot.py import --path rag_docs.parquet
+# --> 임베딩 호출 없이 파일 읽기 + 큰 묶음 add만 하므로 몇 초~몇 분.
+#
+# - 열(column) : id, document, metadata(json 문자열), embedding(float32 고정 길이 리스트)
+# - 파일 메타데이터 : 임베딩 모델, 차원, 청크 수, 컬렉션 이름, 만든 시각
+# - 내보내기/가져오기 모두 batch_size개씩 나눠서 처리 --> 청크가 많아도 메모리는 한 묶음만큼만 씀
+# - 확장자가 .parquet이면 Parquet(zstd 압축), .arrow / .feather / .ipc이면 Arrow IPC 파일
+# - pyarrow가 필요함 (pip install pyarrow)
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+SNAPSHOT_FORMAT = 1
+_ARROW_SUFFIXES = ('.arrow', '.feather', '.ipc')
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("스냅샷을 쓰려면 pyarrow가 필요합니다 (pip install pyarrow)") from e
+    return pa, pq
+
+
+def _is_arrow(path: str) -> bool:
+    return path.lower().endswith(_ARROW_SUFFIXES)
+
+
+def _schema(pa, dim: int, meta: Dict[str, Any]):
+    return pa.schema([
+        pa.field("id", pa.string(), nullable=False),
+        pa.field("document", pa.large_string()),
+        pa.field("metadata", pa.string()),
+        pa.field("embedding", pa.list_(pa.float32(), dim)),
+    ], metadata={b"ollama_rag": json.dumps(meta, ensure_ascii=False).encode("utf-8")})
+
+
+def export_collection(rag, path: str, batch_size: int = 5000) -> Dict[str, Any]:
+    """
+    rag(ChromaRAG)의 컬렉션 전체를 path에 씁니다.
+    리턴 : {"path", "chunks", "dim", "seconds"}
+    """
+    pa, pq = _pyarrow()
+    t0 = time.perf_counter()
+    writer = None
+    n = 0
+    dim = 0
+    try:
+        for got in rag._iter_collection(["documents", "metadatas", "embeddings"], batch_size):
+            embs = np.asarray(got["embeddings"], dtype=np.float32)
+            if writer is None:
+                dim = embs.shape[1]
+                schema = _schema(pa, dim, {
+                    "format": SNAPSHOT_FORMAT,
+                    "collection": rag.collection_name,
+                    "embed_model": rag.embed_model,
+                    "dim": dim,
+                    "chunks": rag.count(),
+                    "created_at": time.time(),
+                })
+                if _is_arrow(path):
+                    writer = pa.ipc.new_file(path, schema)
+                else:
+                    writer = pq.ParquetWriter(path, schema, compression="zstd")
+            metas = got["metadatas"] or [None] * len(got["ids"])
+            batch = pa.record_batch([
+                pa.array(got["ids"], pa.string()),
+                pa.array(got["documents"], pa.large_string()),
+                pa.array([json.dumps(m, ensure_ascii=False) if m is not None else None for m in metas], pa.string()),
+                pa.FixedSizeListArray.from_arrays(pa.array(embs.reshape(-1), pa.float32()), dim),
+            ], schema=schema)
+            # Parquet은 묶음 하나가 row group 하나 --> 가져올 때도 묶음 단위로 읽음
+            writer.write_batch(batch)
+            n += len(got["ids"])
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("컬렉션이 비어 있습니다")
+    return {"path": path, "chunks": n, "dim": dim, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def read_snapshot_info(path: str) -> Dict[str, Any]:
+    pa, pq = _pyarrow()
+    if _is_arrow(path):
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    else:
+        schema = pq.read_schema(path)
+    raw = (schema.metadata or {}).get(b"ollama_rag")
+    if raw is None:
+        raise ValueError(f"스냅샷 파일이 아닙니다: {path}")
+    return json.loads(raw)
+
+
+def _iter_batches(path: str, batch_size: int) -> Iterator[Any]:
+    pa, pq = _pyarrow()
+    if _is_arrow(path):
+        # mmap으로 열어서 묶음(record batch)을 복사 없이 하나씩
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for s in range(0, batch.num_rows, batch_size):
+                    yield batch.slice(s, batch_size)
+    else:
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+
+
+def import_collection(rag, path: str, batch_size: int = 5000, overwrite: bool = False,
+                      check_model: bool = True) -> Dict[str, Any]:
+    """
+    path의 스냅샷을 rag(ChromaRAG)의 컬렉션에 넣습니다. (임베딩 계산 없음)
+    - 컬렉션이 비어 있어야 함. overwrite=True면 기존 청크를 먼저 모두 지움.
+    - check_model : 스냅샷의 임베딩 모델이 rag.embed_model과 다르면 에러 (질문 벡터와 맞지 않으므로)
+    리턴 : {"path", "chunks", "dim", "seconds"}
+    """
+    info = read_snapshot_info(path)
+    if check_model and info.get("embed_model") != rag.embed_model:
+        raise ValueError(f"임베딩 모델이 다릅니다: 스냅샷 {info.get('embed_model')}, 현재 {rag.embed_model}")
+    if rag.count() > 0:
+        if not overwrite:
+            raise ValueError("컬렉션이 비어 있지 않습니다 (overwrite=True로 기존 청크를 지우고 가져오기)")
+        ids = [_id for got in rag._iter_collection([], batch_size) for _id in got["ids"]]
+        for s in range(0, len(ids), batch_size):
+            rag._delete_chunks(ids[s:s + batch_size])
+
+    # 크로마는 한 번에 넣을 수 있는 개수 제한이 있음 (sqlite 변수 개수)
+    if rag.client is not None and hasattr(rag.client, "get_max_batch_size"):
+        batch_size = min(batch_size, rag.client.get_max_batch_size())
+
+    t0 = time.perf_counter()
+    n = 0
+    for batch in _iter_batches(path, batch_size):
+        ids: List[str] = batch.column("id").to_pylist()
+        docs: List[Optional[str]] = batch.column("document").to_pylist()
+        metas = [json.loads(m) if m is not None else None for m in batch.column("metadata").to_pylist()]
+        # 고정 길이 리스트 --> (행 수 x 차원) 행렬 (flatten은 slice된 묶음도 그 부분만 꺼냄)
+        embs = batch.column("embedding").flatten().to_numpy(zero_copy_only=False).reshape(len(ids), -1)
+        rag._write_chunks(ids=ids, docs=docs, embeddings=embs.tolist(), metadatas=metas)
+        n += len(ids)
+    return {"path": path, "chunks": n, "dim": info.get("dim"), "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def main():
+    from chroma_db import ChromaRAG
+    from vector_store import VECTOR_STORES
+
+    parser = argparse.ArgumentParser(description="Export / import a collection snapshot (Parquet or Arrow)")
+    parser.add_argument("command", choices=["export", "import", "info"])
+    parser.add_argument("--path", "--out", dest="path", required=True, help="Snapshot file (.parquet or .arrow)")
+    parser.add_argument("--chroma_dir", default="./chroma_data", help="Chroma persist directory")
+    parser.add_argument("--collection", default="rag_docs", help="Chroma collection name")
+    parser.add_argument("--embed_model", default="nomic-embed-text", help="Ollama embedding model")
+    parser.add_argument("--vector_store", default="chroma", choices=list(VECTOR_STORES), help="Vector store backend")
+    parser.add_argument("--batch_size", type=int, default=5000, help="Rows per batch (read / write)")
+    parser.add_argument("--overwrite", action="store_true", help="import: delete existing chunks first")
+    parser.add_argument("--ignore_model", action="store_true", help="import: skip the embedding model check")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(json.dumps(read_snapshot_info(args.path), ensure_ascii=False, indent=2))
+        return
+
+    rag = ChromaRAG(chroma_dir=args.chroma_dir, collection_name=args.collection, embed_model=args.embed_model,
+                    vector_store=args.vector_store)
+    if args.command == "export":
+        result = export_collection(rag, args.path, batch_size=args.batch_size)
+    else:
+        result = import_collection(rag, args.path, batch_size=args.batch_size, overwrite=args.overwrite,
+                                   check_model=not args.ignore_model)
+    print(f"{args.command}: {result['chunks']:,} chunks (dim {result['dim']}) in {result['seconds']}s "
+          f"({result['chunks'] / max(result['seconds'], 1e-9):,.0f} chunks/s) --> {result['path']}")
+
+
+if __name__ == "__main__":
+    main()
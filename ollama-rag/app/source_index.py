@@ -0,0 +1,110 @@
+# source_index.py
+# 문서(source + filename)별 청크 개수 색인
+#
+# /sources 목록을 만들려고 컬렉션 전체를 get()해서 세면 청크가 많을수록 느려짐.
+# 그래서 컬렉션에 쓸 때마다(ChromaRAG._write_chunks / _delete_chunks) 여기도 같이 갱신해 둠.
+#   chunks : 청크 id --> (source, filename)   (다시 넣거나 지울 때 어느 문서였는지 알아야 해서)
+#   counts : (source, filename) --> 청크 개수   (목록은 이 작은 테이블만 읽음)
+# 저장 : sqlite (chroma_data/rag_docs.sources.sqlite3), 다른 프로세스가 써도 바로 보임.
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class SourceIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id TEXT PRIMARY KEY,"
+            " source TEXT NOT NULL,"
+            " filename TEXT NOT NULL)"  # filename이 없으면 ''
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counts ("
+            " source TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " chunks INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (source, filename))"
+        )
+        self._conn.commit()
+
+    ###############
+    # 추가 / 삭제 (같은 id가 이미 있으면 예전 문서에서 빼고 새 문서에 더함)
+    def add(self, ids: List[str], metadatas: List[Optional[Dict[str, Any]]]) -> None:
+        rows = {_id: (str((m or {}).get("source") or ""), str((m or {}).get("filename") or ""))
+                for _id, m in zip(ids, metadatas)}
+        if not rows:
+            return
+        with self._lock, self._conn:
+            delta: Dict[Tuple[str, str], int] = {}
+            for _id, doc in self._docs_of(list(rows)).items():
+                delta[doc] = delta.get(doc, 0) - 1
+            for doc in rows.values():
+                delta[doc] = delta.get(doc, 0) + 1
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (id, source, filename) VALUES (?, ?, ?)",
+                                   [(_id, s, f) for _id, (s, f) in rows.items()])
+            self._apply(delta)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            old = self._docs_of(list(ids))
+            if not old:
+                return
+            delta: Dict[Tuple[str, str], int] = {}
+            for doc in old.values():
+                delta[doc] = delta.get(doc, 0) - 1
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(_id,) for _id in old])
+            self._apply(delta)
+
+    def _docs_of(self, ids: List[str]) -> Dict[str, Tuple[str, str]]:
+        out: Dict[str, Tuple[str, str]] = {}
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            q = "SELECT id, source, filename FROM chunks WHERE id IN (%s)" % ",".join("?" * len(part))
+            for _id, source, filename in self._conn.execute(q, part):
+                out[_id] = (source, filename)
+        return out
+
+    def _apply(self, delta: Dict[Tuple[str, str], int]) -> None:
+        now = time.time()
+        changed = [(s, f, d, now) for (s, f), d in delta.items() if d]
+        self._conn.executemany(
+            "INSERT INTO counts (source, filename, chunks, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (source, filename) DO UPDATE"
+            " SET chunks = chunks + excluded.chunks, updated_at = excluded.updated_at",
+            changed,
+        )
+        self._conn.execute("DELETE FROM counts WHERE chunks <= 0")
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM counts")
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(chunks), 0) FROM counts").fetchone()[0]
+
+    ###############
+    # 목록 : [{"source", "filename", "chunks", "updated_at"}] (source, filename 순)
+    def list(self, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT source, filename, chunks, updated_at FROM counts"
+        params: Tuple[Any, ...] = ()
+        if source is not None:
+            sql += " WHERE source = ?"
+            params = (source,)
+        sql += " ORDER BY source, filename"
+        return [{"source": s, "filename": f or None, "chunks": n, "updated_at": t}
+                for s, f, n, t in self._conn.execute(sql, params)]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,45 @@
+# vector_store.py
+# ChromaRAG가 벡터를 저장/검색하는 곳(backend)을 바꿀 수 있게 하는 부분
+#
+# ChromaRAG는 self.collection의 아래 함수들만 씀 --> 이 함수들만 있으면 어떤 저장소든 끼울 수 있음.
+#   - 'chroma' : 크로마 PersistentClient의 collection (sqlite + HNSW, 근사 검색)
+#   - 'flat'   : flat_store.FlatVectorStore (mmap한 float16/int8 행렬, 정확한 검색, 바로 시작)
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+VECTOR_STORES = ('chroma', 'flat')
+
+
+class VectorStore(Protocol):
+    def count(self) -> int: ...
+
+    def upsert(self, ids: List[str], embeddings: Sequence[Sequence[float]],
+               documents: Optional[List[str]] = None, metadatas: Optional[List[Dict[str, Any]]] = None) -> None: ...
+
+    def update(self, ids: List[str], metadatas: Optional[List[Dict[str, Any]]] = None) -> None: ...
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> None: ...
+
+    # 리턴 : {"ids": [...], "documents": [...] 또는 None, "metadatas": [...] 또는 None}
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ...) -> Dict[str, Any]: ...
+
+    # 리턴 : {"ids": [[...]], "documents": [[...]], "metadatas": [[...]], "distances": [[...]]}  (질문마다 리스트)
+    def query(self, query_embeddings: Sequence[Sequence[float]], n_results: int = 10,
+              where: Optional[Dict[str, Any]] = None, include: Sequence[str] = ...) -> Dict[str, Any]: ...
+
+
+# --> (client, collection). flat은 client가 없음(None)
+def open_vector_store(kind: str, chroma_dir: str, collection_name: str,
+                      flat_dtype: str = 'float16') -> Tuple[Any, VectorStore]:
+    if kind == 'chroma':
+        import chromadb  # flat만 쓸 때는 크로마를 import하지 않음 (시작 시간 단축)
+        client = chromadb.PersistentClient(path=chroma_dir)
+        return client, client.get_or_create_collection(name=collection_name)
+    if kind == 'flat':
+        from flat_store import FlatVectorStore
+        return None, FlatVectorStore(os.path.join(chroma_dir, 'flat', collection_name), dtype=flat_dtype)
+    raise ValueError(f"vector_store는 {VECTOR_STORES} 중 하나여야 합니다: {kind}")
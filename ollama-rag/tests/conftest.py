@@ -0,0 +1,6 @@
+# app 폴더의 모듈을 그대로 import 할 수 있게 (uvicorn을 app 폴더에서 실행하는 것과 같게)
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.insert(0, APP_DIR)
@@ -0,0 +1,117 @@
+# chat_history.ChatHistory.page : 대화가 계속 추가되는 중에도 커서(before/after)가 같은 메시지를 가리키는지
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis에서 lua(EVALSHA) 실행
+
+from chat_history import ChatHistory  # noqa: E402
+
+
+def _history(max_messages: int = 1000) -> ChatHistory:
+    redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    return ChatHistory(redis, max_messages=max_messages)
+
+
+async def _writer(history: ChatHistory, start: int, n: int) -> None:
+    for i in range(start, start + n):
+        await history.append("s", [{"role": "user", "content": f"m{i}"}])
+        await asyncio.sleep(0)
+
+
+def _check(page) -> list:
+    # index와 내용이 항상 맞아야 함 (m<index>)
+    for m in page["history"]:
+        assert m["content"] == f"m{m['index']}"
+    return [m["index"] for m in page["history"]]
+
+
+def test_before_cursor_is_stable_while_appending():
+    async def run():
+        history = _history()
+        await _writer(history, 0, 30)
+        first = await history.page("s", limit=5)
+        assert _check(first) == [25, 26, 27, 28, 29]
+
+        async def reader():
+            seen, before = [], first["next_before"]
+            while before is not None:
+                page = await history.page("s", limit=5, before=before)
+                seen = _check(page) + seen
+                before = page["next_before"]
+                await asyncio.sleep(0)
+            return seen
+
+        seen, _ = await asyncio.gather(reader(), _writer(history, 30, 40))
+        assert seen == list(range(25))
+
+    asyncio.run(run())
+
+
+def test_after_cursor_picks_up_new_messages_without_gaps():
+    async def run():
+        history = _history()
+        await _writer(history, 0, 10)
+
+        async def reader():
+            seen, after = [], -1
+            for _ in range(200):
+                page = await history.page("s", limit=4, after=after)
+                got = _check(page)
+                seen += got
+                if got:
+                    after = got[-1]
+                if after == 49:
+                    break
+                await asyncio.sleep(0)
+            return seen
+
+        seen, _ = await asyncio.gather(reader(), _writer(history, 10, 40))
+        assert seen == list(range(50))
+
+    asyncio.run(run())
+
+
+def test_cursor_into_trimmed_messages_returns_what_is_left():
+    async def run():
+        history = _history(max_messages=10)
+        await _writer(history, 0, 10)
+        first = await history.page("s", limit=3)
+        assert _check(first) == [7, 8, 9]
+
+        # 그 사이에 5개가 더 들어와서 0~4는 LTRIM으로 잘려나감 --> 7 이전은 5, 6만 남음
+        await _writer(history, 10, 5)
+        page = await history.page("s", limit=5, before=first["next_before"])
+        assert _check(page) == [5, 6]
+        assert page["oldest_index"] == 5
+        assert page["next_before"] is None
+
+    asyncio.run(run())
+
+
+def test_short_turns_are_summarized_before_ltrim_drops_them():
+    async def run():
+        history = _history(max_messages=10)
+        assert history.keep_recent == 6
+
+        # 요약 = 이전 요약 + 요약할 메시지들을 그대로 이어 붙임 --> 어떤 메시지가 요약에 들어갔는지 확인 가능
+        async def summarize(prompt: str) -> str:
+            return " ".join(w for w in prompt.split() if w.startswith("<"))
+
+        # /chat과 같은 순서 : load --> append(이번 턴) --> schedule_compaction(기록 + 이번 턴)
+        for i in range(30):
+            summary, past = await history.load("s")
+            turn = [{"role": "user", "content": f"<u{i}>"}, {"role": "assistant", "content": f"<a{i}>"}]
+            await history.append("s", turn)
+            history.schedule_compaction("s", summary, past + turn, summarize)
+            await asyncio.gather(*history._tasks)
+
+        summary, past = await history.load("s")
+        assert summary == await history.redis.get(history.summary_key("s"))
+        kept = summary.split() + [m["content"] for m in past]
+        expected = [f"<{r}{i}>" for i in range(30) for r in "ua"]
+        assert kept == expected  # 빠진 것도, 중복도 없음
+        assert len(past) <= history.max_messages
+
+    asyncio.run(run())
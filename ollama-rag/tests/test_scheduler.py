@@ -0,0 +1,154 @@
+# scheduler.GenerationScheduler : 대기열이 꽉 찼을 때 거절 (Saturated --> 429 + Retry-After)
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, GenerationScheduler, Saturated
+
+httpx = pytest.importorskip("httpx")
+
+
+def test_queue_full_rejects_with_retry_after():
+    async def run():
+        scheduler = GenerationScheduler(default_slots=1, max_queue=1)
+        lease = await scheduler.acquire("m")
+        waiter = asyncio.ensure_future(scheduler.acquire("m"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(Saturated) as exc:
+            await scheduler.acquire("m")
+        assert exc.value.reason == "queue_full"
+        assert exc.value.retry_after >= 1
+        with pytest.raises(Saturated):
+            scheduler.check("m")
+        assert scheduler.rejected == 2
+        assert scheduler.stats()["models"]["m"]["waiting"] == 1
+
+        # slot을 반납하면 기다리던 요청이 받음 --> 다시 자리가 생김
+        lease.release()
+        (await waiter).release()
+        scheduler.check("m")
+        model = scheduler.stats()["models"]["m"]
+        assert (model["active"], model["waiting"]) == (0, 0)
+
+    asyncio.run(run())
+
+
+def test_full_queue_preempts_lower_priority_waiter():
+    async def run():
+        scheduler = GenerationScheduler(default_slots=1, max_queue=1)
+        lease = await scheduler.acquire("m", PRIORITY_INTERACTIVE)
+        batch = asyncio.ensure_future(scheduler.acquire("m", PRIORITY_BATCH))
+        await asyncio.sleep(0)
+
+        chat = asyncio.ensure_future(scheduler.acquire("m", PRIORITY_INTERACTIVE))
+        with pytest.raises(Saturated) as exc:
+            await batch
+        assert exc.value.reason == "preempted"
+
+        lease.release()
+        (await chat).release()
+
+    asyncio.run(run())
+
+
+def test_install_turns_queue_full_into_429():
+    async def run():
+        scheduler = GenerationScheduler(default_slots=1, max_queue=1)
+        app = FastAPI()
+        scheduler.install(app)
+        release = asyncio.Event()
+
+        @app.get("/gen")
+        async def gen():
+            async with scheduler.slot("m"):
+                await release.wait()
+            return {"ok": True}
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            running = asyncio.ensure_future(client.get("/gen"))
+            queued = asyncio.ensure_future(client.get("/gen"))
+            for _ in range(500):
+                if scheduler.stats()["models"].get("m", {}).get("waiting") == 1:
+                    break
+                await asyncio.sleep(0.01)
+
+            rejected = await client.get("/gen")
+            assert rejected.status_code == 429
+            assert int(rejected.headers["Retry-After"]) >= 1
+            assert "queue_full" in rejected.json()["detail"]
+
+            release.set()
+            assert [r.status_code for r in await asyncio.gather(running, queued)] == [200, 200]
+
+    asyncio.run(run())
+
+
+def test_shared_budget_hands_free_slot_to_interactive_generation_before_batch_embeddings():
+    async def run():
+        scheduler = GenerationScheduler(slots={"gen": 2, "embed": 2}, total_slots=2)
+        held = [await scheduler.acquire("embed", PRIORITY_BATCH) for _ in range(2)]
+        batch = [asyncio.ensure_future(scheduler.acquire("embed", PRIORITY_BATCH)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        # gen 모델 slot은 비어 있지만 전체 slot(2)을 임베딩이 다 쓰고 있음 --> 기다림
+        chat = asyncio.ensure_future(scheduler.acquire("gen", PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        assert not chat.done()
+        assert scheduler.saturated()
+
+        # 임베딩 하나가 끝나면, 먼저 와서 기다리던 적재 임베딩이 아니라 대화 생성이 slot을 받음
+        held.pop().release()
+        lease = await asyncio.wait_for(chat, 1)
+        assert not any(b.done() for b in batch)
+        assert scheduler.stats()["active"] == 2
+
+        lease.release()
+        held.pop().release()
+        for b in batch:
+            (await b).release()
+        assert scheduler.stats()["active"] == 0
+
+    asyncio.run(run())
+
+
+def test_interactive_generation_under_batch_embedding_load():
+    async def run():
+        scheduler = GenerationScheduler(slots={"gen": 4, "embed": 4}, total_slots=4, max_queue=256)
+        hold = 0.02
+        stop = asyncio.Event()
+        peak = 0
+
+        async def embed_worker():
+            nonlocal peak
+            while not stop.is_set():
+                async with scheduler.slot("embed", PRIORITY_BATCH):
+                    peak = max(peak, scheduler.stats()["active"])
+                    await asyncio.sleep(hold)
+
+        async def chat():
+            t0 = asyncio.get_running_loop().time()
+            async with scheduler.slot("gen", PRIORITY_INTERACTIVE):
+                waited = asyncio.get_running_loop().time() - t0
+                await asyncio.sleep(hold)
+            return waited
+
+        # 적재 임베딩이 전체 slot보다 훨씬 많이 몰려 있는 상태
+        workers = [asyncio.ensure_future(embed_worker()) for _ in range(32)]
+        await asyncio.sleep(0.1)
+        assert scheduler.stats()["models"]["embed"]["waiting"] > 0
+
+        waits = []
+        for _ in range(10):
+            waits += await asyncio.gather(chat(), chat())
+            await asyncio.sleep(hold)
+        stop.set()
+        await asyncio.gather(*workers)
+
+        # 대화는 적재 대기열 뒤에 줄 서지 않고, 임베딩 하나가 끝나는 시간 안에 slot을 받음
+        assert max(waits) < hold * 3
+        assert peak <= 4
+
+    asyncio.run(run())
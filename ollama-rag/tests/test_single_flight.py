@@ -0,0 +1,92 @@
+# single_flight.SingleFlight : 먼저 온 요청(leader)이 에러를 낼 때
+import asyncio
+import gc
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Boom(Exception):
+    pass
+
+
+def test_leader_error_reaches_every_waiter_and_is_not_kept():
+    async def run():
+        flight = SingleFlight()
+        started, release = asyncio.Event(), asyncio.Event()
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            started.set()
+            await release.wait()
+            raise Boom("ollama down")
+
+        leader = asyncio.ensure_future(flight.do("k", failing))
+        await started.wait()
+        followers = [asyncio.ensure_future(flight.do("k", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert len(flight) == 1
+
+        release.set()
+        results = await asyncio.gather(leader, *followers, return_exceptions=True)
+        assert all(isinstance(r, Boom) for r in results)
+        assert calls == 1
+        assert flight.stats()["shared"] == 3
+        assert len(flight) == 0
+
+        # 에러는 저장하지 않음 --> 다음 요청은 다시 실행
+        async def ok():
+            return "fine"
+
+        assert await flight.do("k", ok) == ("fine", False)
+        assert flight.stats()["calls"] == 2
+
+    asyncio.run(run())
+
+
+def test_cancelled_leader_does_not_cancel_the_work():
+    async def run():
+        flight = SingleFlight()
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow():
+            started.set()
+            await release.wait()
+            return 42
+
+        leader = asyncio.ensure_future(flight.do("k", slow))
+        await started.wait()
+        follower = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        release.set()
+        assert await follower == (42, True)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(run())
+
+
+def test_leader_error_after_all_waiters_left_is_retrieved(caplog):
+    async def run():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def failing():
+            started.set()
+            await asyncio.sleep(0.01)
+            raise Boom("late")
+
+        leader = asyncio.ensure_future(flight.do("k", failing))
+        await started.wait()
+        leader.cancel()
+        await asyncio.sleep(0.05)
+        assert len(flight) == 0
+
+    asyncio.run(run())
+    gc.collect()  # 에러를 아무도 안 꺼낸 task는 gc될 때 로그를 남김
+    assert "never retrieved" not in caplog.text
@@ -0,0 +1,17 @@
+# ollama-rag/app과 ollama-test/app에 복사해둔 모듈이 서로 달라지지 않았는지 확인
+import filecmp
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+VENDORED = ["metrics.py", "chat_history.py", "scheduler.py", "single_flight.py", "result_cache.py"]
+
+
+@pytest.mark.parametrize("name", VENDORED)
+def test_vendored_copies_match(name):
+    rag = os.path.join(ROOT, "ollama-rag", "app", name)
+    other = os.path.join(ROOT, "ollama-test", "app", name)
+    if not os.path.exists(other):
+        pytest.skip("ollama-test/app이 없음")
+    assert filecmp.cmp(rag, other, shallow=False), f"{name} : ollama-rag/app과 ollama-test/app의 복사본이 다름"
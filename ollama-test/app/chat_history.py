@@ -0,0 +1,300 @@
+# chat_history.py
+# (ollama-rag/app, ollama-test/app에 똑같은 파일이 있음. app 폴더를 하나씩 따로 배포하므로 복사본을 둠
+#  --> 고칠 때는 둘 다 같이 고칠 것. ollama-rag/tests/test_vendored.py가 확인함)
+# redis 대화 기록 : 길이 제한(LTRIM) + 만료(EXPIRE) + 오래된 대화는 요약(rolling summary)으로 압축
+#
+# 예전 /chat은 chat_history:<id>에 rpush만 해서 리스트가 끝없이 커지고, 기록을 프롬프트에 넣지도 않았음.
+# 여기서는
+#   - load()   : 요약 + 최근 max_messages개를 pipeline 한 번(왕복 1번)으로 읽음
+#   - append() : rpush + ltrim + expire를 pipeline 한 번으로 --> redis 메모리가 세션마다 max_messages개로 제한
+#   - messages() : [요약(system)] + 최근 대화 + 새 질문 --> ollama chat에 넣을 메시지 (token_budget을 넘지 않게 자름)
+#   - 기록이 token_budget을 넘거나, 곧 max_messages에 닿으면(LTRIM으로 잘리기 전에)
+#     keep_recent개만 남기고 앞부분을 요약으로 합침 (백그라운드, 응답을 늦추지 않음)
+#
+#   - page()   : 커서(index) 기반 페이지 (최근 limit개, before/after index) --> 기록이 길어도 한 번에 조금씩
+#   - iter_all() : 처음부터 끝까지 페이지 단위로 (내보내기 스트리밍용)
+#
+# redis 키
+#   chat_history:<id>  : 메시지 리스트 (예전과 같은 키라 기존 기록도 그대로 읽힘)
+#   chat_summary:<id>  : 지금까지 잘라낸 대화의 요약 (문자열)
+#   chat_seq:<id>      : 지금까지 저장한 메시지 수 --> 메시지 index (LTRIM으로 앞이 잘려도 index가 바뀌지 않음)
+#
+# 저장 형식 (encoding)
+#   "json"    : 메시지마다 json 문자열 (기본, 예전 형식)
+#   "msgpack" : b"M" + msgpack, 길면 b"Z" + zlib(msgpack) --> 더 작음. decode_responses=False인 redis 클라이언트 필요
+#   읽을 때는 형식을 보고 알아서 풂 (섞여 있어도 됨)
+from __future__ import annotations
+
+import asyncio
+import json
+import zlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from redis.exceptions import WatchError
+
+from metrics import redis_call
+
+Message = Dict[str, str]
+SummarizeFn = Callable[[str], Awaitable[str]]
+
+ENCODINGS = ("json", "msgpack")
+# 이보다 긴 메시지만 zlib 압축 (짧은 메시지는 압축해도 별로 안 줄어듦)
+_COMPRESS_MIN_BYTES = 256
+
+# 페이지 읽기 (redis 안에서 한 번에 실행 --> 읽는 중에 다른 요청이 append/trim해도 index가 어긋나지 않음)
+# KEYS : history, seq, summary / ARGV : before, after, limit (before/after가 빈 문자열이면 안 씀)
+# 리턴 : {전체 개수(= 다음 index), 남아있는 첫 index, 이 페이지 첫 index, 메시지들, 요약}
+_PAGE_LUA = """
+local len = redis.call('LLEN', KEYS[1])
+local total = tonumber(redis.call('GET', KEYS[2]) or '0')
+if total < len then total = len end
+local head = total - len
+local before, after, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local start, stop
+if after then
+  start = math.max(after + 1, head)
+  stop = math.min(start + limit, total)
+else
+  stop = total
+  if before and before < total then stop = before end
+  start = math.max(stop - limit, head)
+end
+local items = {}
+if stop > start then items = redis.call('LRANGE', KEYS[1], start - head, stop - head - 1) end
+return {total, head, start, items, redis.call('GET', KEYS[3])}
+"""
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError as e:
+        raise RuntimeError("encoding='msgpack'을 쓰려면 msgpack이 필요합니다 (pip install msgpack)") from e
+    return msgpack
+
+
+def encode_message(message: Message, encoding: str = "json") -> Union[str, bytes]:
+    if encoding == "json":
+        return json.dumps(message, ensure_ascii=False)
+    packed = _msgpack().packb(message, use_bin_type=True)
+    if len(packed) >= _COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(packed, 6)
+        if len(compressed) < len(packed):
+            return b"Z" + compressed
+    return b"M" + packed
+
+
+def decode_message(raw: Union[str, bytes]) -> Message:
+    if isinstance(raw, bytes):
+        if raw[:1] == b"Z":
+            return _msgpack().unpackb(zlib.decompress(raw[1:]), raw=False)
+        if raw[:1] == b"M":
+            return _msgpack().unpackb(raw[1:], raw=False)
+    return json.loads(raw)
+
+
+def _text(v: Any) -> Optional[str]:
+    return v.decode("utf-8") if isinstance(v, bytes) else v
+
+
+def estimate_tokens(text: str) -> int:
+    # 한글(ASCII가 아닌 글자) 한 글자 ≈ 토큰 1개, 그 외 4글자 ≈ 토큰 1개 (ollama-rag chunker.py와 같은 계산)
+    n = len(text)
+    wide = (len(text.encode("utf-8")) - n) // 2
+    other = n - wide - text.count(" ") - text.count("\n")
+    return wide + (max(0, other) + 3) // 4
+
+
+def message_tokens(messages: List[Message]) -> int:
+    # 메시지마다 role 등 형식에 토큰 몇 개가 더 들어감
+    return sum(estimate_tokens(m.get("content", "")) + 4 for m in messages)
+
+
+class ChatHistory:
+    def __init__(self, redis, max_messages: int = 40, ttl: int = 7 * 24 * 3600, token_budget: int = 1500,
+                 keep_recent: int = 6, history_prefix: str = "chat_history", summary_prefix: str = "chat_summary",
+                 seq_prefix: str = "chat_seq", encoding: str = "json"):
+        """
+        max_messages : 세션마다 redis에 남기는 최대 메시지 수 (user + assistant 각각 1개)
+        ttl          : 마지막 대화 후 이 시간(초)이 지나면 기록/요약 삭제
+        token_budget : 프롬프트에 넣는 기록(요약 포함)의 최대 토큰 수. 기록이 이보다 길면 요약으로 압축
+        keep_recent  : 압축할 때 요약하지 않고 그대로 남기는 최근 메시지 수
+        encoding     : 새로 저장하는 메시지 형식 ("json" 또는 "msgpack")
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"encoding은 {ENCODINGS} 중 하나여야 합니다: {encoding}")
+        if encoding == "msgpack":
+            _msgpack()
+            if redis.connection_pool.connection_kwargs.get("decode_responses"):
+                raise ValueError("encoding='msgpack'은 decode_responses=False인 redis 클라이언트가 필요합니다")
+        self.redis = redis
+        self.encoding = encoding
+        self.seq_prefix = seq_prefix
+        self._page_script = redis.register_script(_PAGE_LUA)
+        self.max_messages = max(2, max_messages)
+        self.ttl = max(1, int(ttl))
+        self.token_budget = max(1, token_budget)
+        self.keep_recent = max(0, min(keep_recent, self.max_messages))
+        self.history_prefix = history_prefix
+        self.summary_prefix = summary_prefix
+        self._compacting: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def history_key(self, session_id: str) -> str:
+        return f"{self.history_prefix}:{session_id}"
+
+    def summary_key(self, session_id: str) -> str:
+        return f"{self.summary_prefix}:{session_id}"
+
+    def seq_key(self, session_id: str) -> str:
+        return f"{self.seq_prefix}:{session_id}"
+
+    ###############
+    # 읽기 / 쓰기 (각각 redis 왕복 1번)
+    async def load(self, session_id: str) -> Tuple[Optional[str], List[Message]]:
+        with redis_call("pipeline"):
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(self.summary_key(session_id))
+            pipe.lrange(self.history_key(session_id), -self.max_messages, -1)
+            summary, raw = await pipe.execute()
+        return _text(summary), [decode_message(m) for m in raw]
+
+    async def append(self, session_id: str, messages: List[Message]) -> None:
+        if not messages:
+            return
+        key, seq = self.history_key(session_id), self.seq_key(session_id)
+        with redis_call("pipeline"):
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.incrby(seq, len(messages))
+            pipe.rpush(key, *[encode_message(m, self.encoding) for m in messages])
+            pipe.ltrim(key, -self.max_messages, -1)
+            for k in (key, seq, self.summary_key(session_id)):
+                pipe.expire(k, self.ttl)
+            total, length = (await pipe.execute())[:2]
+        if total == len(messages) and length > total:
+            # chat_seq가 생기기 전의 기록 --> 이미 있던 메시지 수만큼 맞춰줌 (세션마다 한 번)
+            await self.redis.incrby(seq, length - total)
+
+    async def clear(self, session_id: str) -> None:
+        with redis_call("delete"):
+            await self.redis.delete(self.history_key(session_id), self.summary_key(session_id),
+                                    self.seq_key(session_id))
+
+    ###############
+    # 페이지 : 최근 limit개 / before index보다 앞(더 오래된) limit개 / after index보다 뒤 limit개
+    # 메시지마다 "index"(0부터, 세션에서 몇 번째 메시지인지)를 붙여서 줌
+    # next_before : 더 오래된 페이지를 읽을 커서 (없으면 None, 앞부분은 summary에 요약되어 있음)
+    # next_after  : 더 최근 페이지를 읽을 커서 (없으면 None)
+    async def page(self, session_id: str, limit: int = 50, before: Optional[int] = None,
+                   after: Optional[int] = None) -> Dict[str, Any]:
+        limit = max(1, limit)
+        keys = [self.history_key(session_id), self.seq_key(session_id), self.summary_key(session_id)]
+        args = ["" if before is None else max(0, before), "" if after is None else max(-1, after), limit]
+        with redis_call("page"):
+            total, head, start, items, summary = await self._page_script(keys=keys, args=args)
+        messages = [{**decode_message(m), "index": start + i} for i, m in enumerate(items)]
+        end = start + len(messages)
+        return {
+            "history": messages,
+            "summary": _text(summary),
+            "total": total,
+            "oldest_index": head,
+            "next_before": start if messages and start > head else None,
+            "next_after": end - 1 if messages and end < total else None,
+        }
+
+    # 처음(남아있는 가장 오래된 메시지)부터 끝까지 batch개씩
+    async def iter_all(self, session_id: str, batch: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        after = -1
+        while True:
+            page = await self.page(session_id, limit=batch, after=after)
+            for m in page["history"]:
+                yield m
+            if page["next_after"] is None:
+                return
+            after = page["next_after"]
+
+    ###############
+    # ollama chat에 넣을 메시지 : [요약] + 최근 대화(token_budget 안에서 최신부터) + 새 메시지
+    def messages(self, summary: Optional[str], history: List[Message], new: Message) -> List[Message]:
+        out: List[Message] = []
+        budget = self.token_budget
+        if summary:
+            out.append({"role": "system", "content": f"지금까지의 대화 요약:\n{summary}"})
+            budget -= message_tokens(out)
+        recent: List[Message] = []
+        for m in reversed(history):
+            budget -= message_tokens([m])
+            if budget < 0:
+                break
+            recent.append(m)
+        return out + recent[::-1] + [new]
+
+    # history : 이번 대화까지 저장된 기록
+    # 짧은 대화가 많으면 토큰은 적어도 개수가 max_messages에 먼저 닿음 --> 그 전에 요약해야 LTRIM으로 그냥 사라지지 않음
+    # (한 턴 = user + assistant 2개가 더 들어와도 잘리지 않게 최소 2개는 여유를 둠)
+    def needs_compaction(self, summary: Optional[str], history: List[Message]) -> bool:
+        if len(history) <= self.keep_recent:
+            return False
+        if len(history) > self.max_messages - max(self.keep_recent, 2):
+            return True
+        total = message_tokens(history) + (estimate_tokens(summary) if summary else 0)
+        return total > self.token_budget
+
+    ###############
+    # 압축 : 최근 keep_recent개를 뺀 앞부분 + 예전 요약 --> 새 요약
+    async def compact(self, session_id: str, summarize: SummarizeFn) -> bool:
+        if session_id in self._compacting:
+            return False
+        self._compacting.add(session_id)
+        try:
+            summary, history = await self.load(session_id)
+            if not self.needs_compaction(summary, history):
+                return False
+            old = history[:len(history) - self.keep_recent]
+            new_summary = (await summarize(self.summary_prompt(summary, old))).strip()
+            if not new_summary:
+                return False
+            return await self._replace_head(session_id, old, new_summary)
+        finally:
+            self._compacting.discard(session_id)
+
+    # 요약하는 동안 다른 요청이 리스트를 바꿨으면(WATCH) 이번 압축은 버림 --> 다음 대화 때 다시 시도
+    async def _replace_head(self, session_id: str, old: List[Message], summary: str) -> bool:
+        key = self.history_key(session_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                head = await pipe.lrange(key, 0, len(old) - 1)
+                if [decode_message(m) for m in head] != old:
+                    return False
+                pipe.multi()
+                pipe.set(self.summary_key(session_id), summary, ex=self.ttl)
+                pipe.ltrim(key, len(old), -1)
+                with redis_call("pipeline"):
+                    await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    @staticmethod
+    def summary_prompt(summary: Optional[str], messages: List[Message]) -> str:
+        lines = [f"{m['role']}: {m['content']}" for m in messages]
+        before = f"이전 요약:\n{summary}\n\n" if summary else ""
+        return (f"{before}다음 대화를 이어서 요약해 주세요. 사용자가 알려준 사실, 요청, 결정된 내용은 빠뜨리지 말고 "
+                f"10문장 이내로 요약만 출력하세요.\n\n" + "\n".join(lines))
+
+    # 응답을 늦추지 않게 백그라운드로 압축 (태스크 참조를 들고 있어야 중간에 GC되지 않음)
+    def schedule_compaction(self, session_id: str, summary: Optional[str], history: List[Message],
+                            summarize: SummarizeFn) -> None:
+        if session_id in self._compacting or not self.needs_compaction(summary, history):
+            return
+        task = asyncio.create_task(self._compact_quietly(session_id, summarize))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _compact_quietly(self, session_id: str, summarize: SummarizeFn) -> None:
+        try:
+            await self.compact(session_id, summarize)
+        except Exception as e:
+            print(f"대화 기록 요약 실패 ({session_id}) : {e}")
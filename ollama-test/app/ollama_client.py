@@ -2,6 +2,8 @@
 from fastapi import HTTPException
 import requests
 
+from metrics import ollama_call, record_ollama_usage
+
 
 # Ollama 기본 설정
 OLLAMA_BASE_URL = "http://localhost:11434"  # Ollama 기본 포트
@@ -36,13 +38,16 @@ def ollama_client(word : str):
             }
         }
 
-        response = requests.post(
-                f"{OLLAMA_BASE_URL}/api/generate",
-                json=payload,
-                timeout=60.0  # 응답 대기 시간
-            )
+        with ollama_call("generate", DEFAULT_MODEL):
+            response = requests.post(
+                    f"{OLLAMA_BASE_URL}/api/generate",
+                    json=payload,
+                    timeout=60.0  # 응답 대기 시간
+                )
         if response.status_code == 200:
             ollama_response = response.json()
+            # 토큰 수, tokens/s --> /metrics
+            record_ollama_usage(DEFAULT_MODEL, ollama_response)
 
         # JSON 응답 구성
         result = {